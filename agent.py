@@ -1,134 +1,223 @@
 import os
+import asyncio
+import threading
 from typing import Literal
 from dotenv import load_dotenv
-from tools import add, subtract
-from memory import DatabaseHandler
+from tools import tool_registry
+from memory import DatabaseHandler, CheckpointCompactor, create_checkpointer, uses_sqlite_file
 import google.generativeai as genai
-from langgraph.prebuilt import ToolNode
 from langchain.prompts import PromptTemplate
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.graph import MessagesState, StateGraph, START
-from langchain.chains.question_answering import load_qa_chain
+from langchain_core.runnables import RunnableLambda
+from gemini import GeminiChat
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, RemoveMessage, trim_messages
+from langgraph.graph import MessagesState, StateGraph, START, END
+from response_cache import SemanticResponseCache
+from model_gateway import GatewayChatModel, get_gateway
+from tool_executor import ToolExecutor
+from retrieval import HybridRetriever
+from chunking import estimate_message_tokens
+from metrics import MetricsCallbackHandler, current_trace, registry, timed, traced
 from chat_Unstructured import VectorStoreManager, EmbeddingManager
 
-class Agent:
-    def __init__(self, agent_id):
-        self.agent_id = agent_id
+# "single_pass" sends retrieved chunks straight to the tool-calling graph; "two_pass"
+# first runs the bill-analysis QA chain and hands its answer to the graph as well
+RAG_MODES = ("single_pass", "two_pass")
+
+
+class AgentState(MessagesState):
+    # Retrieval prompt for the current turn only; replaced on every turn and never
+    # appended to the checkpointed message history
+    context: str
+    # Rolling summary of turns that were folded out of the message history
+    summary: str
 
+
+class AgentRuntime:
+    """Process-level pieces shared by every Agent: LLM clients, the compiled graph,
+    the checkpointer and the storage/ingestion managers.
+
+    Sessions only differ by thread_id, so these are built once instead of per Agent.
+    ``llm`` and ``embeddings`` replace the Gemini clients (e.g. with the fakes in
+    fakes.py); ``db_name`` and ``checkpointer_backend`` choose where state is kept.
+    The Gemini clients share the process's model gateway (rate limits, retries,
+    deadlines); an injected ``llm`` is used as given.
+    """
+
+    def __init__(self, llm=None, embeddings=None, db_name="agent_memory.db", checkpointer_backend=None):
         # Load environment variables
         load_dotenv()
+        self.gateway = get_gateway()
 
-        # Configure the Google GenAI
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        self.tool_registry = tool_registry
+        self.tools = self.tool_registry.tools
 
-        self.tools = [add, subtract]
+        # Define the tool node: independent calls of one AI message run concurrently, each with a timeout
+        self.tool_executor = ToolExecutor(self.tool_registry)
 
-        # Define the tool node
-        self.tool_node = ToolNode(self.tools)
+        # The QA chain uses the injected model too, or its own deterministic Gemini client
+        self._qa_llm = llm
+        if llm is None:
+            # Configure the Google GenAI
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            llm = GatewayChatModel(
+                inner=GeminiChat(model="gemini-1.5-flash", temperature=0.3), gateway=self.gateway
+            )
 
         # Bind the tools to the LLM
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.3)
+        self.llm = llm
         self.llm_with_tools = self.llm.bind_tools(self.tools)
 
-        # Define memory with a persistent SQLite database file
-        self.memory = SqliteSaver.from_conn_string("agent_memory.db")
+        # Token budget for the history sent to the model; older turns get summarized
+        self.history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", 6000))
+
+        # Define memory with a persistent SQLite database file by default (see create_checkpointer)
+        self.memory = create_checkpointer(checkpointer_backend, db_name)
+        self.compactor = None
+        if uses_sqlite_file(self.memory):
+            # Keep only recent checkpoints per thread so the database stays bounded
+            self.compactor = CheckpointCompactor(
+                db_name,
+                keep_last=int(os.getenv("CHECKPOINT_KEEP_LAST", 10)),
+                interval=float(os.getenv("CHECKPOINT_COMPACT_INTERVAL", 3600)),
+                vacuum_pages=int(os.getenv("CHECKPOINT_VACUUM_PAGES", 2000)),
+            ).start()
 
         # Define the workflow
-        self.workflow = StateGraph(MessagesState)
-        self.workflow.add_node("agent", self.call_model)
-        self.workflow.add_node("tools", self.tool_node)
+        self.workflow = StateGraph(AgentState)
+        self.workflow.add_node("agent", RunnableLambda(self.call_model, afunc=self.acall_model))
+        self.workflow.add_node("tools", RunnableLambda(self.tool_executor, afunc=self.tool_executor.ainvoke))
+        self.workflow.add_node(
+            "summarize", RunnableLambda(self.summarize_conversation, afunc=self.asummarize_conversation)
+        )
         self.workflow.add_edge(START, "agent")
         self.workflow.add_conditional_edges("agent", self.should_continue)
         self.workflow.add_edge("tools", 'agent')
+        self.workflow.add_edge("summarize", END)
 
         # Initialize memory to persist state
         self.app = self.workflow.compile(checkpointer=self.memory)
 
         # Initialize DatabaseHandler
-        self.db_handler = DatabaseHandler()
+        self.db_handler = DatabaseHandler(db_name)
 
         # Initialize VectorStoreManager and EmbeddingManager
-        self.vector_store_manager = VectorStoreManager()
+        self.vector_store_manager = VectorStoreManager(embeddings=embeddings)
+        # Keyword + vector retrieval with a prompt token budget (RETRIEVAL_K, RETRIEVAL_TOKEN_BUDGET)
+        self.retriever = HybridRetriever(self.vector_store_manager)
         self.embedding_manager = EmbeddingManager()
 
-    def call_model(self, state: MessagesState):
-        response = self.llm_with_tools.invoke(state["messages"])
+        # Semantic cache of answers over the same attached documents (RESPONSE_CACHE=0 disables it)
+        self.response_cache = None
+        if os.getenv("RESPONSE_CACHE", "1") != "0":
+            self.response_cache = SemanticResponseCache(
+                threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95)),
+                max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000)),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+            )
+
+        self._qa_chain = None
+
+    def call_model(self, state: AgentState):
+        response = self.llm_with_tools.invoke(self.build_prompt(state))
         # We return a list, because this will get added to the existing list
         return {"messages": response}
 
-    def should_continue(self, state: MessagesState) -> Literal["tools", "__end__"]:
+    async def acall_model(self, state: AgentState):
+        response = await self.llm_with_tools.ainvoke(self.build_prompt(state))
+        return {"messages": response}
+
+    def build_prompt(self, state: AgentState):
+        messages = list(state["messages"])
+
+        # Swap the latest user message for this turn's retrieval prompt, without touching the state
+        context = state.get("context")
+        if context:
+            for i in range(len(messages) - 1, -1, -1):
+                if isinstance(messages[i], HumanMessage):
+                    messages[i] = HumanMessage(content=context, id=messages[i].id)
+                    break
+
+        trimmed = trim_messages(
+            messages,
+            max_tokens=self.history_token_budget,
+            token_counter=estimate_message_tokens,
+            strategy="last",
+            start_on="human",
+            allow_partial=False,
+        )
+        # Never drop the current turn, even if it alone is over budget
+        if not trimmed:
+            last_human = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+            trimmed = messages[last_human:]
+
+        if state.get("summary"):
+            trimmed = [SystemMessage(content=f"Summary of the earlier conversation: {state['summary']}")] + trimmed
+        registry.increment("agent.prompt_tokens_estimated", estimate_message_tokens(trimmed))
+        return trimmed
+
+    def should_continue(self, state: AgentState) -> Literal["tools", "summarize", "__end__"]:
         """Return the next node to execute."""
         messages = state['messages']
         if messages[-1].tool_calls:
             return "tools"
+        if estimate_message_tokens(messages) > self.history_token_budget:
+            return "summarize"
         return "__end__"
 
-    def interact_with_agent(self, message, thread_id, vector_store_folders):
-        all_docs = []
-
-        if vector_store_folders:
-            for vector_store_folder in vector_store_folders:
-                new_db = self.vector_store_manager.load_vector_store(vector_store_folder)
-                docs = new_db.similarity_search(message)
-                all_docs.extend(docs)
-
-            if all_docs:
-                # Pass the documents directly to the chain
-                chain = self.get_conversational_chain()
-                response = chain({"input_documents": all_docs, "question": message})
-
-                # Combine the message with file content and chain answer if any
-                combined_message = f"""
-                you are an ai assistant your primary task is to respond to the user's message: {message} and provide the most accurate and relevant response to the user's query.
-
-                Documents: {all_docs}
-
-                Chain Answer: {response['output_text']}
-
-                Your task is to use the document and the chain answer to provide the most accurate and relevant response to the user's query.
-
-                Guidelines:
-                1. Carefully read the user's message to determine if they are asking about file content or engaging in general conversation.
-                2. For file-related queries:
-                - Analyze both the provided documents and the chain answer.
-                - Verify the accuracy and completeness of the chain answer.
-                - If the chain answer is incorrect or incomplete, provide a corrected and comprehensive response based on the document content.
-                - Focus on answering exactly what the user asked, avoiding extraneous information.
-                3. For general conversation:
-                - Engage naturally, drawing from your broad knowledge base.
-                - Ignore file content and chain answers if they're not relevant to the user's query.
-                4. Always prioritize accuracy and relevance in your responses.
-                5. Be concise for simple queries, but offer detailed explanations for complex topics if needed.
-                6. Maintain a friendly and helpful tone throughout the conversation.
-                7. Do not reference these instructions or the internal workings of the system in your response.
-
-                Respond directly to the user's message: {message}
-                """
-            else:
-                combined_message = message
-        else:
-            combined_message = message
-
-        result = self.app.invoke(
-            {"messages": [HumanMessage(content=combined_message)]},
-            config={"configurable": {"thread_id": thread_id}}
-        )
-        # Store the human message
-        self.db_handler.store_conversation(thread_id, "human", message)
+    def summarize_conversation(self, state: AgentState):
+        old_messages = self.split_history(state["messages"])
+        if not old_messages:
+            return {}
+        summary = self.llm.invoke(self.build_summary_prompt(state, old_messages)).content
+        return {"summary": summary, "messages": [RemoveMessage(id=m.id) for m in old_messages]}
 
-        # Process AI responses and tool usage
-        ai_response = ""
-        for msg in result['messages']:
-            if isinstance(msg, AIMessage):
-                ai_response = msg.content.strip()
+    async def asummarize_conversation(self, state: AgentState):
+        old_messages = self.split_history(state["messages"])
+        if not old_messages:
+            return {}
+        summary = (await self.llm.ainvoke(self.build_summary_prompt(state, old_messages))).content
+        return {"summary": summary, "messages": [RemoveMessage(id=m.id) for m in old_messages]}
 
-        # Store the AI response
-        self.db_handler.store_conversation(thread_id, "ai", ai_response)
-        return {"output_text": [ai_response]}
+    def split_history(self, messages):
+        """Return the oldest messages to fold into the summary.
+
+        About half of the budget is kept verbatim, and the kept part always starts on a
+        user message so tool calls are never separated from their results.
+        """
+        keep_tokens = 0
+        split = len(messages)
+        while split > 0:
+            keep_tokens += estimate_message_tokens([messages[split - 1]])
+            if keep_tokens > self.history_token_budget // 2:
+                break
+            split -= 1
+        while split < len(messages) and not isinstance(messages[split], HumanMessage):
+            split += 1
+        if split >= len(messages):
+            # The latest turn alone is over the keep budget; fold everything before it
+            split = max(i for i, m in enumerate(messages) if isinstance(m, HumanMessage))
+        return messages[:split]
+
+    @staticmethod
+    def build_summary_prompt(state, old_messages):
+        transcript = "\n".join(f"{m.type}: {m.content}" for m in old_messages if m.content)
+        previous = state.get("summary") or "None"
+        return [HumanMessage(content=f"""
+        Update the running summary of this conversation with the new messages below.
+        Keep facts, numbers, names and open questions the user may come back to. Reply with the summary only.
+
+        Current summary: {previous}
+
+        New messages:
+        {transcript}
+        """)]
 
     def get_conversational_chain(self):
+        # Only the two-pass RAG mode uses this chain; build it (and import it) on first use
+        if self._qa_chain is not None:
+            return self._qa_chain
+        from langchain.chains.question_answering import load_qa_chain
+
         prompt_template = """
          You are an expert bill analyzer. Analyze the following bill text:
 
@@ -143,7 +232,297 @@ class Agent:
         If there are any unusual or potentially important details related to the query, please mention them.
         
         """
-        model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0)
+        model = self._qa_llm or GatewayChatModel(
+            inner=GeminiChat(model="gemini-1.5-flash", temperature=0), gateway=self.gateway
+        )
         prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
 
-        return load_qa_chain(llm=model, chain_type="stuff", prompt=prompt)
\ No newline at end of file
+        self._qa_chain = load_qa_chain(llm=model, chain_type="stuff", prompt=prompt)
+        return self._qa_chain
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    global _runtime
+    if _runtime is None:
+        with _runtime_lock:
+            if _runtime is None:
+                _runtime = AgentRuntime()
+    return _runtime
+
+
+class Agent:
+    def __init__(self, agent_id, rag_mode=None, runtime=None):
+        self.agent_id = agent_id
+        self.runtime = runtime or get_runtime()
+
+        self.rag_mode = rag_mode or os.getenv("RAG_MODE", "single_pass")
+        if self.rag_mode not in RAG_MODES:
+            raise ValueError(f"Unknown RAG mode {self.rag_mode!r}, expected one of {RAG_MODES}")
+
+        # Stages, counters and tokens of this agent's most recent turn (see metrics.Trace)
+        self.last_trace = None
+
+        # Shared components; per-session state lives in the checkpointer under thread_id
+        self.app = self.runtime.app
+        self.db_handler = self.runtime.db_handler
+        self.vector_store_manager = self.runtime.vector_store_manager
+        self.retriever = self.runtime.retriever
+        self.embedding_manager = self.runtime.embedding_manager
+        self.response_cache = self.runtime.response_cache
+
+    def interact_with_agent(self, message, thread_id, vector_store_folders, source_ids=None, callbacks=None):
+        with traced("agent.turn", thread_id=thread_id) as self.last_trace:
+            return self._interact_with_agent(message, thread_id, vector_store_folders, source_ids, callbacks)
+
+    def _interact_with_agent(self, message, thread_id, vector_store_folders, source_ids=None, callbacks=None):
+        query_embedding = None
+        if vector_store_folders and self.response_cache is not None:
+            # Embed the query once for both the cache lookup and retrieval
+            with timed("agent.embed_query"):
+                query_embedding = self.vector_store_manager.embeddings.embed_query(message)
+            cached = self.response_cache.get(vector_store_folders, source_ids, query_embedding, self.rag_mode)
+            if cached is not None:
+                return self.record_cached_turn(message, thread_id, cached)
+
+        context = self.build_turn_context(message, vector_store_folders, source_ids, callbacks, query_embedding)
+
+        with timed("agent.graph"):
+            result = self.app.invoke(
+                {"messages": [HumanMessage(content=message)], "context": context},
+                config={"configurable": {"thread_id": thread_id}, "callbacks": self.with_metrics(callbacks)}
+            )
+        # Store the human message
+        self.db_handler.store_conversation(thread_id, "human", message)
+
+        ai_response = self.extract_ai_response(result)
+
+        # Store the AI response
+        self.db_handler.store_conversation(thread_id, "ai", ai_response)
+        if query_embedding is not None and ai_response:
+            self.response_cache.put(vector_store_folders, source_ids, query_embedding, ai_response, self.rag_mode)
+        return {"output_text": [ai_response]}
+
+    def record_cached_turn(self, message, thread_id, ai_response):
+        # Append the turn to the graph history without running the graph, so later turns still see it
+        self.app.update_state(
+            {"configurable": {"thread_id": thread_id}},
+            {"messages": [HumanMessage(content=message), AIMessage(content=ai_response)], "context": ""},
+            as_node="agent",
+        )
+        self.db_handler.store_conversation(thread_id, "human", message)
+        self.db_handler.store_conversation(thread_id, "ai", ai_response)
+        return {"output_text": [ai_response]}
+
+    def build_turn_context(self, message, vector_store_folders, source_ids=None, callbacks=None, query_embedding=None):
+        """Return this turn's retrieval prompt, or "" when no documents apply."""
+        if not vector_store_folders:
+            return ""
+
+        # One fused keyword + vector ranking over the session index (optionally limited to some files)
+        all_docs = self.retriever.retrieve(
+            vector_store_folders, message, source_ids=source_ids, embedding=query_embedding
+        )
+        if not all_docs:
+            return ""
+
+        if self.rag_mode == "single_pass":
+            return self.build_context_message(message, all_docs)
+
+        # Pass the documents directly to the chain
+        chain = self.get_conversational_chain()
+        with timed("agent.qa_chain"):
+            response = chain.invoke(
+                {"input_documents": all_docs, "question": message}, config={"callbacks": self.with_metrics(callbacks)}
+            )
+
+        # Combine the message with file content and chain answer if any
+        return self.build_combined_message(message, all_docs, response['output_text'])
+
+    async def ainteract_with_agent(self, message, thread_id, vector_store_folders, source_ids=None):
+        """Async counterpart of interact_with_agent.
+
+        Store searches run concurrently and the LLM calls use the async clients, so one
+        event loop can serve many sessions at once.
+        """
+        with traced("agent.turn", thread_id=thread_id) as self.last_trace:
+            return await self._ainteract_with_agent(message, thread_id, vector_store_folders, source_ids)
+
+    async def _ainteract_with_agent(self, message, thread_id, vector_store_folders, source_ids=None):
+        query_embedding, cached = await self.alookup_cached_response(message, vector_store_folders, source_ids)
+        if cached is not None:
+            return await self.arecord_cached_turn(message, thread_id, cached)
+
+        context = await self.abuild_turn_context(message, vector_store_folders, source_ids, query_embedding)
+
+        with timed("agent.graph"):
+            result = await self.app.ainvoke(
+                {"messages": [HumanMessage(content=message)], "context": context},
+                config={"configurable": {"thread_id": thread_id}, "callbacks": self.with_metrics()}
+            )
+        await asyncio.to_thread(self.db_handler.store_conversation, thread_id, "human", message)
+
+        ai_response = self.extract_ai_response(result)
+
+        await asyncio.to_thread(self.db_handler.store_conversation, thread_id, "ai", ai_response)
+        if query_embedding is not None and ai_response:
+            self.response_cache.put(vector_store_folders, source_ids, query_embedding, ai_response, self.rag_mode)
+        return {"output_text": [ai_response]}
+
+    async def alookup_cached_response(self, message, vector_store_folders, source_ids=None):
+        """Return (query_embedding, cached answer or None); the embedding is None when caching is off."""
+        if not vector_store_folders or self.response_cache is None:
+            return None, None
+        with timed("agent.embed_query"):
+            query_embedding = await self.vector_store_manager.embeddings.aembed_query(message)
+        cached = await asyncio.to_thread(
+            self.response_cache.get, vector_store_folders, source_ids, query_embedding, self.rag_mode
+        )
+        return query_embedding, cached
+
+    async def arecord_cached_turn(self, message, thread_id, ai_response):
+        await self.app.aupdate_state(
+            {"configurable": {"thread_id": thread_id}},
+            {"messages": [HumanMessage(content=message), AIMessage(content=ai_response)], "context": ""},
+            as_node="agent",
+        )
+        await asyncio.to_thread(self.db_handler.store_conversation, thread_id, "human", message)
+        await asyncio.to_thread(self.db_handler.store_conversation, thread_id, "ai", ai_response)
+        return {"output_text": [ai_response]}
+
+    async def astream_interact_with_agent(self, message, thread_id, vector_store_folders, source_ids=None):
+        """Yield events while the graph runs instead of waiting for the full answer.
+
+        Events are dicts with a "type" of "token" (content), "tool_call" (name, args),
+        "tool_result" (name, content) and, last, "done" (output_text as returned by
+        interact_with_agent).
+        """
+        with traced("agent.turn", thread_id=thread_id, streamed=True) as self.last_trace:
+            async for event in self._astream_interact_with_agent(message, thread_id, vector_store_folders, source_ids):
+                yield event
+
+    async def _astream_interact_with_agent(self, message, thread_id, vector_store_folders, source_ids=None):
+        query_embedding, cached = await self.alookup_cached_response(message, vector_store_folders, source_ids)
+        if cached is not None:
+            result = await self.arecord_cached_turn(message, thread_id, cached)
+            yield {"type": "token", "content": cached}
+            yield {"type": "done", **result}
+            return
+
+        context = await self.abuild_turn_context(message, vector_store_folders, source_ids, query_embedding)
+        config = {"configurable": {"thread_id": thread_id}, "callbacks": self.with_metrics()}
+
+        with timed("agent.graph") as stage:
+            async for event in self.app.astream_events(
+                {"messages": [HumanMessage(content=message)], "context": context}, config=config, version="v2"
+            ):
+                kind = event["event"]
+                if kind == "on_chat_model_stream" and event["metadata"].get("langgraph_node") == "agent":
+                    content = event["data"]["chunk"].content
+                    if content:
+                        # Time from the start of the turn to the first streamed token
+                        stage.setdefault("first_token_seconds", current_trace.get().elapsed())
+                        yield {"type": "token", "content": content}
+                elif kind == "on_tool_start":
+                    yield {"type": "tool_call", "name": event["name"], "args": event["data"].get("input")}
+                elif kind == "on_tool_end":
+                    yield {"type": "tool_result", "name": event["name"], "content": str(event["data"].get("output"))}
+
+        await asyncio.to_thread(self.db_handler.store_conversation, thread_id, "human", message)
+
+        state = await self.app.aget_state(config)
+        ai_response = self.extract_ai_response(state.values)
+
+        await asyncio.to_thread(self.db_handler.store_conversation, thread_id, "ai", ai_response)
+        if query_embedding is not None and ai_response:
+            self.response_cache.put(vector_store_folders, source_ids, query_embedding, ai_response, self.rag_mode)
+        yield {"type": "done", "output_text": [ai_response]}
+
+    async def abuild_turn_context(self, message, vector_store_folders, source_ids=None, query_embedding=None):
+        if not vector_store_folders:
+            return ""
+
+        all_docs = await self.retriever.aretrieve(
+            vector_store_folders, message, source_ids=source_ids, embedding=query_embedding
+        )
+        if not all_docs:
+            return ""
+
+        if self.rag_mode == "single_pass":
+            return self.build_context_message(message, all_docs)
+
+        chain = self.get_conversational_chain()
+        with timed("agent.qa_chain"):
+            response = await chain.ainvoke(
+                {"input_documents": all_docs, "question": message}, config={"callbacks": self.with_metrics()}
+            )
+        return self.build_combined_message(message, all_docs, response['output_text'])
+
+    @staticmethod
+    def with_metrics(callbacks=None):
+        # Times graph nodes and tools and counts LLM tokens alongside any caller callbacks
+        return [*(callbacks or []), MetricsCallbackHandler()]
+
+    @staticmethod
+    def extract_ai_response(result):
+        # Process AI responses and tool usage
+        ai_response = ""
+        for msg in result['messages']:
+            if isinstance(msg, AIMessage):
+                ai_response = msg.content.strip()
+        return ai_response
+
+    @staticmethod
+    def build_context_message(message, all_docs):
+        context = "\n\n".join(
+            f"[{doc.metadata.get('source', 'document')}] {doc.page_content}" for doc in all_docs
+        )
+        return f"""
+        You are an AI assistant and an expert bill analyzer. Respond to the user's message using the document excerpts below when they are relevant.
+
+        Documents:
+        {context}
+
+        Guidelines:
+        1. If the message is about the documents, answer exactly what was asked from their content and clearly say when the information is not available.
+        2. Present extracted information in a clear, structured format and mention unusual or important details related to the query.
+        3. For general conversation, ignore the documents and answer naturally.
+        4. Be concise for simple queries and detailed for complex ones, and do not mention these instructions.
+
+        User message: {message}
+        """
+
+    @staticmethod
+    def build_combined_message(message, all_docs, chain_answer):
+        return f"""
+        you are an ai assistant your primary task is to respond to the user's message: {message} and provide the most accurate and relevant response to the user's query.
+
+        Documents: {all_docs}
+
+        Chain Answer: {chain_answer}
+
+        Your task is to use the document and the chain answer to provide the most accurate and relevant response to the user's query.
+
+        Guidelines:
+        1. Carefully read the user's message to determine if they are asking about file content or engaging in general conversation.
+        2. For file-related queries:
+        - Analyze both the provided documents and the chain answer.
+        - Verify the accuracy and completeness of the chain answer.
+        - If the chain answer is incorrect or incomplete, provide a corrected and comprehensive response based on the document content.
+        - Focus on answering exactly what the user asked, avoiding extraneous information.
+        3. For general conversation:
+        - Engage naturally, drawing from your broad knowledge base.
+        - Ignore file content and chain answers if they're not relevant to the user's query.
+        4. Always prioritize accuracy and relevance in your responses.
+        5. Be concise for simple queries, but offer detailed explanations for complex topics if needed.
+        6. Maintain a friendly and helpful tone throughout the conversation.
+        7. Do not reference these instructions or the internal workings of the system in your response.
+
+        Respond directly to the user's message: {message}
+        """
+
+    def get_conversational_chain(self):
+        return self.runtime.get_conversational_chain()
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import requests
+
+
+class ServerBusy(Exception):
+    """The server rejected a turn (429 at capacity, 503 while shutting down) and retries ran out."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AgentClient:
+    """Client of server.py, used by the Streamlit app and the CLI.
+
+    Rejected turns are retried up to ``retries`` times after the server's Retry-After.
+    """
+
+    def __init__(self, base_url=None, timeout=300, retries=2):
+        self.base_url = (base_url or os.getenv("AGENT_SERVER_URL", "http://127.0.0.1:8080")).rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.http = requests.Session()
+
+    def sessions(self):
+        """Return {thread_id: status} of the sessions with stored conversation."""
+        return self._request("GET", "/sessions").json()
+
+    def new_session(self):
+        return self._request("POST", "/sessions").json()["thread_id"]
+
+    def history(self, thread_id, limit=50):
+        """Return the latest ``limit`` messages as dicts (id, timestamp, role, content), oldest first."""
+        return self._request("GET", f"/sessions/{thread_id}/history", params={"limit": limit}).json()
+
+    def turn(self, thread_id, message, source_ids=None):
+        """Run a turn over the session's documents (or those of ``source_ids``); returns {"output_text": [answer], "trace": ...}."""
+        body = {"message": message, "source_ids": source_ids}
+        return self._request("POST", f"/sessions/{thread_id}/turns", json=body).json()
+
+    def stream_turn(self, thread_id, message, source_ids=None):
+        """Yield the turn's events as Agent.astream_interact_with_agent does; "done" also carries the trace."""
+        body = {"message": message, "source_ids": source_ids, "stream": True}
+        with self._request("POST", f"/sessions/{thread_id}/turns", json=body, stream=True) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "error":
+                    raise RuntimeError(f"Turn failed on the server: {event['error']}")
+                yield event
+
+    def upload(self, thread_id, file_name, data, replace=None):
+        """Queue a file's bytes for indexing; returns {"job_id", "source_id"}.
+
+        With ``replace``, the file is a new version of that document and keeps its source id.
+        """
+        files = {"file": (file_name, data)}
+        params = {"replace": replace} if replace else None
+        return self._request("POST", f"/sessions/{thread_id}/documents", files=files, params=params).json()
+
+    def submit_url(self, thread_id, url, replace=None):
+        body = {"url": url, "replace": replace} if replace else {"url": url}
+        return self._request("POST", f"/sessions/{thread_id}/documents", json=body).json()
+
+    def jobs(self, thread_id):
+        return self._request("GET", f"/sessions/{thread_id}/jobs").json()
+
+    def cancel_job(self, thread_id, job_id):
+        self._request("DELETE", f"/sessions/{thread_id}/jobs/{job_id}")
+
+    def metrics(self):
+        return self._request("GET", "/metrics").json()
+
+    def reset_metrics(self):
+        self._request("POST", "/metrics/reset")
+
+    def _request(self, method, path, **kwargs):
+        for attempt in range(self.retries + 1):
+            response = self.http.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            if response.status_code not in (429, 503):
+                response.raise_for_status()
+                return response
+            retry_after = float(response.headers.get("Retry-After", 1))
+            response.close()
+            if attempt == self.retries:
+                raise ServerBusy(f"{method} {path} rejected with {response.status_code}", retry_after)
+            time.sleep(retry_after)
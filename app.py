@@ -1,12 +1,78 @@
 import streamlit as st
 from main import SessionManager
-from agent import Agent 
-from chat_Unstructured import EmbeddingManager, VectorStoreManager
 import uuid
-import os
+
+def render_agent_events(events):
+    streamed = False
+    for event in events:
+        if event["type"] == "token":
+            streamed = True
+            yield event["content"]
+        elif event["type"] == "tool_call":
+            st.toast(f"Using tool: {event['name']}")
+        elif event["type"] == "done":
+            st.session_state.last_trace = event.get("trace")
+            if not streamed:
+                # The model answered without streaming chunks
+                yield event["output_text"][0]
+
+def render_debug_panel(trace):
+    # Timings and counters for the last turn and since the server started
+    with st.sidebar.expander("Debug metrics", expanded=True):
+        if trace is not None and trace["seconds"] is not None:
+            st.write(f"Last turn: {trace['seconds'] * 1000:.0f} ms")
+            st.dataframe([
+                {"stage": stage["stage"], "ms": round(stage.pop("seconds") * 1000, 1), **stage}
+                for stage in trace["stages"]
+            ])
+            st.json(trace["counters"])
+        snapshot = client.metrics()
+        st.write("Stage latency (ms) since start")
+        st.dataframe([
+            {"metric": name[:-len(".seconds")], "count": summary["count"],
+             **{q: round(summary[q] * 1000, 1) for q in ("p50", "p95", "p99")}}
+            for name, summary in sorted(snapshot["histograms"].items()) if name.endswith(".seconds")
+        ])
+        st.json(snapshot["counters"])
+        if st.button("Reset metrics"):
+            client.reset_metrics()
+
+def attach_finished_jobs(jobs):
+    # Sources indexed by the background queue join the session's files; this also restores them on load
+    for job in jobs:
+        if job["status"] == "done" and job["vector_store"] and job["source_id"] not in st.session_state.files:
+            st.session_state.files[job["source_id"]] = {'name': job["source"], 'vector_store': job["vector_store"]}
+    session_manager.sessions[st.session_state.thread_id] = {
+        'agent_id': st.session_state.agent_id,
+        'files': st.session_state.files
+    }
+
+@st.fragment(run_every=2)
+def render_ingestion_jobs():
+    # Reruns on its own every 2 seconds, so progress updates without blocking the chat
+    jobs = client.jobs(st.session_state.thread_id)
+    attach_finished_jobs(jobs)
+    for job in jobs:
+        if job["status"] in ("queued", "running"):
+            st.write(f"⏳ {job['source']}: {job['status']}, {job['chunks_done']} chunks indexed")
+            if st.button("Cancel", key=f"cancel_{job['id']}"):
+                client.cancel_job(st.session_state.thread_id, job["id"])
+        elif job["status"] == "failed":
+            st.write(f"⚠️ {job['source']}: failed ({job['error']})")
+
+@st.cache_resource(show_spinner=False)
+def get_session_manager():
+    # Built once per process; the session list is refreshed from the server when needed
+    return SessionManager()
+
+# Number of most recent messages shown when a session is loaded
+HISTORY_PAGE_SIZE = 100
 
 # Create instances of necessary classes
-session_manager = SessionManager()
+session_manager = get_session_manager()
+# Turns, history and ingestion run in server.py, which orders the turns of each thread
+client = session_manager.client
+
 # Streamlit app
 st.set_page_config(page_title="AI Agent Interaction", page_icon="🤖")
 st.title("AI Agent Interaction")
@@ -47,7 +113,6 @@ if option == "Start New Session":
     if st.sidebar.button("Start New Session"):
         st.session_state.thread_id = session_manager.start_new_session()
         st.session_state.agent_id = str(uuid.uuid4())
-        st.session_state.agent = Agent(agent_id=st.session_state.agent_id)
         st.session_state.files = {}
         st.session_state.messages = []
         session_manager.sessions[st.session_state.thread_id] = {
@@ -58,6 +123,7 @@ if option == "Start New Session":
         # Clear existing messages
         
 if option == "Continue Existing Session":
+    session_manager.refresh_sessions()
     sessions = session_manager.sessions
     if not sessions:
         st.sidebar.warning("No sessions found. Please start a new session.")
@@ -75,11 +141,9 @@ if option == "Continue Existing Session":
                 if not st.session_state.agent_id:
                     st.session_state.agent_id = str(uuid.uuid4())
                     session_data['agent_id'] = st.session_state.agent_id
-                st.session_state.agent = Agent(agent_id=st.session_state.agent_id)
                 st.session_state.files = session_data.get('files', {})
             else:
                 st.session_state.agent_id = str(uuid.uuid4())
-                st.session_state.agent = Agent(agent_id=st.session_state.agent_id)
                 st.session_state.files = {}
                 sessions[session_id] = {
                     'agent_id': st.session_state.agent_id,
@@ -92,11 +156,9 @@ if option == "Continue Existing Session":
                 'files': st.session_state.files
             }
 
-            conversation_history = session_manager.db_handler.get_conversation_history(st.session_state.thread_id)
+            conversation_history = client.history(st.session_state.thread_id, limit=HISTORY_PAGE_SIZE)
             for record in conversation_history:
-                role = record[3]
-                content = record[4]
-                st.session_state.messages.append({"role": role, "content": content})
+                st.session_state.messages.append({"role": record["role"], "content": record["content"]})
             st.sidebar.success(f"Continuing session: {st.session_state.thread_id}")
             
             # Display loaded files
@@ -116,52 +178,30 @@ if st.session_state.thread_id:
             key="file_uploader"
         )
         url = st.text_input("Enter a URL to process", key="url_input")
+        replace = st.checkbox("Replace files with the same name", key="replace_files")
         
         if st.form_submit_button("Submit & Process"):
             if uploaded_files or url:
-                with st.spinner("Processing files and URL..."):
-                    for uploaded_file in uploaded_files:
-                        file_id = str(uuid.uuid4())
-                        file_name = uploaded_file.name
-                        file_path = f"uploads/{st.session_state.agent_id}/{file_id}_{file_name}"
-                        
-                        # Ensure the directory exists
-                        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                        
-                        # Save the file
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        
-                        # Process the file
-                        text_chunks = EmbeddingManager().process_files_and_url([file_path], None)
-                        vector_store_path = VectorStoreManager().create_vector_store(text_chunks, file_id)
-                        
-                        # Store file information
-                        st.session_state.files[file_id] = {
-                            'name': file_name,
-                            'vector_store': vector_store_path
-                        }
-                    
-                    # Process URL if provided
-                    if url:
-                        url_id = str(uuid.uuid4())
-                        text_chunks = EmbeddingManager().process_files_and_url([], url)
-                        vector_store_path = VectorStoreManager().create_vector_store(text_chunks, url_id)
-                        st.session_state.files[url_id] = {
-                            'name': url,
-                            'vector_store': vector_store_path
-                        }
-                    
-                    # Update session manager
-                    session_manager.sessions[st.session_state.thread_id] = {
-                        'agent_id': st.session_state.agent_id,
-                        'files': st.session_state.files
-                    }
-                    
-                    st.success("Files and URL processed successfully!")
+                # Otherwise a file with a name the session already has is added as another document
+                existing = {file_info['name']: file_id for file_id, file_info in st.session_state.files.items()} if replace else {}
+                for uploaded_file in uploaded_files:
+                    # The server saves the file; parsing, embedding and index writes happen on its ingestion workers
+                    client.upload(
+                        st.session_state.thread_id, uploaded_file.name, uploaded_file.getvalue(),
+                        replace=existing.get(uploaded_file.name),
+                    )
+
+                if url:
+                    client.submit_url(st.session_state.thread_id, url, replace=existing.get(url))
+
+                st.success("Files and URL queued for processing. You can keep chatting meanwhile.")
             else:
                 st.warning("Please upload files or enter a URL to process.")
 
+    attach_finished_jobs(client.jobs(st.session_state.thread_id))
+    with st.sidebar:
+        render_ingestion_jobs()
+
     # Display all files (both loaded and newly uploaded)
     if st.session_state.files:
         st.sidebar.write("All Files:")
@@ -173,10 +213,6 @@ if st.session_state.thread_id:
     st.title("Chat Interface")
     st.write(f"Session ID: {st.session_state.thread_id} - Agent ID: {st.session_state.agent_id}")
 
-    # Ensure agent is initialized
-    if 'agent' not in st.session_state:
-        st.session_state.agent = Agent(agent_id=st.session_state.agent_id)
-
     # Display chat messages
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -190,17 +226,13 @@ if st.session_state.thread_id:
 
         # Display chat messages and bot response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                if st.session_state.files:
-                    # Use all vector stores for question answering
-                    vector_stores = [file_info['vector_store'] for file_info in st.session_state.files.values()]
-                    response = st.session_state.agent.interact_with_agent(prompt, st.session_state.thread_id, vector_stores)
-                else:
-                    # Use the regular agent interaction
-                    response = st.session_state.agent.interact_with_agent(prompt, st.session_state.thread_id, None)
-                full_response = response['output_text'][0]
-                st.write(full_response)
+            # The server searches the stores of the session's indexed files; render tokens as they arrive
+            events = client.stream_turn(st.session_state.thread_id, prompt)
+            full_response = st.write_stream(render_agent_events(events))
         st.session_state.messages.append({"role": "assistant", "content": full_response})
 
+    if st.sidebar.checkbox("Show debug metrics"):
+        render_debug_panel(st.session_state.get("last_trace"))
+
 else:
     st.info("Please start a new session to begin.")
@@ -0,0 +1,112 @@
+"""Chunking throughput (MB/s) of the chunking engine against the previous splitter path.
+
+The previous path is reproduced here as it was: per-type regex passes,
+RecursiveCharacterTextSplitter over an 8000-character window, and spreadsheets
+rendered with DataFrame.to_string before splitting:
+
+    python -m benchmarks.chunking --pages 300 --rows 100000
+"""
+import re
+import json
+import time
+import argparse
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from chunking import TableChunker, TextChunker, normalize
+from benchmarks.suite import bill_rows
+
+
+def legacy_preprocess(text, file_type):
+    text = text.replace('\n', ' ').replace('\r', '')
+    if file_type == 'pdf':
+        text = re.sub(r'\s+', ' ', text)
+    elif file_type == 'csv' or file_type == 'xls':
+        text = re.sub(r'\s{2,}', ' | ', text)
+    elif file_type == 'json':
+        text = re.sub(r'[{}\[\]]', '', text)
+    return text
+
+
+def legacy_chunks(segments, buffer_size=8000):
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=200, separators=["\n\n", "\n", ". ", ", ", " "], length_function=len
+    )
+    buffer = ""
+    for file_type, segment in segments:
+        buffer += legacy_preprocess(segment, file_type) + "\n"
+        if len(buffer) >= buffer_size:
+            chunks = splitter.split_text(buffer)
+            yield from chunks[:-1]
+            buffer = chunks[-1] + "\n" if chunks else ""
+    if buffer.strip():
+        yield from splitter.split_text(buffer)
+
+
+def pages_of_text(count, lines_per_page=40, seed=0):
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(2000)]
+    pages = []
+    for page in range(count):
+        lines = []
+        for line in range(lines_per_page):
+            sentence = " ".join(rng.choice(words, rng.integers(6, 16)))
+            lines.append(f"Invoice INV-{page:04d}-{line:02d}   total  {rng.uniform(10, 5000):.2f}   {sentence}.")
+        pages.append("\n".join(lines))
+    return pages
+
+
+def throughput(megabytes, run, repeat):
+    best = None
+    chunks = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = sum(1 for _ in run())
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return {"seconds": round(best, 4), "mb_per_s": round(megabytes / best, 2), "chunks": chunks}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--block-rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pages = pages_of_text(args.pages)
+    text_mb = sum(len(page) for page in pages) / 2 ** 20
+    chunker = TextChunker()
+
+    rows = bill_rows(args.rows)
+    blocks = [rows.iloc[i:i + args.block_rows] for i in range(0, len(rows), args.block_rows)]
+    table_mb = len(rows.to_csv(index=False)) / 2 ** 20
+    table_chunker = TableChunker()
+
+    results = {
+        "text": {
+            "megabytes": round(text_mb, 2),
+            "legacy": throughput(text_mb, lambda: legacy_chunks(("pdf", page) for page in pages), args.repeat),
+            "engine": throughput(
+                text_mb,
+                lambda: chunker.iter_chunks((normalize(page, "pdf"), i) for i, page in enumerate(pages, 1)),
+                args.repeat,
+            ),
+        },
+        "table": {
+            "megabytes": round(table_mb, 2),
+            "legacy": throughput(
+                table_mb,
+                lambda: legacy_chunks(("csv", block.to_string(index=False)) for block in blocks),
+                args.repeat,
+            ),
+            "engine": throughput(table_mb, lambda: table_chunker.iter_chunks(blocks), args.repeat),
+        },
+    }
+    for result in results.values():
+        result["speedup"] = round(result["engine"]["mb_per_s"] / result["legacy"]["mb_per_s"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
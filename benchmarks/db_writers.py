@@ -0,0 +1,84 @@
+"""Conversation-store write throughput with many concurrent sessions.
+
+Compares one connection + commit per message (the previous DatabaseHandler
+behaviour) against the pooled, write-behind DatabaseHandler:
+
+    python -m benchmarks.db_writers --sessions 32 --turns 50
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from memory import DatabaseHandler
+
+
+def store_per_connection(db_name, thread_id, role, content):
+    with sqlite3.connect(db_name, timeout=30) as conn:
+        conn.execute("""
+        INSERT INTO conversations (thread_id, timestamp, role, content)
+        VALUES (?, ?, ?, ?)
+        """, (thread_id, datetime.now().isoformat(), role, content))
+        conn.commit()
+
+
+def run_sessions(store, sessions, turns):
+    def session(i):
+        for turn in range(turns):
+            store(f"session-{i}", "human", f"question {turn}")
+            store(f"session-{i}", "ai", f"answer {turn} " * 20)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+    messages = args.sessions * args.turns * 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Plain connection so the legacy database keeps SQLite's default rollback journal
+        legacy_db = os.path.join(tmp, "legacy.db")
+        with sqlite3.connect(legacy_db) as conn:
+            conn.execute("""
+            CREATE TABLE conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                thread_id TEXT,
+                timestamp TEXT,
+                role TEXT,
+                content TEXT
+            )
+            """)
+        legacy_seconds = run_sessions(
+            lambda *row: store_per_connection(legacy_db, *row), args.sessions, args.turns
+        )
+
+        handler = DatabaseHandler(os.path.join(tmp, "pooled.db"))
+        enqueue_seconds = run_sessions(handler.store_conversation, args.sessions, args.turns)
+        start = time.perf_counter()
+        handler.flush()
+        pooled_seconds = enqueue_seconds + time.perf_counter() - start
+        handler.close()
+
+    print(json.dumps({
+        "sessions": args.sessions,
+        "messages": messages,
+        "per_connection_msgs_per_s": messages / legacy_seconds,
+        "write_behind_msgs_per_s": messages / pooled_seconds,
+        "write_behind_enqueue_msgs_per_s": messages / enqueue_seconds,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
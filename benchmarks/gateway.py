@@ -0,0 +1,107 @@
+"""Model calls straight to a rate-limited API against the same calls through the model gateway.
+
+Runs against fakes.FakeModelServer, which answers 429 beyond its quota and fails
+some requests with 503, and reports completed and failed calls, upstream
+requests and latency for chat (half of the sessions ask the same questions at the
+same time) and for concurrent query embeddings:
+
+    python -m benchmarks.gateway --sessions 40 --calls 5
+"""
+import json
+import time
+import asyncio
+import argparse
+from langchain_core.messages import HumanMessage
+from fakes import FakeHttpChatModel, FakeHttpEmbeddings, FakeModelServer
+from model_gateway import GatewayChatModel, GatewayEmbeddings, ModelGateway
+from benchmarks.suite import latency_summary
+
+
+def make_gateway(args):
+    per_minute = args.limit * 60 / args.window
+    return ModelGateway(
+        limits={"chat": (per_minute, 0), "embeddings": (per_minute, 0)},
+        burst=args.window, base_delay=0.1, deadline=args.deadline,
+    )
+
+
+async def timed_call(call, latencies, errors):
+    start = time.perf_counter()
+    try:
+        await call()
+    except Exception as e:
+        errors.append(type(e).__name__)
+        return
+    latencies.append(time.perf_counter() - start)
+
+
+async def chat_load(model, args):
+    async def session(number):
+        for call in range(args.calls):
+            # Even sessions ask the shared questions, odd ones their own
+            question = f"question {call}" if number % 2 == 0 else f"question {call} from session {number}"
+            await timed_call(lambda: model.ainvoke([HumanMessage(content=question)]), latencies, errors)
+
+    latencies, errors = [], []
+    await asyncio.gather(*(session(number) for number in range(args.sessions)))
+    return latencies, errors
+
+
+async def embedding_load(embeddings, args):
+    latencies, errors = [], []
+    await asyncio.gather(*(
+        timed_call(lambda i=i: embeddings.aembed_query(f"total due on invoice {i}"), latencies, errors)
+        for i in range(args.queries)
+    ))
+    return latencies, errors
+
+
+def run(load, client, args):
+    server = FakeModelServer(limit=args.limit, window=args.window, fail_every=args.fail_every, latency=args.latency)
+    url = server.start()
+    try:
+        start = time.perf_counter()
+        latencies, errors = asyncio.run(load(client(url), args))
+        seconds = time.perf_counter() - start
+    finally:
+        server.stop()
+    return {
+        "completed": len(latencies),
+        "failed": len(errors),
+        "errors": sorted(set(errors)),
+        "seconds": round(seconds, 3),
+        "upstream": dict(server.stats),
+        "latency": latency_summary(latencies) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--calls", type=int, default=5, help="chat calls per session")
+    parser.add_argument("--queries", type=int, default=200, help="concurrent query embeddings")
+    parser.add_argument("--limit", type=int, default=20, help="fake API requests allowed per window")
+    parser.add_argument("--window", type=float, default=1.0, help="fake API quota window in seconds")
+    parser.add_argument("--fail-every", type=int, default=25, help="every Nth request fails with 503")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--deadline", type=float, default=60.0)
+    args = parser.parse_args()
+
+    results = {
+        "chat": {
+            "direct": run(chat_load, lambda url: FakeHttpChatModel(base_url=url), args),
+            "gateway": run(
+                chat_load, lambda url: GatewayChatModel(inner=FakeHttpChatModel(base_url=url), gateway=make_gateway(args)),
+                args,
+            ),
+        },
+        "embeddings": {
+            "direct": run(embedding_load, FakeHttpEmbeddings, args),
+            "gateway": run(embedding_load, lambda url: GatewayEmbeddings(FakeHttpEmbeddings(url), make_gateway(args)), args),
+        },
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare latency and LLM tokens per turn for the single-pass and two-pass RAG modes.
+
+Runs against the live Gemini API, so GOOGLE_API_KEY/GEMINI_API_KEY must be set:
+
+    python -m benchmarks.rag_modes --file bill.pdf --question "What is the total?"
+"""
+import time
+import json
+import uuid
+import argparse
+import statistics
+from langchain_core.callbacks import BaseCallbackHandler
+from agent import Agent, RAG_MODES, get_runtime
+
+
+class UsageCallback(BaseCallbackHandler):
+    def __init__(self):
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.llm_calls += 1
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.input_tokens += usage.get("input_tokens", 0)
+                self.output_tokens += usage.get("output_tokens", 0)
+
+
+def run_mode(rag_mode, vector_store_folder, questions, turns, runtime=None):
+    runtime = runtime or get_runtime()
+    # Every question is answered for real; repeated questions would otherwise hit the cache
+    runtime.response_cache = None
+    agent = Agent(agent_id=str(uuid.uuid4()), rag_mode=rag_mode, runtime=runtime)
+    latencies = []
+    usage = UsageCallback()
+    for turn in range(turns):
+        # A fresh thread per turn so history does not skew the comparison
+        thread_id = str(uuid.uuid4())
+        question = questions[turn % len(questions)]
+        start = time.perf_counter()
+        agent.interact_with_agent(question, thread_id, [vector_store_folder], callbacks=[usage])
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "mode": rag_mode,
+        "turns": turns,
+        "latency_mean_s": statistics.mean(latencies),
+        "latency_p50_s": statistics.median(latencies),
+        "llm_calls_per_turn": usage.llm_calls / turns,
+        "input_tokens_per_turn": usage.input_tokens / turns,
+        "output_tokens_per_turn": usage.output_tokens / turns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--file", action="append", required=True, help="document to ingest (repeatable)")
+    parser.add_argument("--question", action="append", required=True, help="question to ask (repeatable)")
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    agent = Agent(agent_id=str(uuid.uuid4()))
+    session_id = f"bench_{uuid.uuid4()}"
+    folder = None
+    for file in args.file:
+        folder = agent.vector_store_manager.add_to_session_store(
+            agent.embedding_manager.iter_text_chunks([file]), session_id, file, file
+        )
+
+    results = [run_mode(rag_mode, folder, args.question, args.turns) for rag_mode in RAG_MODES]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""Offline performance suite: ingestion, index build/query, agent turns, concurrent sessions and serving.
+
+Runs entirely on the deterministic fakes in fakes.py, so no API keys are needed,
+and prints one JSON document that can be saved and compared with a later run:
+
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from fakes import FakeChatModel, FakeEmbeddings
+from metrics import registry
+from chat_Unstructured import EmbeddingManager, VectorStoreCache, VectorStoreManager
+from retrieval import HybridRetriever
+from vector_index import FaissIndexFactory
+from benchmarks.vector_indexes import synthetic_corpus
+
+SCENARIOS = ("ingestion", "index", "turns", "concurrency", "serving")
+
+
+def latency_summary(seconds):
+    seconds = np.array(seconds) * 1000
+    return {
+        "count": len(seconds),
+        "mean_ms": round(float(seconds.mean()), 3),
+        "p50_ms": round(float(np.percentile(seconds, 50)), 3),
+        "p95_ms": round(float(np.percentile(seconds, 95)), 3),
+    }
+
+
+def write_pdf(path, pages, lines_per_page=40):
+    """Write a minimal text-only PDF (Helvetica, one content stream per page)."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        lines = page[:lines_per_page]
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        text = " T* ".join(f"({line}) Tj" for line in escaped)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Contents {len(objects)} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def bill_rows(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "invoice": [f"INV-2024-{i:05d}" for i in range(count)],
+        "date": [f"2024-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}" for _ in range(count)],
+        "customer": [f"Customer {rng.integers(1000)}" for _ in range(count)],
+        "description": [f"Service item {rng.integers(100)} for period {rng.integers(1, 13)}" for _ in range(count)],
+        "amount": rng.uniform(10, 5000, count).round(2),
+    })
+
+
+def make_fixtures(folder, args):
+    rows = bill_rows(args.rows)
+    fixtures = {}
+
+    lines = [" | ".join(map(str, row)) for row in rows.itertuples(index=False)]
+    pages = [lines[i:i + 40] for i in range(0, min(len(lines), args.pdf_pages * 40), 40)]
+    fixtures["pdf"] = os.path.join(folder, "bills.pdf")
+    write_pdf(fixtures["pdf"], pages)
+
+    fixtures["csv"] = os.path.join(folder, "bills.csv")
+    rows.to_csv(fixtures["csv"], index=False)
+
+    try:
+        fixtures["xls"] = os.path.join(folder, "bills.xls")
+        # pandas can no longer write the legacy format; read_excel sniffs the content, not the extension
+        with pd.ExcelWriter(fixtures["xls"], engine="openpyxl") as writer:
+            rows.to_excel(writer, index=False)
+    except ImportError as e:
+        fixtures["xls"] = None
+        fixtures["xls_skipped"] = str(e)
+    return fixtures
+
+
+def bench_ingestion(folder, args):
+    manager = EmbeddingManager()
+    fixtures = make_fixtures(folder, args)
+    results = {}
+    for kind in ("pdf", "csv", "xls"):
+        path = fixtures[kind]
+        if path is None:
+            results[kind] = {"skipped": fixtures[f"{kind}_skipped"]}
+            continue
+        try:
+            start = time.perf_counter()
+            chunks = list(manager.iter_text_chunks([path]))
+            seconds = time.perf_counter() - start
+        except ImportError as e:
+            results[kind] = {"skipped": str(e)}
+            continue
+        megabytes = os.path.getsize(path) / 2 ** 20
+        results[kind] = {
+            "megabytes": round(megabytes, 3),
+            "seconds": round(seconds, 4),
+            "mb_per_s": round(megabytes / seconds, 3),
+            "chunks": len(chunks),
+            "chunks_per_s": round(len(chunks) / seconds, 1),
+        }
+
+    # As the ingestion queue does: queued files parsed ahead, all at once, in the manager's process pool
+    files = [fixtures[kind] for kind in ("pdf", "csv", "xls") if "skipped" not in results[kind]]
+    jobs = [(path, os.path.join(folder, f"job_{i}.chunks")) for i, path in enumerate(files * args.parallel_copies)]
+    try:
+        # The queue's pool lives as long as the server, so its start-up is not timed
+        with ThreadPoolExecutor(max_workers=manager.parse_workers) as executor:
+            list(executor.map(lambda job: manager.parse_to_spool(*job), jobs[:manager.parse_workers]))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            chunks = sum(executor.map(lambda job: manager.parse_to_spool(*job), jobs))
+        seconds = time.perf_counter() - start
+    finally:
+        manager.close()
+    results["parallel"] = {
+        "files": len(jobs),
+        "workers": manager.parse_workers,
+        "seconds": round(seconds, 4),
+        "chunks_per_s": round(chunks / seconds, 1),
+    }
+    return results
+
+
+def bench_index(folder, args):
+    texts, queries = synthetic_corpus(args.chunks, args.queries)
+    embeddings = FakeEmbeddings(dim=args.dim)
+    factory = FaissIndexFactory(args.index_type, min_train_size=min(5000, args.chunks))
+    manager = VectorStoreManager(cache=VectorStoreCache(), embeddings=embeddings, index_factory=factory)
+
+    start = time.perf_counter()
+    store = manager.add_to_session_store(texts, f"bench_{uuid.uuid4().hex}", "corpus", "corpus")
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    manager.load_vector_store(store)
+    open_seconds = time.perf_counter() - start
+
+    query_vectors = [embeddings.embed_query(query) for query in queries]
+    vector_latencies = []
+    for query, vector in zip(queries, query_vectors):
+        start = time.perf_counter()
+        manager.search([store], query, embedding=vector)
+        vector_latencies.append(time.perf_counter() - start)
+
+    retriever = HybridRetriever(manager)
+    hybrid_latencies = []
+    for query, vector in zip(queries, query_vectors):
+        start = time.perf_counter()
+        retriever.retrieve([store], query, embedding=vector)
+        hybrid_latencies.append(time.perf_counter() - start)
+
+    return {
+        "chunks": args.chunks,
+        "index_type": args.index_type,
+        "build_seconds": round(build_seconds, 3),
+        "build_chunks_per_s": round(args.chunks / build_seconds, 1),
+        "open_seconds": round(open_seconds, 5),
+        "vector_query": latency_summary(vector_latencies),
+        "hybrid_query": latency_summary(hybrid_latencies),
+    }
+
+
+def make_runtime(folder, args):
+    from agent import AgentRuntime
+
+    runtime = AgentRuntime(
+        llm=FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency, tool_call_every=4),
+        embeddings=FakeEmbeddings(dim=args.dim, latency=args.embed_latency),
+        db_name=os.path.join(folder, "agent.db"),
+    )
+    # Every question is answered for real; repeated benchmark questions would otherwise hit the cache
+    runtime.response_cache = None
+    texts, _ = synthetic_corpus(2000, 0)
+    store = runtime.vector_store_manager.add_to_session_store(texts, "bench_turns", "corpus", "corpus")
+    return runtime, store
+
+
+def bench_turns(folder, args):
+    from agent import Agent
+
+    runtime, store = make_runtime(folder, args)
+    _, questions = synthetic_corpus(0, args.turns, seed=1)
+    agent = Agent("bench", runtime=runtime)
+    thread_id = str(uuid.uuid4())
+    registry.reset()
+
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        agent.interact_with_agent(question, thread_id, [store])
+        latencies.append(time.perf_counter() - start)
+
+    stages = registry.snapshot()["histograms"]
+    return {
+        "llm_latency_ms": args.llm_latency * 1000,
+        "turn": latency_summary(latencies),
+        # Median time per stage, to see where a turn's time goes
+        "stage_p50_ms": {
+            name[:-len(".seconds")]: round(summary["p50"] * 1000, 3)
+            for name, summary in sorted(stages.items()) if name.endswith(".seconds")
+        },
+    }
+
+
+def bench_concurrency(folder, args):
+    from agent import Agent
+
+    runtime, store = make_runtime(folder, args)
+    _, questions = synthetic_corpus(0, args.turns, seed=2)
+
+    async def session(latencies):
+        agent = Agent(str(uuid.uuid4()), runtime=runtime)
+        thread_id = str(uuid.uuid4())
+        for question in questions:
+            start = time.perf_counter()
+            await agent.ainteract_with_agent(question, thread_id, [store])
+            latencies.append(time.perf_counter() - start)
+
+    async def run():
+        latencies = []
+        await asyncio.gather(*(session(latencies) for _ in range(args.sessions)))
+        return latencies
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run())
+    seconds = time.perf_counter() - start
+    return {
+        "sessions": args.sessions,
+        "turns": len(latencies),
+        "seconds": round(seconds, 3),
+        "turns_per_s": round(len(latencies) / seconds, 2),
+        "turn": latency_summary(latencies),
+    }
+
+
+def bench_serving(folder, args):
+    import aiohttp
+    from aiohttp import web
+    from ingest_jobs import IngestionQueue
+    from server import AdmissionControl, AgentServer
+
+    runtime, store = make_runtime(folder, args)
+    _, questions = synthetic_corpus(0, args.server_turns, seed=3)
+    server = AgentServer(
+        runtime,
+        ingestion_queue=IngestionQueue(
+            runtime.vector_store_manager, runtime.embedding_manager, db_name=os.path.join(folder, "agent.db")
+        ),
+        admission=AdmissionControl(max_active=args.server_active, max_queued=args.server_queued),
+    )
+
+    async def client(http, url, latencies, rejected):
+        # One session sending its turns back to back; a rejected turn is skipped after Retry-After
+        thread_id = str(uuid.uuid4())
+        # Turns search the stores registered for their thread
+        await asyncio.to_thread(server.ingestion_queue.documents.put, thread_id, "corpus", "corpus", None, store, 0)
+        for question in questions:
+            start = time.perf_counter()
+            async with http.post(f"{url}/sessions/{thread_id}/turns", json={"message": question}) as response:
+                await response.read()
+                if response.status == 429:
+                    rejected.append(1)
+                    await asyncio.sleep(float(response.headers["Retry-After"]))
+                    continue
+                response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async def run():
+        runner = web.AppRunner(server.build_app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        latencies, rejected = [], []
+        start = time.perf_counter()
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as http:
+            await asyncio.gather(*(
+                client(http, f"http://{host}:{port}", latencies, rejected) for _ in range(args.server_clients)
+            ))
+        seconds = time.perf_counter() - start
+        await runner.cleanup()
+        return latencies, len(rejected), seconds
+
+    latencies, rejected, seconds = asyncio.run(run())
+    return {
+        "clients": args.server_clients,
+        "max_active": args.server_active,
+        "max_queued": args.server_queued,
+        "accepted": len(latencies),
+        "rejected": rejected,
+        "turns_per_s": round(len(latencies) / seconds, 2),
+        "turn": {**latency_summary(latencies), "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3)},
+    }
+
+
+def compare(results, baseline, threshold, path=""):
+    """Yield (metric, old, new, change, regressed) for numeric results present in both runs."""
+    for key, new in results.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{path}.{key}" if path else key
+        if isinstance(new, dict) and isinstance(old, dict):
+            yield from compare(new, old, threshold, name)
+        elif isinstance(new, (int, float)) and isinstance(old, (int, float)) and old:
+            change = new / old - 1
+            if key.endswith(("_ms", "seconds")):
+                regressed = change > threshold
+            elif key.endswith("_per_s"):
+                regressed = change < -threshold
+            else:
+                regressed = False
+            yield name, old, new, change, regressed
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--rows", type=int, default=20000, help="bill rows in the CSV/XLS fixtures")
+    parser.add_argument("--pdf-pages", type=int, default=100)
+    parser.add_argument("--parallel-copies", type=int, default=2)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="fake model seconds per call")
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="fake embedding seconds per call")
+    parser.add_argument("--server-clients", type=int, default=64, help="concurrent clients of the server")
+    parser.add_argument("--server-turns", type=int, default=5, help="turns each server client sends")
+    parser.add_argument("--server-active", type=int, default=8)
+    parser.add_argument("--server-queued", type=int, default=16)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change flagged as a regression")
+    args = parser.parse_args()
+
+    benchmarks = {
+        "ingestion": bench_ingestion,
+        "index": bench_index,
+        "turns": bench_turns,
+        "concurrency": bench_concurrency,
+        "serving": bench_serving,
+    }
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        # Vector store folders are created relative to the working directory
+        os.chdir(folder)
+        try:
+            for scenario in args.scenarios:
+                results[scenario] = benchmarks[scenario](folder, args)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = 0
+        for name, old, new, change, regressed in compare(results, baseline["results"], args.threshold):
+            regressions += regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:55} {old:>12} -> {new:>12} ({change:+.1%}){flag}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Recall and latency of the FAISS index types over a synthetic corpus.
+
+Chunks are bags of topic words embedded with the deterministic FakeEmbeddings,
+so the corpus has the clustered structure of real text without calling an API.
+Recall@k is measured against exact (flat) search:
+
+    python -m benchmarks.vector_indexes --chunks 50000 --dim 768
+"""
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+from fakes import FakeEmbeddings
+from vector_index import FaissIndexFactory
+
+# (index type, query-time knobs) pairs swept by default
+SWEEP = [
+    ("flat", {}),
+    ("ivf_flat", {"nprobe": 4}),
+    ("ivf_flat", {"nprobe": 8}),
+    ("ivf_flat", {"nprobe": 16}),
+    ("ivf_flat", {"nprobe": 32}),
+    ("ivf_pq", {"nprobe": 16}),
+    ("ivf_pq", {"nprobe": 32}),
+    ("hnsw", {"ef_search": 16}),
+    ("hnsw", {"ef_search": 32}),
+    ("hnsw", {"ef_search": 64}),
+    ("hnsw", {"ef_search": 128}),
+]
+
+
+def synthetic_corpus(chunks, queries, topics=500, words_per_chunk=40, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"w{i}" for i in range(topics * 10)]
+    topic_words = [rng.choice(vocabulary, 30, replace=False) for _ in range(topics)]
+
+    def text(length):
+        topic = topic_words[rng.integers(topics)]
+        # Mostly on-topic words with some background vocabulary
+        on_topic = rng.random(length) < 0.8
+        words = np.where(on_topic, rng.choice(topic, length), rng.choice(vocabulary, length))
+        return " ".join(words)
+
+    return [text(words_per_chunk) for _ in range(chunks)], [text(8) for _ in range(queries)]
+
+
+def measure(factory, vectors, queries, truth, k):
+    start = time.perf_counter()
+    index = factory.build(vectors)
+    index.add(vectors)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    found = []
+    for query in queries:
+        # One query at a time, as in a chat turn
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+
+    recall = np.mean([len(set(ids) & set(expected)) / k for ids, expected in zip(found, truth)])
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "index": type(index).__name__,
+        "recall_at_k": round(float(recall), 4),
+        "mean_ms": round(float(latencies_ms.mean()), 4),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 4),
+        "build_s": round(build_seconds, 3),
+        "index_mb": round(faiss.serialize_index(index).nbytes / 2 ** 20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    texts, query_texts = synthetic_corpus(args.chunks, args.queries)
+    embeddings = FakeEmbeddings(args.dim)
+    vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    queries = np.array([embeddings.embed_query(text) for text in query_texts], dtype=np.float32)
+
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for index_type, knobs in SWEEP:
+        factory = FaissIndexFactory(index_type, min_train_size=0, **knobs)
+        results.append({"type": index_type, **knobs, **measure(factory, vectors, queries, truth, args.k)})
+
+    print(json.dumps({"chunks": args.chunks, "dim": args.dim, "k": args.k, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,148 +1,536 @@
-import re
 import os
 import json
-import pandas as pd
-from PyPDF2 import PdfReader
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 import google.generativeai as genai
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import UnstructuredURLLoader
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from gemini import GeminiEmbeddings
+from chunking import TableChunker, TextChunker, normalize
+from embeddings import CachedEmbeddings, EmbeddingCache
+from model_gateway import GatewayEmbeddings, get_gateway
+from vector_index import FaissIndexFactory
+from vector_storage import chunk_hash, is_transient, load_store, replace_store, save_store, store_exists, without_positions
+from metrics import registry, timed
+
+@lru_cache(maxsize=None)
+def get_embeddings(model="models/embedding-001"):
+    # One embeddings client per process instead of one per load/create call,
+    # with chunk vectors reused across uploads through the content-hash cache and
+    # API calls rate limited, retried and micro-batched by the model gateway
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY not found in environment variables.")
+    genai.configure(api_key=api_key)
+    return CachedEmbeddings(
+        GatewayEmbeddings(
+            GeminiEmbeddings(model=model), get_gateway(), query_task_type="retrieval_query"
+        ),
+        cache=EmbeddingCache(),
+        namespace=model,
+        max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4)),
+    )
+
+
+class VectorStoreCache:
+    """Process-wide LRU cache of loaded FAISS stores.
+
+    Entries are keyed by folder path and invalidated when the mtime/size of the
+    files in the folder change. Eviction is LRU under a byte budget measured on
+    the on-disk size of each store.
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("VECTOR_STORE_CACHE_BYTES", 512 * 1024 * 1024))
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {folder: (fingerprint, store, nbytes)}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def fingerprint(folder):
+        files = []
+        for name in sorted(os.listdir(folder)):
+            if is_transient(name):
+                continue
+            try:
+                stat = os.stat(os.path.join(folder, name))
+            except FileNotFoundError:
+                # Replaced by a concurrent save
+                continue
+            files.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(files)
+
+    def get(self, folder, loader):
+        key = os.path.abspath(folder)
+        fingerprint = self.fingerprint(folder)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                registry.increment("vector_store_cache.hits")
+                return entry[1]
+            self.misses += 1
+        registry.increment("vector_store_cache.misses")
+
+        # Load outside the lock so hits on other folders are not blocked by disk reads
+        store = loader(folder)
+        nbytes = sum(size for _, _, size in fingerprint)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (fingerprint, store, nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+        return store
+
+    def put(self, folder, store):
+        # Replace the cached entry after an in-place update has been saved to disk
+        key = os.path.abspath(folder)
+        fingerprint = self.fingerprint(folder)
+        nbytes = sum(size for _, _, size in fingerprint)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (fingerprint, store, nbytes)
+            self.current_bytes += nbytes
+            self._evict()
+
+    def invalidate(self, folder):
+        with self._lock:
+            self._remove(os.path.abspath(folder))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[2]
+
+    def _evict(self):
+        # Always keep the most recently used entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and (
+            self.current_bytes > self.max_bytes
+            or (self.max_entries is not None and len(self._entries) > self.max_entries)
+        ):
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+
+# Shared by every VectorStoreManager in the process
+vector_store_cache = VectorStoreCache()
+
 
 class VectorStoreManager:
-    def __init__(self):
+    def __init__(self, cache=None, embeddings=None, index_factory=None):
         self.vector_store_folder = None
+        self.cache = cache if cache is not None else vector_store_cache
+        self._embeddings = embeddings
+        # Index type and search knobs come from VECTOR_INDEX_* unless a factory is given
+        self.index_factory = index_factory if index_factory is not None else FaissIndexFactory.from_env()
+
+    @property
+    def embeddings(self):
+        # Resolved lazily so a custom embedder can be injected without touching Google clients
+        if self._embeddings is None:
+            self._embeddings = get_embeddings()
+        return self._embeddings
 
     def create_vector_store(self, text_chunks,id):
         unique_id = id
         self.vector_store_folder = f"faiss_index_{unique_id}"
         os.makedirs(self.vector_store_folder, exist_ok=True)
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        embeddings = self.embeddings
         
         # Create metadata for each chunk
         metadatas = [{"chunk": i, "total_chunks": len(text_chunks)} for i in range(len(text_chunks))]
         
-        vector_store = FAISS.from_texts(text_chunks, embedding=embeddings, metadatas=metadatas)
-        vector_store.save_local(self.vector_store_folder)
+        vector_store = self._new_store(text_chunks, metadatas)
+        save_store(self.vector_store_folder, vector_store)
+        self.cache.invalidate(self.vector_store_folder)
         return self.vector_store_folder
 
+    def add_to_session_store(self, text_chunks, session_id, source, source_id, batch_size=256, first_chunk=0):
+        """Append chunks from one source to the session-wide index, creating it if needed.
+
+        ``text_chunks`` may be a generator of texts or of (text, position metadata) pairs, as
+        EmbeddingManager.iter_chunks yields; chunks are embedded batch by batch as they arrive.
+        ``first_chunk`` numbers the chunks when a source is appended in several parts.
+        """
+        items = (
+            self._source_item(chunk, i, source, source_id)
+            for i, chunk in enumerate(text_chunks, first_chunk)
+        )
+        return self._append_to_session_store(items, session_id, batch_size)
+
+    def update_session_store(self, session_id, removed_positions, added_chunks, source, source_id, batch_size=256):
+        """Drop the chunks at ``removed_positions`` and append ``added_chunks``, [(chunk number, chunk)].
+
+        Only the added chunks are embedded. Removing chunks renumbers the store, so it is
+        then written as a new copy that replaces the folder (see replace_store).
+        """
+        folder = f"faiss_index_session_{session_id}"
+        with timed("vector_store.update", removed=len(removed_positions), added=len(added_chunks)):
+            vector_store = load_store(folder, self.embeddings, writable=True, append=not removed_positions)
+            if removed_positions:
+                vector_store = without_positions(vector_store, removed_positions)
+            for start in range(0, len(added_chunks), batch_size):
+                batch = [
+                    self._source_item(chunk, i, source, source_id) for i, chunk in added_chunks[start:start + batch_size]
+                ]
+                vector_store = self._add_batch(vector_store, batch)
+            if removed_positions:
+                replace_store(folder, vector_store)
+            elif added_chunks:
+                save_store(folder, vector_store)
+            self.cache.invalidate(folder)
+        return folder
+
+    @staticmethod
+    def _source_item(chunk, number, source, source_id):
+        text, position = chunk if isinstance(chunk, tuple) else (chunk, {})
+        metadata = {"source": source, "source_id": source_id, "chunk": number, "chunk_hash": chunk_hash(text)}
+        return text, {**metadata, **position}
+
+    def _append_to_session_store(self, items, session_id, batch_size):
+        with timed("vector_store.add") as stage:
+            folder = self._append_batches(items, session_id, batch_size, stage)
+        return folder
+
+    def _append_batches(self, items, session_id, batch_size, stage):
+        # A local name: ingestion workers share this manager across sessions
+        folder = f"faiss_index_session_{session_id}"
+        vector_store = None
+        if store_exists(folder):
+            # Saving writes only the new rows (or a private copy of a trained index); cached readers keep their maps
+            vector_store = load_store(folder, self.embeddings, writable=True, append=True)
+
+        # A failure part-way leaves the files untouched; the partial update dies with the private copy
+        added = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            # A new trained index gets a larger first batch to train on
+            limit = batch_size
+            if vector_store is None and self.index_factory.needs_training:
+                limit = max(batch_size, self.index_factory.train_size)
+            if len(batch) >= limit:
+                vector_store = self._add_batch(vector_store, batch)
+                added += len(batch)
+                batch = []
+        if batch:
+            vector_store = self._add_batch(vector_store, batch)
+            added += len(batch)
+
+        stage["chunks"] = added
+        if added:
+            if self.index_factory.needs_rebuild(vector_store.index):
+                # The store started out flat and is now large enough for the configured index
+                vector_store.index = self.index_factory.rebuild(vector_store.index)
+            save_store(folder, vector_store)
+            # The next search maps the new files, which is near-instant
+            self.cache.invalidate(folder)
+        self.vector_store_folder = folder
+        return folder
+
+    def _add_batch(self, vector_store, batch):
+        texts = [text for text, _ in batch]
+        metadatas = [metadata for _, metadata in batch]
+        if vector_store is None:
+            return self._new_store(texts, metadatas)
+        vector_store.add_texts(texts, metadatas=metadatas)
+        return vector_store
+
+    def _new_store(self, texts, metadatas):
+        # Embed first so a trained index (IVF) can learn from these vectors before they are added
+        vectors = self.embeddings.embed_documents(list(texts))
+        index = self.index_factory.build(vectors)
+        vector_store = FAISS(self.embeddings, index, InMemoryDocstore(), {})
+        vector_store.add_embeddings(zip(texts, vectors), metadatas=metadatas)
+        return vector_store
+
+    def search(self, folders, query, k=4, source_ids=None, embedding=None):
+        """Search every distinct store once and return the global top-k documents.
+
+        A session index holds all of its sources, so this is a single search; legacy
+        per-file folders are still supported and their hits are ranked together.
+        Pass ``embedding`` to reuse an already computed query embedding.
+        """
+        search_kwargs = {"k": k}
+        if source_ids:
+            search_kwargs["filter"] = {"source_id": list(source_ids)}
+
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+
+        scored = []
+        for folder in dict.fromkeys(folders):
+            vector_store = self.load_vector_store(folder)
+            with timed("vector_store.search"):
+                scored.extend(vector_store.similarity_search_with_score_by_vector(embedding, **search_kwargs))
+
+        # Lower L2 distance means more similar
+        scored.sort(key=lambda item: item[1])
+        return [doc for doc, _ in scored[:k]]
+
     def load_vector_store(self, folder):
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        return FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+        return self.cache.get(folder, self._load_from_disk)
+
+    def _load_from_disk(self, folder):
+        with timed("vector_store.load"):
+            vector_store = load_store(folder, self.embeddings)
+        self.index_factory.configure(vector_store.index)
+        return vector_store
 
 
 class EmbeddingManager:
+    # Raw text read per plain-text segment, and rows read per spreadsheet block
+    SPLIT_BUFFER_SIZE = 8000
+    ROWS_PER_BLOCK = 2000
+
     def __init__(self):
-        load_dotenv()
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables.")
-        genai.configure(api_key=api_key)
+        # Parsing and chunking only; the Google client is configured where embeddings are created.
+        # Chunk sizes are in estimated tokens (see chunking.py)
+        chunk_tokens = int(os.getenv("CHUNK_TOKENS", 250))
+        self.text_chunker = TextChunker(chunk_tokens, int(os.getenv("CHUNK_OVERLAP_TOKENS", 50)))
+        self.table_chunker = TableChunker(chunk_tokens)
+        # Processes that parse files for the ingestion queue, started on first use
+        self.parse_workers = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+        self._pool = None
+        self._pool_lock = threading.Lock()
 
     def process_files_and_url(self, uploaded_files, url):
-        raw_text = self.get_all_text_from_files(uploaded_files)
+        # Chunk positions go in the metadata (see create_vector_store), not into the embedded text
+        return list(self.iter_text_chunks(uploaded_files, url))
+
+    def iter_text_chunks(self, uploaded_files, url=None):
+        """Yield chunk texts as they are produced; see iter_chunks."""
+        for text, _ in self.iter_chunks(uploaded_files, url):
+            yield text
+
+    def iter_chunks(self, uploaded_files, url=None):
+        """Yield (chunk text, position metadata) as chunks are produced, one page/row block/item at a time.
+
+        Only a bounded window of raw text is held in memory, so large PDFs and
+        spreadsheets are never rendered into one string. Text chunks carry their
+        character span (and pages, for PDFs), spreadsheet chunks their row range.
+        """
+        for file in uploaded_files:
+            yield from self.iter_file_chunks(file)
         if url:
-            raw_text += self.get_url_text(url)
-        text_chunks = self.get_text_chunks(raw_text)
-        return text_chunks
+            yield from self.text_chunker.iter_chunks(self._normalized(self.iter_url_segments(url)))
+
+    def iter_file_chunks(self, file):
+        if file.endswith('.csv'):
+            return self.table_chunker.iter_chunks(self.iter_csv_blocks(file))
+        if file.endswith('.xls'):
+            return self.table_chunker.iter_chunks(self.iter_xls_blocks(file))
+        return self.text_chunker.iter_chunks(self._normalized(self.iter_file_segments(file), paged=file.endswith('.pdf')))
+
+    @staticmethod
+    def _normalized(segments, paged=False):
+        for page, (file_type, segment) in enumerate(segments, 1):
+            yield normalize(segment, file_type), page if paged else None
+
+    def parse_to_spool(self, file, spool_path):
+        """Parse and chunk ``file`` in a worker process, writing its chunks to ``spool_path``.
+
+        Parsing is CPU-bound, so ingestion threads sharing this manager parse their
+        files on separate cores. Chunks come back one JSON line each (read them with
+        iter_spooled_chunks), so no process holds a whole file's chunks. Returns the
+        number of chunks.
+        """
+        with timed("ingest.parse_file", workers=self.parse_workers) as stage:
+            future = self.submit_parse(file, spool_path)
+            if future is None:
+                # With a single worker the process round trip costs more than it saves
+                stage["chunks"] = _spool_chunks(self, file, spool_path)
+            else:
+                stage["chunks"] = future.result()
+        return stage["chunks"]
+
+    def submit_parse(self, file, spool_path):
+        """Start parse_to_spool's work in the process pool and return its Future (of the chunk count).
+
+        Returns None when there is no pool (a single parse worker).
+        """
+        pool = self._parse_pool()
+        return pool.submit(_spool_file, file, spool_path) if pool is not None else None
+
+    @staticmethod
+    def iter_spooled_chunks(spool_path):
+        """Yield the (chunk text, position metadata) pairs parse_to_spool wrote."""
+        with open(spool_path, encoding="utf-8") as f:
+            for line in f:
+                text, position = json.loads(line)
+                yield text, position
+
+    def _parse_pool(self):
+        with self._pool_lock:
+            if self._pool is None and self.parse_workers > 1:
+                # Spawned, not forked: the parent runs server and ingestion threads whose locks a fork would copy
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_ingest_worker,
+                )
+            return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def iter_file_segments(self, file):
+        if file.endswith('.pdf'):
+            return self.iter_pdf_segments(file)
+        if file.endswith('.csv'):
+            return self.iter_csv_segments(file)
+        if file.endswith('.txt'):
+            return self.iter_txt_segments(file)
+        if file.endswith('.xls'):
+            return self.iter_xls_segments(file)
+        if file.endswith('.json'):
+            return self.iter_json_segments(file)
+        return iter(())
+
+    # Parser libraries are imported on first use so a cold start does not pay for them
+
+    def iter_pdf_segments(self, pdf):
+        from PyPDF2 import PdfReader
+
+        pdf_reader = PdfReader(pdf)
+        for page in pdf_reader.pages:
+            yield 'pdf', page.extract_text() or ""
+
+    def iter_csv_blocks(self, csv):
+        import pandas as pd
+
+        yield from pd.read_csv(csv, chunksize=self.ROWS_PER_BLOCK)
+
+    def iter_csv_segments(self, csv):
+        for block in self.iter_csv_blocks(csv):
+            yield 'csv', block.to_string(index=False)
+
+    def iter_txt_segments(self, txt):
+        with open(txt, encoding="utf-8", errors="replace") as f:
+            lines = []
+            size = 0
+            for line in f:
+                lines.append(line)
+                size += len(line)
+                if size >= self.SPLIT_BUFFER_SIZE:
+                    yield 'txt', "".join(lines)
+                    lines, size = [], 0
+            if lines:
+                yield 'txt', "".join(lines)
+
+    def iter_xls_blocks(self, xls):
+        import pandas as pd
+
+        # The xls format has no incremental reader, but chunking is still done per row block
+        df = pd.read_excel(xls)
+        for start in range(0, len(df), self.ROWS_PER_BLOCK):
+            yield df.iloc[start:start + self.ROWS_PER_BLOCK]
+
+    def iter_xls_segments(self, xls):
+        for block in self.iter_xls_blocks(xls):
+            yield 'xls', block.to_string(index=False)
+
+    def iter_json_segments(self, json_file):
+        with open(json_file, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for key, value in data.items():
+                yield 'json', f"{key}: {json.dumps(value, indent=2)}"
+        elif isinstance(data, list):
+            for item in data:
+                yield 'json', json.dumps(item, indent=2)
+        else:
+            yield 'json', json.dumps(data, indent=2)
+
+    def iter_url_segments(self, url):
+        from langchain_community.document_loaders import UnstructuredURLLoader
+
+        loader = UnstructuredURLLoader(urls=[url])
+        for doc in loader.lazy_load():
+            yield 'url', doc.page_content
 
     def get_all_text_from_files(self, uploaded_files):
-        raw_text = ""
-        print(uploaded_files)
-        pdf_docs = [file for file in uploaded_files if file.endswith('.pdf')]
-        csv_docs = [file for file in uploaded_files if file.endswith('.csv')]
-        txt_docs = [file for file in uploaded_files if file.endswith('.txt')]
-        xls_docs = [file for file in uploaded_files if file.endswith('.xls')]
-        json_docs = [file for file in uploaded_files if file.endswith('.json')]
-
-        if pdf_docs:
-            raw_text += self.get_pdf_text(pdf_docs)
-        if csv_docs:
-            raw_text += self.get_csv_text(csv_docs)
-        if txt_docs:
-            raw_text += self.get_txt_text(txt_docs)
-        if xls_docs:
-            raw_text += self.get_xls_text(xls_docs)
-        if json_docs:
-            raw_text += self.get_json_text(json_docs)
-
-        return raw_text
+        return "".join(segment for file in uploaded_files for _, segment in self.iter_file_segments(file))
 
     def preprocess_text(self, text, file_type):
-        # Common preprocessing
-        text = text.replace('\n', ' ').replace('\r', '')
-        
-        if file_type == 'pdf':
-            # PDF-specific preprocessing
-            text = re.sub(r'\s+', ' ', text)  # Remove extra whitespace
-        elif file_type == 'csv' or file_type == 'xls':
-            # Spreadsheet-specific preprocessing
-            text = re.sub(r'\s{2,}', ' | ', text)  # Replace multiple spaces with a delimiter
-        elif file_type == 'json':
-            # JSON-specific preprocessing
-            text = re.sub(r'[{}\[\]]', '', text)  # Remove brackets
-        
-        return text
+        return normalize(text, file_type)
 
-    # Update the get_*_text methods to use this preprocessing
     def get_pdf_text(self, pdf_docs):
-        text = ""
-        for pdf in pdf_docs:
-            pdf_reader = PdfReader(pdf)
-            for page in pdf_reader.pages:
-                text += self.preprocess_text(page.extract_text(), 'pdf') + "\n"
-        return text
-
-    # Similarly, update other get_*_text methods
+        return "".join(
+            self.preprocess_text(segment, file_type) + "\n"
+            for pdf in pdf_docs
+            for file_type, segment in self.iter_pdf_segments(pdf)
+        )
 
     def get_csv_text(self, csv_docs):
-        text = ""
-        for csv in csv_docs:
-            df = pd.read_csv(csv)
-            text += df.to_string(index=False)
-        return text
+        return "".join(segment for csv in csv_docs for _, segment in self.iter_csv_segments(csv))
 
     def get_txt_text(self, txt_docs):
-        text = ""
-        for txt in txt_docs:
-            text += txt.read().decode("utf-8")
-        return text
+        return "".join(segment for txt in txt_docs for _, segment in self.iter_txt_segments(txt))
 
     def get_xls_text(self, xls_docs):
-        text = ""
-        for xls in xls_docs:
-            df = pd.read_excel(xls)
-            text += df.to_string(index=False)
-        return text
+        return "".join(segment for xls in xls_docs for _, segment in self.iter_xls_segments(xls))
 
     def get_json_text(self, json_docs):
-        text = ""
-        for json_file in json_docs:
-            data = json.load(json_file)
-            text += json.dumps(data, indent=2)
-        return text
+        return "".join(segment for json_file in json_docs for _, segment in self.iter_json_segments(json_file))
 
     def get_url_text(self, url):
-        loader = UnstructuredURLLoader(urls=[url])
-        documents = loader.load()
-        text = "\n".join([doc.page_content for doc in documents])
-        return text
+        return "\n".join(segment for _, segment in self.iter_url_segments(url))
 
     def get_text_chunks(self, text):
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", ". ", ", ", " "],
-            length_function=len
-        )
-        chunks = text_splitter.split_text(text)
-        
-        # Add metadata to each chunk
-        for i, chunk in enumerate(chunks):
-            chunks[i] = f"Chunk {i+1} of {len(chunks)}:\n{chunk}"
-        
-        return chunks
+        return [chunk for chunk, _ in self.text_chunker.split(text)]
+
+
+# Per-process EmbeddingManager for ingestion workers, built once by the pool initializer
+_worker_manager = None
+
+
+def _init_ingest_worker():
+    global _worker_manager
+    _worker_manager = EmbeddingManager()
+
 
+def _spool_file(file, spool_path):
+    return _spool_chunks(_worker_manager, file, spool_path)
 
 
+def _spool_chunks(manager, file, spool_path):
+    count = 0
+    with open(spool_path, "w", encoding="utf-8") as f:
+        for chunk in manager.iter_chunks([file]):
+            f.write(json.dumps(chunk) + "\n")
+            count += 1
+    return count
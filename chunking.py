@@ -0,0 +1,188 @@
+import re
+import numpy as np
+
+# Sizes are in estimated tokens, ~4 characters each. estimate_tokens and estimate_message_tokens
+# are the one estimate the chunkers, the retriever's context budget, the agent's history budget
+# and the model gateway's rate limits share
+CHARS_PER_TOKEN = 4
+
+# One translate() call per segment does the newline handling every type shares, plus the
+# per-type character removals; at most one whitespace pass follows
+_NEWLINES = {ord("\n"): " ", ord("\r"): None}
+_TRANSLATIONS = {
+    "json": {**_NEWLINES, **{ord(c): None for c in "{}[]"}},
+}
+# Extraction whitespace in PDFs is collapsed with str.split, which beats an \s+ regex
+_COLLAPSE_WHITESPACE = {"pdf"}
+_PATTERNS = {
+    "csv": (re.compile(r"\s{2,}"), " | "),   # column padding becomes a delimiter
+    "xls": (re.compile(r"\s{2,}"), " | "),
+}
+
+# Chunk ends are searched for with rfind, preferring the end of a sentence to a word break
+SENTENCE_ENDS = (". ", "? ", "! ")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def estimate_message_tokens(messages):
+    # Avoids a count_tokens API round trip per call
+    return estimate_tokens("".join(str(message.content) for message in messages))
+
+
+def normalize(text, file_type):
+    """Normalize extracted text for ``file_type`` in one translate and at most one whitespace pass."""
+    if file_type in _COLLAPSE_WHITESPACE:
+        return " ".join(text.split())
+    text = text.translate(_TRANSLATIONS.get(file_type, _NEWLINES))
+    pattern = _PATTERNS.get(file_type)
+    if pattern is not None:
+        text = pattern[0].sub(pattern[1], text)
+    return text
+
+
+class TextChunker:
+    """Cuts text into chunks of up to ``chunk_tokens`` that overlap by about ``overlap_tokens``.
+
+    Chunks end at a sentence end where possible, else at a word break, found with
+    str.rfind rather than by splitting the text into pieces. Works on a stream of
+    segments (pages, text blocks), so a source is never held in memory as one
+    string. Each chunk comes with its character span in the source's normalized
+    text (segments joined by one space) and, for paged sources, the pages it covers.
+    """
+
+    def __init__(self, chunk_tokens=250, overlap_tokens=50):
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_chars = chunk_tokens * CHARS_PER_TOKEN
+        self.overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+
+    def split(self, text):
+        """Return [(chunk text, metadata)] for a single string."""
+        return list(self.iter_chunks([(text, None)]))
+
+    def iter_chunks(self, segments):
+        """Yield (chunk text, metadata) from [(normalized segment text, page or None)]."""
+        buffer = ""
+        offset = 0    # position of buffer[0] in the source text
+        position = 0  # start of the next chunk in buffer
+        pages = []    # [(source offset, page)] where each buffered segment starts
+        for text, page in segments:
+            # Drop what every chunk is past before growing the buffer
+            buffer = buffer[position:]
+            offset += position
+            position = 0
+            while len(pages) > 1 and pages[1][0] <= offset:
+                pages.pop(0)
+            if buffer:
+                buffer += " "
+            pages.append((offset + len(buffer), page))
+            buffer += text
+            while len(buffer) - position > 2 * self.max_chars:
+                chunk, position = self._next(buffer, position, offset, pages)
+                if chunk is not None:
+                    yield chunk
+        while position < len(buffer):
+            chunk, position = self._next(buffer, position, offset, pages)
+            if chunk is not None:
+                yield chunk
+
+    def _next(self, buffer, position, offset, pages):
+        """Return (chunk or None, start of the next chunk) for the chunk starting at ``position``."""
+        cut = self._cut(buffer, position)
+        text = buffer[position:cut].strip()
+        chunk = None
+        if text:
+            start = offset + position + (len(buffer[position:cut]) - len(buffer[position:cut].lstrip()))
+            chunk = text, self._metadata(start, start + len(text), pages)
+        if cut >= len(buffer):
+            return chunk, cut
+        return chunk, self._overlap_start(buffer, position, cut)
+
+    def _cut(self, buffer, position):
+        limit = position + self.max_chars
+        if limit >= len(buffer):
+            return len(buffer)
+        # Not before half a chunk, so chunks do not come out tiny
+        earliest = position + self.max_chars // 2
+        end = max(buffer.rfind(mark, earliest, limit + 1) for mark in SENTENCE_ENDS)
+        if end != -1:
+            return end + 1
+        end = buffer.rfind(" ", earliest, limit)
+        return end if end != -1 else limit
+
+    def _overlap_start(self, buffer, position, cut):
+        if not self.overlap_chars:
+            return cut
+        # The next chunk restarts at the first sentence (else word) boundary within the overlap
+        target = max(position + 1, cut - self.overlap_chars)
+        starts = [buffer.find(mark, target, cut) for mark in SENTENCE_ENDS]
+        starts = [start + 2 for start in starts if start != -1]
+        if starts:
+            return min(starts)
+        start = buffer.find(" ", target, cut)
+        return start + 1 if start != -1 else cut
+
+    @staticmethod
+    def _metadata(start, end, pages):
+        metadata = {"start": start, "end": end}
+        if pages and pages[0][1] is not None:
+            metadata["page_start"] = max(page for page_offset, page in pages if page_offset <= start)
+            metadata["page_end"] = max(page for page_offset, page in pages if page_offset < end)
+        return metadata
+
+
+class TableChunker:
+    """Chunks tabular sources by whole rows, straight from DataFrame blocks.
+
+    Each row becomes ``value | value | ...`` with vectorized string operations (no
+    padded to_string rendering), and every chunk repeats the header line so it can
+    be read on its own. Chunk metadata holds the half-open row range it covers.
+    """
+
+    def __init__(self, chunk_tokens=250):
+        self.chunk_tokens = chunk_tokens
+
+    def iter_chunks(self, blocks):
+        """Yield (chunk text, metadata) from an iterable of DataFrames with the same columns."""
+        header = None
+        pending = []   # rendered rows carried over from the previous block
+        first_row = 0
+        for block in blocks:
+            if header is None:
+                header = " | ".join(map(str, block.columns))
+            rows = pending + self._render(block)
+            lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows)) + 1
+            ends = np.cumsum(lengths)
+            budget = max(1, self.chunk_tokens * CHARS_PER_TOKEN - len(header))
+
+            start = 0
+            while start < len(rows):
+                used = ends[start - 1] if start else 0
+                # As many rows as fit the budget, and always at least one
+                stop = max(start + 1, int(np.searchsorted(ends, used + budget, side="right")))
+                if stop >= len(rows):
+                    break
+                yield self._chunk(header, rows, start, stop, first_row)
+                start = stop
+            # The block's last, partly filled chunk may grow with the next block's rows
+            pending = rows[start:]
+            first_row += start
+        if pending:
+            yield self._chunk(header, pending, 0, len(pending), first_row)
+
+    @staticmethod
+    def _render(block):
+        if block.empty:
+            return []
+        columns = [block[column].astype(str).where(block[column].notna(), "") for column in block.columns]
+        if len(columns) == 1:
+            return columns[0].tolist()
+        return columns[0].str.cat(columns[1:], sep=" | ").tolist()
+
+    @staticmethod
+    def _chunk(header, rows, start, stop, first_row):
+        text = header + "\n" + "\n".join(rows[start:stop])
+        return text, {"row_start": first_row + start, "row_end": first_row + stop}
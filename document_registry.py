@@ -0,0 +1,154 @@
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+from memory import connect
+from vector_storage import STORE_PREFIX, SWAP_SUFFIXES, chunk_hash
+
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_text(chunk):
+    # Chunks are texts or (text, position metadata) pairs from EmbeddingManager.iter_chunks
+    return chunk[0] if isinstance(chunk, tuple) else chunk
+
+
+def chunks_hash(chunks):
+    # Content hash of a URL, which has no file to hash before it is fetched and parsed
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk_hash(chunk_text(chunk)).encode("ascii"))
+    return digest.hexdigest()
+
+
+def diff_chunks(saved, chunks):
+    """Compare a source's saved chunks, [(position, chunk hash)], with its new chunks.
+
+    Returns (positions to remove, [(chunk number, chunk)] to add); chunks whose hash is
+    unchanged, wherever they moved to, are kept as they are.
+    """
+    positions_by_hash = {}
+    for position, digest in saved:
+        positions_by_hash.setdefault(digest, []).append(position)
+
+    added = []
+    for number, chunk in enumerate(chunks):
+        positions = positions_by_hash.get(chunk_hash(chunk_text(chunk)))
+        if positions:
+            positions.pop()
+        else:
+            added.append((number, chunk))
+    removed = [position for positions in positions_by_hash.values() for position in positions]
+    return removed, added
+
+
+class DocumentRegistry:
+    """Which sources each session has indexed, by content hash, and in which store.
+
+    A document is identified by its source id within a session, so two uploads with
+    the same file name are two documents. Re-submitting under an existing source id
+    replaces that document: unchanged content is skipped, changed content is diffed
+    chunk by chunk against the hashes saved in the store.
+    """
+
+    def __init__(self, db_name="agent_memory.db"):
+        self.conn = connect(db_name)
+        self.lock = threading.Lock()
+        self.initialize_db()
+
+    def initialize_db(self):
+        with self.lock:
+            # Documents used to be keyed by source name; such a table is rebuilt keyed by source id
+            keyed_by_name = any(
+                column[1] == "source" and column[5] for column in self.conn.execute("PRAGMA table_info(documents)")
+            )
+            if keyed_by_name:
+                self.conn.execute("ALTER TABLE documents RENAME TO documents_by_source")
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                session_id TEXT NOT NULL,
+                source TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                content_hash TEXT,
+                vector_store TEXT,
+                chunks INTEGER,
+                updated_at TEXT,
+                PRIMARY KEY (session_id, source_id)
+            )
+            """)
+            if keyed_by_name:
+                self.conn.execute("""
+                INSERT OR IGNORE INTO documents
+                SELECT session_id, source, source_id, content_hash, vector_store, chunks, updated_at
+                FROM documents_by_source
+                """)
+                self.conn.execute("DROP TABLE documents_by_source")
+            self.conn.commit()
+
+    def get(self, session_id, source_id):
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM documents WHERE session_id = ? AND source_id = ?", (session_id, source_id)
+            )
+            row = cursor.fetchone()
+            return {column[0]: value for column, value in zip(cursor.description, row)} if row else None
+
+    def put(self, session_id, source, source_id, content_hash, vector_store, chunks):
+        with self.lock:
+            try:
+                self.conn.execute("""
+                INSERT OR REPLACE INTO documents
+                    (session_id, source, source_id, content_hash, vector_store, chunks, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (session_id, source, source_id, content_hash, vector_store, chunks, datetime.now().isoformat()))
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+
+    def session_stores(self, session_id):
+        """Return the store folders of the session's indexed documents."""
+        with self.lock:
+            return sorted(row[0] for row in self.conn.execute(
+                "SELECT DISTINCT vector_store FROM documents WHERE session_id = ? AND vector_store IS NOT NULL",
+                (session_id,),
+            ))
+
+    def stores(self):
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT DISTINCT vector_store FROM documents")}
+
+    def collect_garbage(self, referenced=(), root=".", min_age=3600):
+        """Delete store folders under ``root`` that no document or ``referenced`` names.
+
+        Folders modified in the last ``min_age`` seconds are left alone, since a store
+        being written is not registered yet. Returns the deleted folder names.
+        """
+        keep = self.stores() | set(referenced)
+        deleted = []
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if not name.startswith(STORE_PREFIX) or not os.path.isdir(path):
+                continue
+            if time.time() - os.path.getmtime(path) < min_age:
+                continue
+            base, suffix = name, None
+            for swap_suffix in SWAP_SUFFIXES:
+                if name.endswith(swap_suffix):
+                    base, suffix = name[:-len(swap_suffix)], swap_suffix
+            if base in keep:
+                # A swap leftover is only needed while its store folder is missing (see vector_storage)
+                if suffix is None or not os.path.isdir(os.path.join(root, base)):
+                    continue
+            shutil.rmtree(path, ignore_errors=True)
+            deleted.append(name)
+        return deleted
@@ -0,0 +1,111 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.embeddings import Embeddings
+from metrics import registry, timed
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent content-hash -> float32 vector cache backed by SQLite."""
+
+    def __init__(self, db_name="embedding_cache.db"):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS embeddings (
+            namespace TEXT,
+            hash TEXT,
+            vector BLOB,
+            PRIMARY KEY (namespace, hash)
+        )
+        """)
+        self._conn.commit()
+
+    def get_many(self, namespace, hashes):
+        found = {}
+        hashes = list(hashes)
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE namespace = ? AND hash IN ({placeholders})",
+                    (namespace, *batch),
+                ).fetchall()
+            for hash_, blob in rows:
+                found[hash_] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, namespace, items):
+        rows = [(namespace, hash_, np.asarray(vector, dtype=np.float32).tobytes()) for hash_, vector in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (namespace, hash, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that dedupes texts, reuses cached vectors and batches the misses.
+
+    Any LangChain ``Embeddings`` can be wrapped, so a deterministic local fake can
+    stand in for the Google client.
+    """
+
+    def __init__(self, embedder, cache=None, namespace="default", batch_size=100, max_concurrency=4):
+        self.embedder = embedder
+        self.cache = cache
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts):
+        with timed("embeddings.embed_documents", texts=len(texts)):
+            return self._embed_documents(texts)
+
+    def _embed_documents(self, texts):
+        hashes = [content_hash(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+
+        vectors = self.cache.get_many(self.namespace, unique) if self.cache is not None else {}
+        missing = [(hash_, text) for hash_, text in unique.items() if hash_ not in vectors]
+        self.hits += len(unique) - len(missing)
+        self.misses += len(missing)
+        registry.increment("embeddings.cache_hits", len(unique) - len(missing))
+        registry.increment("embeddings.cache_misses", len(missing))
+
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(batches)))) as executor:
+                results = executor.map(self._embed_batch, batches)
+                for batch, batch_vectors in zip(batches, results):
+                    new_items = [(hash_, vector) for (hash_, _), vector in zip(batch, batch_vectors)]
+                    vectors.update(new_items)
+                    if self.cache is not None:
+                        self.cache.put_many(self.namespace, new_items)
+
+        return [vectors[hash_] for hash_ in hashes]
+
+    def embed_query(self, text):
+        return self.embedder.embed_query(text)
+
+    async def aembed_query(self, text):
+        return await self.embedder.aembed_query(text)
+
+    def _embed_batch(self, batch):
+        return self.embedder.embed_documents([text for _, text in batch])
@@ -0,0 +1,305 @@
+import time
+import json
+import asyncio
+import hashlib
+import threading
+from collections import deque
+import aiohttp
+import requests
+import numpy as np
+from aiohttp import web
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from chunking import estimate_message_tokens, estimate_tokens
+from model_gateway import RateLimited
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic offline embeddings: the mean of per-word random vectors seeded by the word's hash.
+
+    Texts that share words get similar vectors, so retrieval behaves like it does
+    on real text. ``latency`` seconds are spent per call to stand in for the API.
+    """
+
+    def __init__(self, dim=768, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self._words = {}
+
+    def _word_vector(self, word):
+        if word not in self._words:
+            seed = int.from_bytes(hashlib.sha1(word.encode("utf-8")).digest()[:8], "little")
+            self._words[word] = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return self._words[word]
+
+    def _embed(self, text):
+        words = text.lower().split() or [""]
+        vector = np.mean([self._word_vector(word) for word in words], axis=0)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    async def aembed_documents(self, texts):
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline chat model with configurable latency.
+
+    Waits ``latency`` seconds before answering and ``token_latency`` per output
+    token, streams word by word, and reports estimated token usage. With
+    ``tool_call_every`` = N, every Nth user turn first calls the ``add`` tool.
+    """
+
+    answer: str = "Based on the documents, the requested total is 42.00 and it is due on 01/15/2024."
+    latency: float = 0.0
+    token_latency: float = 0.0
+    tool_call_every: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages):
+        input_tokens = estimate_message_tokens(messages)
+        human_turns = sum(isinstance(message, HumanMessage) for message in messages)
+        if (
+            self.tool_call_every
+            and isinstance(messages[-1], HumanMessage)
+            and human_turns % self.tool_call_every == 0
+        ):
+            tool_call = {"name": "add", "args": {"a": human_turns, "b": 1}, "id": f"call_{human_turns}"}
+            return AIMessage(content="", tool_calls=[tool_call], usage_metadata={
+                "input_tokens": input_tokens, "output_tokens": 10, "total_tokens": input_tokens + 10,
+            })
+        if isinstance(messages[-1], ToolMessage):
+            content = f"The result is {messages[-1].content}."
+        else:
+            content = self.answer
+        output_tokens = estimate_tokens(content)
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        })
+
+    def _delay(self, message):
+        return self.latency + self.token_latency * estimate_tokens(str(message.content))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        time.sleep(self._delay(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        await asyncio.sleep(self._delay(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message):
+        if message.tool_calls:
+            tool_call_chunks = [
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]
+            yield AIMessageChunk(content="", tool_call_chunks=tool_call_chunks, usage_metadata=message.usage_metadata)
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield AIMessageChunk(
+                content=word if last else word + " ",
+                usage_metadata=message.usage_metadata if last else None,
+            )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        time.sleep(self.latency)
+        for chunk in self._chunks(message):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(message):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+
+class FakeModelServer:
+    """Local HTTP stand-in for a model API with a request quota.
+
+    POST /chat {"messages": [{"type", "content"}]} answers like FakeChatModel and
+    POST /embed {"texts": [...]} like FakeEmbeddings, after ``latency`` seconds.
+    Beyond ``limit`` requests in the last ``window`` seconds it answers 429 with
+    Retry-After, and every ``fail_every``-th request gets a 503, so retry and
+    rate-limit handling can be exercised offline. ``start()`` returns the base URL.
+    """
+
+    def __init__(self, limit=60, window=60.0, fail_every=0, latency=0.05, dim=768):
+        self.limit = limit
+        self.window = window
+        self.fail_every = fail_every
+        self.latency = latency
+        self.model = FakeChatModel()
+        self.embeddings = FakeEmbeddings(dim=dim)
+        self.stats = {"requests": 0, "rate_limited": 0, "failed": 0, "answered": 0, "texts_embedded": 0}
+        self._recent = deque()
+        self._loop = None
+        self._runner = None
+
+    def start(self, host="127.0.0.1", port=0):
+        started = threading.Event()
+        address = []
+
+        async def serve():
+            app = web.Application()
+            app.add_routes([web.post("/chat", self._chat), web.post("/embed", self._embed)])
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, host, port).start()
+            address.extend(self._runner.addresses[0][:2])
+            started.set()
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="fake-model-server", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(serve(), self._loop)
+        started.wait()
+        return f"http://{address[0]}:{address[1]}"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _admit(self):
+        # Returns an error response, or None when the request is served
+        self.stats["requests"] += 1
+        now = time.monotonic()
+        while self._recent and self._recent[0] <= now - self.window:
+            self._recent.popleft()
+        if len(self._recent) >= self.limit:
+            self.stats["rate_limited"] += 1
+            retry_after = self._recent[0] + self.window - now
+            return web.json_response(
+                {"error": "quota exceeded"}, status=429, headers={"Retry-After": f"{retry_after:.3f}"}
+            )
+        self._recent.append(now)
+        if self.fail_every and self.stats["requests"] % self.fail_every == 0:
+            self.stats["failed"] += 1
+            return web.json_response({"error": "unavailable"}, status=503)
+        return None
+
+    async def _chat(self, request):
+        body = await request.json()
+        error = self._admit()
+        if error is not None:
+            return error
+        await asyncio.sleep(self.latency)
+        messages = [
+            HumanMessage(content=m["content"]) if m["type"] == "human" else AIMessage(content=m["content"])
+            for m in body["messages"]
+        ]
+        message = self.model._respond(messages)
+        self.stats["answered"] += 1
+        return web.json_response({"content": message.content, "usage": message.usage_metadata})
+
+    async def _embed(self, request):
+        body = await request.json()
+        error = self._admit()
+        if error is not None:
+            return error
+        await asyncio.sleep(self.latency)
+        self.stats["texts_embedded"] += len(body["texts"])
+        return web.json_response({"vectors": self.embeddings.embed_documents(body["texts"])})
+
+
+class HttpStatusError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"HTTP {status_code}: {text}")
+        self.status_code = status_code
+
+
+def _check(status, headers, text):
+    if status == 429:
+        retry_after = headers.get("Retry-After")
+        raise RateLimited(text, float(retry_after) if retry_after else None)
+    if status >= 400:
+        raise HttpStatusError(status, text)
+
+
+class FakeHttpChatModel(BaseChatModel):
+    """Chat client of FakeModelServer; raises RateLimited on 429 and HttpStatusError on other errors."""
+
+    base_url: str
+    timeout: float = 30.0
+
+    @property
+    def _llm_type(self):
+        return "fake-http-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    @staticmethod
+    def _payload(messages):
+        return {"messages": [{"type": message.type, "content": str(message.content)} for message in messages]}
+
+    @staticmethod
+    def _result(body):
+        message = AIMessage(content=body["content"], usage_metadata=body["usage"])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        response = requests.post(f"{self.base_url}/chat", json=self._payload(messages), timeout=self.timeout)
+        _check(response.status_code, response.headers, response.text)
+        return self._result(response.json())
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as http:
+            async with http.post(f"{self.base_url}/chat", json=self._payload(messages)) as response:
+                _check(response.status, response.headers, await response.text())
+                return self._result(await response.json())
+
+
+class FakeHttpEmbeddings(Embeddings):
+    """Embeddings client of FakeModelServer, with the same errors as FakeHttpChatModel."""
+
+    def __init__(self, base_url, timeout=30.0):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def embed_documents(self, texts):
+        response = requests.post(f"{self.base_url}/embed", json={"texts": list(texts)}, timeout=self.timeout)
+        _check(response.status_code, response.headers, response.text)
+        return response.json()["vectors"]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as http:
+            async with http.post(f"{self.base_url}/embed", json={"texts": list(texts)}) as response:
+                _check(response.status, response.headers, await response.text())
+                return (await response.json())["vectors"]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,88 @@
+"""Gemini clients that send exactly one request per call.
+
+langchain_google_genai retries on its own twice over: a tenacity decorator
+(2 attempts on any Google API error) around every chat request, and
+google-api-core's default Retry on 503 inside the client (up to 600 s for
+generate_content, 60 s for embeddings). Under the model gateway, which already
+retries with backoff against the rate limits and the call's deadline, those
+layers multiply the attempts and hide their waits from the deadline, so these
+subclasses pass ``retry=None`` and leave retrying to the gateway.
+"""
+from google.ai.generativelanguage_v1beta.types import BatchEmbedContentsRequest
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_google_genai.chat_models import _response_to_result
+
+REQUEST_OPTIONS = ("tools", "functions", "safety_settings", "tool_config", "generation_config")
+
+
+class GeminiChat(ChatGoogleGenerativeAI):
+    """ChatGoogleGenerativeAI without client-side retries; errors reach the caller on the first failure."""
+
+    max_retries: int = 0
+
+    def _request(self, messages, stop, kwargs):
+        return self._prepare_request(messages, stop=stop, **{name: kwargs.get(name) for name in REQUEST_OPTIONS})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        response = self.client.generate_content(
+            request=self._request(messages, stop, kwargs), metadata=self.default_metadata, retry=None
+        )
+        return _response_to_result(response)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not self.async_client:
+            # Runs _generate in an executor
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        response = await self.async_client.generate_content(
+            request=self._request(messages, stop, kwargs), metadata=self.default_metadata, retry=None
+        )
+        return _response_to_result(response)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        response = self.client.stream_generate_content(
+            request=self._request(messages, stop, kwargs), metadata=self.default_metadata, retry=None
+        )
+        for chunk in response:
+            generation = _response_to_result(chunk, stream=True).generations[0]
+            if run_manager:
+                run_manager.on_llm_new_token(generation.text)
+            yield generation
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        if not self.async_client:
+            async for generation in super()._astream(messages, stop, run_manager, **kwargs):
+                yield generation
+            return
+        response = await self.async_client.stream_generate_content(
+            request=self._request(messages, stop, kwargs), metadata=self.default_metadata, retry=None
+        )
+        async for chunk in response:
+            generation = _response_to_result(chunk, stream=True).generations[0]
+            if run_manager:
+                await run_manager.on_llm_new_token(generation.text)
+            yield generation
+
+
+class GeminiEmbeddings(GoogleGenerativeAIEmbeddings):
+    """GoogleGenerativeAIEmbeddings without client-side retries.
+
+    API errors are raised as they are, not wrapped, so the gateway can read their status.
+    """
+
+    def embed_documents(self, texts, *, batch_size=100, task_type=None, titles=None, output_dimensionality=None):
+        embeddings = []
+        start = 0
+        for batch in self._prepare_batches(texts, batch_size):
+            batch_titles = titles[start:start + len(batch)] if titles else [None] * len(batch)
+            start += len(batch)
+            requests = [
+                self._prepare_request(
+                    text=text, task_type=task_type, title=title, output_dimensionality=output_dimensionality
+                )
+                for text, title in zip(batch, batch_titles)
+            ]
+            result = self.client.batch_embed_contents(
+                BatchEmbedContentsRequest(requests=requests, model=self.model), retry=None
+            )
+            embeddings.extend(list(embedding.values) for embedding in result.embeddings)
+        return embeddings
@@ -0,0 +1,404 @@
+import os
+import uuid
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+from itertools import islice
+from memory import connect
+from vector_storage import INDEX_FILE, store_exists
+from document_registry import DocumentRegistry, chunks_hash, diff_chunks, file_hash
+from metrics import log_event, registry, timed
+
+JOB_STATUSES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class IngestionQueue:
+    """SQLite-backed queue of ingestion jobs, run by a pool of worker threads.
+
+    One job indexes one file or URL into its session's store. Chunks are saved in
+    parts of ``commit_every``, so progress survives a restart: a job left running
+    is queued again and skips the chunks of its source already in the store.
+    Flat stores append each part in place; saving a trained index rewrites it
+    whole, so for those a part is at least as large as the store already is.
+    Jobs of one session run one at a time since they append to the same store.
+    A job that is cancelled or fails removes the chunks it saved, so only sources
+    of registered documents are searchable.
+    Files are parsed in the embedding manager's process pool, ahead of their turn:
+    up to ``prefetch`` queued file jobs (default INGEST_WORKERS) are parsed while
+    earlier jobs embed and write, so a many-file upload to one session parses on
+    every core and only the store appends wait for each other.
+    A job submitted with the source id of a document the session already indexed
+    replaces that document: it is skipped when unchanged and otherwise diffed, so
+    only its changed chunks are embedded.
+    """
+
+    def __init__(self, vector_store_manager, embedding_manager, db_name="agent_memory.db", workers=None,
+                 commit_every=None, poll_interval=1.0, prefetch=None):
+        self.vector_store_manager = vector_store_manager
+        self.embedding_manager = embedding_manager
+        self.workers = workers or int(os.getenv("INGEST_JOB_WORKERS", 2))
+        self.commit_every = commit_every or int(os.getenv("INGEST_COMMIT_CHUNKS", 2048))
+        self.poll_interval = poll_interval
+        if prefetch is None:
+            # Without a pool there is nothing to parse alongside the running job
+            prefetch = embedding_manager.parse_workers if embedding_manager.parse_workers > 1 else 0
+        self.prefetch = prefetch
+        self.conn = connect(db_name)
+        self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._store_locks = {}  # {session_id: Lock} held while a session store is written
+        self._parsed = {}  # {job_id: (Future, spool path)} for queued jobs parsed ahead
+        self._parse_lock = threading.Lock()
+        self.documents = DocumentRegistry(db_name)
+        self.initialize_db()
+
+    def initialize_db(self):
+        with self.lock:
+            self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                source TEXT,
+                source_id TEXT,
+                path TEXT,
+                url TEXT,
+                status TEXT NOT NULL,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                chunks_total INTEGER,
+                vector_store TEXT,
+                error TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_ingest_jobs_session ON ingest_jobs (session_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, created_at);
+            """)
+            self.conn.commit()
+
+    def submit(self, session_id, source, source_id, path=None, url=None):
+        """Queue ``path`` or ``url`` for indexing into the session store and return the job id.
+
+        A ``source_id`` the session already has replaces that document; a new one adds a document.
+        """
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        with self.lock:
+            self.conn.execute("""
+            INSERT INTO ingest_jobs (id, session_id, source, source_id, path, url, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)
+            """, (job_id, session_id, source, source_id, path, url, now, now))
+            self.conn.commit()
+        registry.increment("ingest_jobs.submitted")
+        self._prefetch()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            return self._as_dict(cursor, row) if row else None
+
+    def list_jobs(self, session_id):
+        """Return the session's jobs as dicts, oldest first."""
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM ingest_jobs WHERE session_id = ? ORDER BY created_at", (session_id,)
+            )
+            return [self._as_dict(cursor, row) for row in cursor.fetchall()]
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or a running one after its current part is saved.
+
+        Either way the chunks the job saved are removed from the session store.
+        """
+        job = self.get(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        self._update(job_id, "status IN ('queued', 'running')", status="cancelled")
+        self._drop_parsed(job_id)
+        if job["status"] == "queued" and job["chunks_done"]:
+            # Requeued by a restart with parts already saved; a running job removes its own
+            self._discard(job)
+
+    def start(self):
+        if not self._threads:
+            # Jobs interrupted by a restart continue where their saved chunks end
+            with self.lock:
+                self.conn.execute("UPDATE ingest_jobs SET status = 'queued' WHERE status = 'running'")
+                self.conn.commit()
+                cursor = self.conn.execute(
+                    "SELECT * FROM ingest_jobs WHERE status IN ('cancelled', 'failed') AND chunks_done > 0"
+                )
+                leftovers = [self._as_dict(cursor, row) for row in cursor.fetchall()]
+            # Chunks of jobs that stopped before a crash could remove them
+            for job in leftovers:
+                self._discard(job)
+            if os.getenv("STORE_GC", "1") != "0":
+                self.collect_garbage()
+            self._stop.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"ingest-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._parse_lock:
+            parsed = list(self._parsed)
+        for job_id in parsed:
+            self._drop_parsed(job_id)
+        self.embedding_manager.close()
+
+    def collect_garbage(self, min_age=24 * 3600):
+        """Delete vector store folders no registered document or job refers to."""
+        with self.lock:
+            referenced = {row[0] for row in self.conn.execute(
+                "SELECT vector_store FROM ingest_jobs WHERE vector_store IS NOT NULL"
+            )}
+            # Stores that unfinished jobs are about to write to
+            referenced |= {f"faiss_index_session_{row[0]}" for row in self.conn.execute(
+                "SELECT session_id FROM ingest_jobs WHERE status IN ('queued', 'running')"
+            )}
+        deleted = self.documents.collect_garbage(referenced, min_age=min_age)
+        if deleted:
+            registry.increment("ingest_jobs.gc_deleted", len(deleted))
+            log_event("ingest_jobs.gc", deleted=deleted)
+        return deleted
+
+    def _work(self):
+        while not self._stop.is_set():
+            self._prefetch()
+            job = self._claim()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                registry.increment("ingest_jobs.failed")
+                self._update(job["id"], "status = 'running'", status="failed", error=repr(e))
+                log_event("ingest_jobs.failed", job_id=job["id"], error=repr(e))
+                self._discard(job)
+            finally:
+                # Parsed ahead but not needed, e.g. an unchanged document
+                self._drop_parsed(job["id"])
+
+    def _claim(self):
+        with self.lock:
+            # Oldest queued job of a session that has no job running
+            cursor = self.conn.execute("""
+            SELECT * FROM ingest_jobs WHERE status = 'queued' AND session_id NOT IN (
+                SELECT session_id FROM ingest_jobs WHERE status = 'running'
+            ) ORDER BY created_at LIMIT 1
+            """)
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            job = self._as_dict(cursor, row)
+            self.conn.execute(
+                "UPDATE ingest_jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (datetime.now().isoformat(), job["id"]),
+            )
+            self.conn.commit()
+        return job
+
+    def _run(self, job):
+        manager = self.vector_store_manager
+        folder = f"faiss_index_session_{job['session_id']}"
+        chunks = None
+        if job["path"]:
+            content_hash = file_hash(job["path"])
+        else:
+            # A URL has to be fetched and parsed before it can be compared
+            chunks = list(self.embedding_manager.iter_chunks([], job["url"]))
+            content_hash = chunks_hash(chunks)
+
+        document = self.documents.get(job["session_id"], job["source_id"])
+        if document and store_exists(document["vector_store"]):
+            self._reingest(job, document, content_hash, chunks)
+            return
+
+        done = 0
+        if store_exists(folder):
+            # The store, not the job row, says what was saved; a crash between the two cannot duplicate chunks
+            done = manager.load_vector_store(folder).docstore.count_source(job["source_id"])
+
+        if chunks is None:
+            chunks = self._file_chunks(job)
+        chunks = islice(chunks, done, None)
+
+        with timed("ingest_jobs.run", resumed_at=done) as stage:
+            while True:
+                part = list(islice(chunks, self._part_size(folder)))
+                if not part:
+                    break
+                with self._store_lock(job["session_id"]):
+                    # Checked under the lock: once cancelled, the session's next job may start writing
+                    if self.get(job["id"])["status"] != "running":
+                        stage["cancelled"] = True
+                        break
+                    folder = manager.add_to_session_store(
+                        part, job["session_id"], job["source"], job["source_id"], first_chunk=done
+                    )
+                done += len(part)
+                self._update(job["id"], "status = 'running'", chunks_done=done, vector_store=folder)
+            stage["chunks"] = done
+        if stage.get("cancelled"):
+            self._discard(job)
+            return
+
+        if done:
+            self.documents.put(job["session_id"], job["source"], job["source_id"], content_hash, folder, done)
+        registry.increment("ingest_jobs.done")
+        self._update(
+            job["id"], "status = 'running'",
+            status="done", chunks_done=done, chunks_total=done, vector_store=folder if done else None,
+        )
+
+    def _reingest(self, job, document, content_hash, chunks):
+        # A new version of a document the session already has, which keeps its unchanged chunks
+        folder = document["vector_store"]
+        source_id = job["source_id"]
+        if document["content_hash"] == content_hash:
+            registry.increment("ingest_jobs.unchanged")
+            done = document["chunks"]
+        else:
+            if chunks is None:
+                chunks = list(self._file_chunks(job))
+            saved = self.vector_store_manager.load_vector_store(folder).docstore.source_chunks(source_id)
+            removed, added = diff_chunks(saved, chunks)
+            with timed("ingest_jobs.reingest", removed=len(removed), added=len(added), kept=len(chunks) - len(added)), \
+                    self._store_lock(job["session_id"]):
+                folder = self.vector_store_manager.update_session_store(
+                    job["session_id"], removed, added, job["source"], source_id
+                )
+            done = len(chunks)
+            self.documents.put(job["session_id"], job["source"], source_id, content_hash, folder, done)
+        registry.increment("ingest_jobs.done")
+        self._update(
+            job["id"], "status = 'running'", status="done", chunks_done=done, chunks_total=done, vector_store=folder,
+        )
+
+    def _discard(self, job):
+        # Remove the chunks a cancelled or failed job saved; a registered document's chunks stay
+        if self.documents.get(job["session_id"], job["source_id"]):
+            return
+        folder = f"faiss_index_session_{job['session_id']}"
+        try:
+            with self._store_lock(job["session_id"]):
+                if store_exists(folder):
+                    store = self.vector_store_manager.load_vector_store(folder)
+                    positions = [position for position, _ in store.docstore.source_chunks(job["source_id"])]
+                    if positions:
+                        self.vector_store_manager.update_session_store(
+                            job["session_id"], positions, [], job["source"], job["source_id"]
+                        )
+                        registry.increment("ingest_jobs.chunks_discarded", len(positions))
+        except Exception as e:
+            # Left for the next start to retry
+            log_event("ingest_jobs.discard_failed", job_id=job["id"], error=repr(e))
+            return
+        self._update(job["id"], "status IN ('cancelled', 'failed')", chunks_done=0)
+
+    def _part_size(self, folder):
+        if not os.path.exists(os.path.join(folder, INDEX_FILE)):
+            return self.commit_every
+        # Doubling the store per part keeps the total rewritten linear in its final size
+        return max(self.commit_every, self.vector_store_manager.load_vector_store(folder).index.ntotal)
+
+    def _store_lock(self, session_id):
+        with self.lock:
+            return self._store_locks.setdefault(session_id, threading.Lock())
+
+    def _file_chunks(self, job):
+        # Parsed in another process; the chunks come back through a spool file
+        with self._parse_lock:
+            parsed = self._parsed.pop(job["id"], None)
+        # Its slot goes to the next queued file
+        self._prefetch()
+        future, spool_path = parsed if parsed is not None else (None, _spool_path())
+        try:
+            if future is None:
+                self.embedding_manager.parse_to_spool(job["path"], spool_path)
+            else:
+                with timed("ingest_jobs.parse_wait"):
+                    future.result()
+            yield from self.embedding_manager.iter_spooled_chunks(spool_path)
+        finally:
+            _remove_spool(spool_path)
+
+    def _prefetch(self):
+        # Start parsing the oldest queued file jobs, whatever their session, up to ``prefetch`` at a time
+        if not self.prefetch:
+            return
+        with self._parse_lock:
+            free = self.prefetch - len(self._parsed)
+            if free <= 0:
+                return
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, path FROM ingest_jobs WHERE status = 'queued' AND path IS NOT NULL "
+                    "ORDER BY created_at LIMIT ?", (self.prefetch + len(self._parsed),)
+                ).fetchall()
+            for job_id, path in rows:
+                if free == 0:
+                    break
+                if job_id in self._parsed:
+                    continue
+                spool_path = _spool_path()
+                future = self.embedding_manager.submit_parse(path, spool_path)
+                if future is None:
+                    _remove_spool(spool_path)
+                    return
+                self._parsed[job_id] = (future, spool_path)
+                free -= 1
+
+    def _drop_parsed(self, job_id):
+        with self._parse_lock:
+            parsed = self._parsed.pop(job_id, None)
+        if parsed is not None:
+            future, spool_path = parsed
+            future.cancel()
+            # Removed once a parse already under way has finished writing it
+            future.add_done_callback(lambda _: _remove_spool(spool_path))
+
+    def _update(self, job_id, condition, **fields):
+        fields["updated_at"] = datetime.now().isoformat()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            try:
+                self.conn.execute(
+                    f"UPDATE ingest_jobs SET {assignments} WHERE id = ? AND {condition}",
+                    (*fields.values(), job_id),
+                )
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+
+    @staticmethod
+    def _as_dict(cursor, row):
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _spool_path():
+    fd, path = tempfile.mkstemp(suffix=".chunks")
+    os.close(fd)
+    return path
+
+
+def _remove_spool(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
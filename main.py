@@ -1,14 +1,18 @@
-from agent import Agent
-from memory import DatabaseHandler
-import uuid
+from agent_client import AgentClient
 
 class SessionManager:
-    def __init__(self):
-        self.db_handler = DatabaseHandler()
-        self.sessions = self.db_handler.load_sessions()
+    def __init__(self, client=None):
+        # Sessions, turns and history are served by server.py
+        self.client = client or AgentClient()
+        self.sessions = self.client.sessions()
+
+    def refresh_sessions(self):
+        # Pick up sessions created elsewhere without dropping the metadata kept for known ones
+        for thread_id, status in self.client.sessions().items():
+            self.sessions.setdefault(thread_id, status)
 
     def start_new_session(self):
-        thread_id = str(uuid.uuid4())
+        thread_id = self.client.new_session()
         self.sessions[thread_id] = "Active"
         print(f"New session started. Session ID: {thread_id}")
         return thread_id
@@ -17,7 +21,7 @@ class SessionManager:
         if not self.sessions:
             print("No sessions found. Please start a new session.")
             return None
-        
+
         print("Sessions:")
         for idx, (session_id, status) in enumerate(self.sessions.items(), 1):
             print(f"{idx}. {session_id} - {status}")
@@ -37,18 +41,24 @@ class SessionManager:
             input_message = input("You: ")
             if input_message.lower() in ["q", "quit", "exit"]:
                 break
-            
-            result, ai_response, tool_output = self.agent.interact_with_agent(input_message, thread_id) # u can the interact_with_agent_terminal() for terminal mode
 
-            if tool_output is not None:
-                print(f"Tool output: {tool_output}")
-            print(f"AI: {ai_response}")
-        
+            # Print the answer as it streams in
+            print("AI: ", end="", flush=True)
+            streamed = False
+            for event in self.client.stream_turn(thread_id, input_message):
+                if event["type"] == "token":
+                    streamed = True
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "tool_result":
+                    print(f"\nTool output ({event['name']}): {event['content']}\nAI: ", end="", flush=True)
+                elif event["type"] == "done" and not streamed:
+                    print(event["output_text"][0], end="")
+            print()
+
         # Display conversation history
         print("\nConversation History:")
-        conversation_history = self.db_handler.get_conversation_history(thread_id)
-        for record in conversation_history:
-            print(f"{record[3]} ({record[2]}): {record[4]}")
+        for record in self.client.history(thread_id, limit=1000):
+            print(f"{record['role']} ({record['timestamp']}): {record['content']}")
     def main(self):
         while True:
             print("\n1. Start New Session")
@@ -73,4 +83,3 @@ class SessionManager:
 if __name__ == "__main__":
     session_manager = SessionManager()
     session_manager.main()
-
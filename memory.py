@@ -1,14 +1,239 @@
+import os
+import time
+import queue
+import atexit
 import sqlite3
+import asyncio
+import threading
 from datetime import datetime
+from langgraph.checkpoint.sqlite import SqliteSaver
+from metrics import log_event, registry, timed
+
+
+def connect(db_name, busy_timeout_ms=5000):
+    """Open a connection shared between threads, in WAL mode with a busy timeout.
+
+    synchronous=NORMAL means commits do not wait for an fsync in WAL mode; the
+    agent checkpointer and the conversation store share this configuration.
+    New databases use incremental auto-vacuum, so freed pages can be returned a
+    few at a time (see CheckpointCompactor).
+    """
+    conn = sqlite3.connect(db_name, check_same_thread=False)
+    # Only takes effect before the first table is created, and has to precede WAL mode
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    return conn
+
+
+class ThreadedSqliteSaver(SqliteSaver):
+    """SqliteSaver whose async methods run the sync ones in a worker thread.
+
+    The stock AsyncSqliteSaver writes a different checkpoint version format, so
+    sharing one saver keeps sync and async turns on the same thread compatible.
+    """
+
+    @classmethod
+    def from_conn_string(cls, conn_string):
+        return cls(conn=connect(conn_string))
+
+    # SqliteSaver only takes its lock for writes; reads use the same connection from
+    # other worker threads, so they take it too
+    def get_tuple(self, config):
+        with self.lock:
+            return super().get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        with self.lock:
+            checkpoints = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from checkpoints
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        checkpoints = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self, config, checkpoint, metadata):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata)
+
+    async def aput_writes(self, config, writes, task_id):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+
+CHECKPOINTER_BACKENDS = ("sqlite", "aiosqlite", "memory")
+
+
+def create_checkpointer(backend=None, db_name="agent_memory.db"):
+    """Build the LangGraph checkpointer selected by ``backend`` (or CHECKPOINTER_BACKEND).
+
+    - "sqlite": ThreadedSqliteSaver, usable from both invoke and ainvoke (default)
+    - "aiosqlite": AsyncSqliteSaver, for async-only deployments; its checkpoint
+      format differs from "sqlite", so give it its own database file
+    - "memory": in-process MemorySaver, for tests and benchmarks
+    """
+    backend = backend or os.getenv("CHECKPOINTER_BACKEND", "sqlite")
+    if backend == "sqlite":
+        return ThreadedSqliteSaver.from_conn_string(db_name)
+    if backend == "aiosqlite":
+        from langgraph.checkpoint.aiosqlite import AsyncSqliteSaver
+        return AsyncSqliteSaver.from_conn_string(db_name)
+    if backend == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+        return MemorySaver()
+    raise ValueError(f"Unknown checkpointer backend {backend!r}, expected one of {CHECKPOINTER_BACKENDS}")
+
+
+def uses_sqlite_file(checkpointer):
+    """Whether ``checkpointer`` keeps its checkpoints in the SQLite tables CheckpointCompactor prunes."""
+    if isinstance(checkpointer, SqliteSaver):
+        return True
+    try:
+        from langgraph.checkpoint.aiosqlite import AsyncSqliteSaver
+    except ImportError:
+        return False
+    # Same checkpoints and writes tables as SqliteSaver, written through aiosqlite
+    return isinstance(checkpointer, AsyncSqliteSaver)
+
+
+class CheckpointCompactor:
+    """Prunes SQLite checkpoints to the latest ``keep_last`` per thread.
+
+    The saver writes a checkpoint on every graph step and never deletes any, so
+    without this the database grows with every turn. Runs on demand with
+    compact() or periodically on a daemon thread with start(). Pruned pages are
+    reused by later writes; in incremental auto-vacuum mode up to ``vacuum_pages``
+    of them are also returned to the file system per run, which holds the write
+    lock only briefly. A full VACUUM locks the database for as long as it takes
+    to rewrite it, so it only runs with compact(vacuum=True), e.g. offline.
+    """
+
+    def __init__(self, db_name="agent_memory.db", keep_last=10, interval=3600, vacuum_pages=2000):
+        self.db_name = db_name
+        self.keep_last = keep_last
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self._stop = threading.Event()
+        self._thread = None
+
+    def compact(self, vacuum=False):
+        conn = connect(self.db_name)
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if "checkpoints" not in tables:
+                return {"checkpoints_deleted": 0, "writes_deleted": 0}
+
+            with conn:
+                deleted = conn.execute("""
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id ORDER BY thread_ts DESC
+                        ) AS position
+                        FROM checkpoints
+                    ) WHERE position > ?
+                )
+                """, (self.keep_last,)).rowcount
+                writes_deleted = 0
+                if "writes" in tables:
+                    writes_deleted = conn.execute("""
+                    DELETE FROM writes WHERE NOT EXISTS (
+                        SELECT 1 FROM checkpoints
+                        WHERE checkpoints.thread_id = writes.thread_id
+                        AND checkpoints.thread_ts = writes.thread_ts
+                    )
+                    """).rowcount
+
+            if vacuum:
+                # Also switches a database created before incremental mode over to it
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+                # In WAL mode the rewritten pages land in the WAL; fold them back to shrink the file
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                # execute() would step the pragma once, freeing a single page; executescript runs it to the end
+                conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+            return {"checkpoints_deleted": deleted, "writes_deleted": writes_deleted}
+        finally:
+            conn.close()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="checkpoint-compactor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                registry.increment("checkpoints.compaction_failed")
+                log_event("checkpoints.compaction_failed", error=repr(e))
+
 
 class DatabaseHandler:
-    def __init__(self, db_name="agent_memory.db"):
+    """Conversation store with one persistent connection and write-behind batching.
+
+    store_conversation only enqueues the message; a background writer thread
+    group-commits queued messages in batches of up to ``batch_size``. Reads flush
+    the queue first so callers always see their own writes. A batch that fails,
+    e.g. on a busy timeout, is retried up to ``write_retries`` times with backoff.
+    """
+
+    _STOP = object()
+
+    def __init__(self, db_name="agent_memory.db", batch_size=256, write_retries=5, retry_delay=0.1):
         self.db_name = db_name
+        self.batch_size = batch_size
+        self.write_retries = write_retries
+        self.retry_delay = retry_delay
+        self.conn = connect(db_name)
+        self.lock = threading.Lock()
         self.initialize_db()
 
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # Schema migrations, applied in order and tracked with PRAGMA user_version
+    MIGRATIONS = [
+        # 1: index history reads by thread and keep per-session stats in their own table
+        """
+        CREATE INDEX IF NOT EXISTS idx_conversations_thread_id ON conversations (thread_id, id);
+        CREATE TABLE IF NOT EXISTS sessions (
+            thread_id TEXT PRIMARY KEY,
+            created_at TEXT,
+            last_activity TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions (last_activity);
+        INSERT OR IGNORE INTO sessions (thread_id, created_at, last_activity, message_count)
+            SELECT thread_id, MIN(timestamp), MAX(timestamp), COUNT(*)
+            FROM conversations GROUP BY thread_id;
+        """,
+        # 2: page sessions on (last_activity, thread_id), which is unique where last_activity alone is not
+        """
+        DROP INDEX IF EXISTS idx_sessions_last_activity;
+        CREATE INDEX IF NOT EXISTS idx_sessions_activity_thread ON sessions (last_activity, thread_id);
+        """,
+    ]
+
     def initialize_db(self):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
+        with self.lock:
+            cursor = self.conn.cursor()
             cursor.execute("""
             CREATE TABLE IF NOT EXISTS conversations (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,30 +243,162 @@ class DatabaseHandler:
                 content TEXT
             )
             """)
-            conn.commit()
+            self.conn.commit()
+            self.migrate()
+
+    def migrate(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(self.MIGRATIONS[version:], version + 1):
+            # executescript commits first, so each migration and its version bump run as one script
+            try:
+                self.conn.executescript(f"BEGIN; {script} PRAGMA user_version = {number}; COMMIT;")
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
 
     def store_conversation(self, thread_id, role, content):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            timestamp = datetime.now().isoformat()
-            cursor.execute("""
-            INSERT INTO conversations (thread_id, timestamp, role, content)
-            VALUES (?, ?, ?, ?)
-            """, (thread_id, timestamp, role, content))
-            conn.commit()
-
-    def get_conversation_history(self, thread_id):
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM conversations WHERE thread_id = ? ORDER BY timestamp", (thread_id,))
+        timestamp = datetime.now().isoformat()
+        self._queue.put((thread_id, timestamp, role, content))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            # Group-commit whatever else is already waiting
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                registry.observe("db.write_batch.rows", len(batch))
+                self._write_with_retries(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write_with_retries(self, batch):
+        delay = self.retry_delay
+        for attempt in range(self.write_retries + 1):
+            try:
+                with timed("db.write_batch", rows=len(batch), attempt=attempt):
+                    self._write_batch(batch)
+                return
+            except sqlite3.Error as e:
+                error = e
+            if attempt < self.write_retries:
+                registry.increment("db.write_batch.retries")
+                log_event("db.write_batch.retry", rows=len(batch), attempt=attempt, error=repr(error))
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        registry.increment("db.write_batch.dropped_rows", len(batch))
+        log_event(
+            "db.write_batch.dropped", rows=len(batch), threads=sorted({row[0] for row in batch}), error=repr(error)
+        )
+
+    def _write_batch(self, batch):
+        # Roll the batch up per session so the sessions table costs one upsert per thread
+        activity = {}
+        for thread_id, timestamp, _, _ in batch:
+            first, last, count = activity.get(thread_id, (timestamp, timestamp, 0))
+            activity[thread_id] = (first, timestamp, count + 1)
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.executemany("""
+                INSERT INTO conversations (thread_id, timestamp, role, content)
+                VALUES (?, ?, ?, ?)
+                """, batch)
+                cursor.executemany("""
+                INSERT INTO sessions (thread_id, created_at, last_activity, message_count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (thread_id) DO UPDATE SET
+                    last_activity = excluded.last_activity,
+                    message_count = message_count + excluded.message_count
+                """, [(thread_id, *stats) for thread_id, stats in activity.items()])
+                self.conn.commit()
+            except sqlite3.Error:
+                # A retry writes the whole batch again
+                self.conn.rollback()
+                raise
+
+    def flush(self):
+        """Block until every queued message has been committed."""
+        if self._writer.is_alive():
+            self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(self._STOP)
+            self._writer.join()
+        atexit.unregister(self.close)
+
+    def get_conversation_history(self, thread_id, limit=None, after_id=None):
+        """Return rows (id, thread_id, timestamp, role, content) in chronological order.
+
+        Pages forward with keyset pagination: pass the last id of the previous page
+        as ``after_id``. Uses the (thread_id, id) index, so a page touches O(limit) rows.
+        """
+        self.flush()
+        query = "SELECT * FROM conversations WHERE thread_id = ? AND id > ? ORDER BY id"
+        params = [thread_id, after_id if after_id is not None else -1]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with timed("db.read_history"), self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+    def get_recent_conversation_history(self, thread_id, limit=50, before_id=None):
+        """Return the latest ``limit`` rows (older than ``before_id`` if given), oldest first."""
+        self.flush()
+        query = "SELECT * FROM conversations WHERE thread_id = ?"
+        params = [thread_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with timed("db.read_history"), self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(query, params)
+            return cursor.fetchall()[::-1]
+
+    def list_sessions(self, limit=None, before=None):
+        """Return (thread_id, created_at, last_activity, message_count), most recent first.
+
+        ``before`` is the (last_activity, thread_id) of the previous page's last row;
+        sessions with the same last_activity are ordered by thread_id, so none is skipped.
+        """
+        self.flush()
+        query = "SELECT thread_id, created_at, last_activity, message_count FROM sessions"
+        params = []
+        if before is not None:
+            query += " WHERE (last_activity, thread_id) < (?, ?)"
+            params.extend(before)
+        query += " ORDER BY last_activity DESC, thread_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with timed("db.list_sessions"), self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(query, params)
             return cursor.fetchall()
 
     def load_sessions(self):
         sessions = {}
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT thread_id FROM conversations")
-            for row in cursor.fetchall():
-                sessions[row[0]] = "Active"
+        for row in self.list_sessions():
+            sessions[row[0]] = "Active"
         return sessions
-
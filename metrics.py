@@ -0,0 +1,216 @@
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Structured events go to this logger as one JSON object per line; attach a handler to see them
+logger = logging.getLogger("metrics")
+logger.addHandler(logging.NullHandler())
+
+# The trace of the turn running in the current context, if any
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Histogram:
+    """Count, sum and extremes of every observation plus a window of recent ones for percentiles."""
+
+    def __init__(self, window=1024):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, safe to update from any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        trace = current_trace.get()
+        if trace is not None:
+            trace.count(name, value)
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = MetricsRegistry()
+
+
+class Trace:
+    """Stages, counters and token usage recorded while one agent turn runs."""
+
+    def __init__(self, name, **fields):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.fields = fields
+        self.stages = []  # [(stage, seconds, fields)]
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def add_stage(self, stage, seconds, fields):
+        self.stages.append((stage, seconds, fields))
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def finish(self):
+        self.seconds = self.elapsed()
+
+    def to_dict(self):
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            **self.fields,
+            "seconds": self.seconds,
+            "stages": [{"stage": stage, "seconds": seconds, **fields} for stage, seconds, fields in self.stages],
+            "counters": dict(self.counters),
+        }
+
+
+def log_event(event, **fields):
+    trace = current_trace.get()
+    if trace is not None:
+        fields.setdefault("trace_id", trace.id)
+    logger.info(json.dumps({"event": event, **fields}, default=str))
+
+
+def record_stage(stage, seconds, **fields):
+    registry.observe(f"{stage}.seconds", seconds)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, seconds, fields)
+    log_event(stage, seconds=round(seconds, 6), **fields)
+
+
+@contextmanager
+def timed(stage, **fields):
+    """Time the block as ``stage``: histogram ``<stage>.seconds``, trace entry and a log line.
+
+    Extra fields can be added to the yielded dict inside the block.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record_stage(stage, time.perf_counter() - start, **fields)
+
+
+@contextmanager
+def traced(name, **fields):
+    """Collect every stage timed inside the block (and in threads it starts via asyncio) into one Trace."""
+    trace = Trace(name, **fields)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.finish()
+        try:
+            current_trace.reset(token)
+        except ValueError:
+            # An abandoned async generator is closed from another context
+            pass
+        record_stage(name, trace.seconds, **fields)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LangChain callbacks that time graph nodes and tools and count LLM tokens."""
+
+    def __init__(self):
+        self._runs = {}  # {run_id: (stage, start)}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # Each node's own run carries the node name; the runnables inside it inherit the metadata.
+        # LangGraph's internal nodes (__start__) are not steps of ours.
+        if node and kwargs.get("name") == node and not node.startswith("__"):
+            self._runs[run_id] = (f"graph.{node}", time.perf_counter())
+            registry.increment("graph.steps")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._runs[run_id] = (f"tool.{name}", time.perf_counter())
+        registry.increment("tool.calls")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error=type(error).__name__)
+
+    def on_llm_end(self, response, **kwargs):
+        registry.increment("llm.calls")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                if usage:
+                    registry.increment("llm.input_tokens", usage.get("input_tokens", 0))
+                    registry.increment("llm.output_tokens", usage.get("output_tokens", 0))
+
+    def _finish(self, run_id, **fields):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            stage, start = run
+            record_stage(stage, time.perf_counter() - start, **fields)
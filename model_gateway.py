@@ -0,0 +1,473 @@
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import hashlib
+import threading
+import contextvars
+from itertools import count
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.load import dumpd
+from chunking import estimate_message_tokens, estimate_tokens
+from metrics import log_event, registry, timed
+
+# HTTP statuses worth another attempt: timeouts, rate limits and server errors
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class RateLimited(Exception):
+    """A provider answered 429; ``retry_after`` is the wait it asked for, if any."""
+
+    def __init__(self, message="rate limited", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = 429
+
+
+class DeadlineExceeded(Exception):
+    """A gateway call could not finish, including waits and retries, within its deadline."""
+
+
+def retry_hint(error):
+    """Return (retryable, seconds the provider asked to wait or None) for a failed call."""
+    if isinstance(error, RateLimited):
+        return True, error.retry_after
+    if isinstance(error, DeadlineExceeded):
+        return False, None
+    # google.api_core errors carry the HTTP status as ``code``, HTTP clients as ``status_code``
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUSES, None
+    return isinstance(error, (ConnectionError, TimeoutError)), None
+
+
+class TokenBucket:
+    """Continuously refilled at ``per_minute``, holding at most ``burst`` seconds' worth.
+
+    Reservations may take the bucket below zero; the returned wait is how long the
+    caller has to sleep until its share is refilled, so callers are served in the
+    order they reserved.
+    """
+
+    def __init__(self, per_minute, burst=60.0):
+        self.rate = per_minute / 60.0
+        self.capacity = self.rate * burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budget of one model; 0 means no limit.
+
+    Up to ``burst`` seconds of budget may be spent at once; providers count per
+    minute, so a minute by default.
+    """
+
+    def __init__(self, rpm=0, tpm=0, burst=60.0):
+        self.requests = TokenBucket(rpm, burst) if rpm else None
+        self.tokens = TokenBucket(tpm, burst) if tpm else None
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=0, deadline_at=None):
+        """Reserve one request and ``tokens``; returns the seconds to wait before sending it.
+
+        Raises DeadlineExceeded, without reserving anything, when the wait would end past ``deadline_at``.
+        """
+        with self._lock:
+            now = time.monotonic()
+            waits = [self.paused_until - now, 0.0]
+            if self.requests is not None:
+                waits.append(self.requests.reserve(1, now))
+            if self.tokens is not None:
+                waits.append(self.tokens.reserve(tokens, now))
+            wait = max(waits)
+            if deadline_at is not None and now + wait > deadline_at:
+                if self.requests is not None:
+                    self.requests.tokens += 1
+                if self.tokens is not None:
+                    self.tokens.tokens += tokens
+                raise DeadlineExceeded(f"rate limit wait of {wait:.1f}s is past the deadline")
+            return wait
+
+    def record(self, tokens):
+        # Correct a reservation once the response reports the tokens actually used
+        if self.tokens is not None and tokens:
+            with self._lock:
+                self.tokens.tokens -= tokens
+
+    def pause(self, seconds):
+        # After a 429 nobody sends to this model until the provider's window has passed
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ModelGateway:
+    """Shared front door for model API calls, sync or async.
+
+    Each call goes through the rate limiter of its model name ("chat", "embeddings"),
+    is retried with jittered exponential backoff on 429s, timeouts and server errors
+    (waiting out Retry-After, which pauses every caller of that model), and fails with
+    DeadlineExceeded once its ``deadline`` (seconds, waits and retries included) is
+    spent. Calls made with the same ``key`` while one is in flight share its result.
+    ``limits`` maps a model name to (rpm, tpm).
+    """
+
+    def __init__(self, limits=None, max_retries=4, base_delay=0.5, max_delay=20.0, deadline=60.0, workers=32,
+                 burst=60.0):
+        self.limits = dict(limits or {})
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self._limiters = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Sync calls run here so their deadline can be enforced while they are in flight
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gateway")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            limits={
+                "chat": (int(os.getenv("GATEWAY_CHAT_RPM", 1000)), int(os.getenv("GATEWAY_CHAT_TPM", 4000000))),
+                "embeddings": (
+                    int(os.getenv("GATEWAY_EMBEDDINGS_RPM", 1500)), int(os.getenv("GATEWAY_EMBEDDINGS_TPM", 0))
+                ),
+            },
+            max_retries=int(os.getenv("GATEWAY_MAX_RETRIES", 4)),
+            deadline=float(os.getenv("GATEWAY_DEADLINE", 60)),
+        )
+
+    def limiter(self, name):
+        with self._lock:
+            if name not in self._limiters:
+                self._limiters[name] = RateLimiter(*self.limits.get(name, (0, 0)), burst=self.burst)
+            return self._limiters[name]
+
+    def call(self, name, fn, tokens=0, key=None, deadline=None):
+        """Run ``fn()`` for model ``name``, estimated to use ``tokens``, and return its result."""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                return future.result(timeout=max(0.0, deadline_at - time.monotonic()))
+            except TimeoutError:
+                raise DeadlineExceeded(f"{name} call still in flight at its deadline") from None
+        try:
+            result = self._call(name, fn, tokens, deadline_at)
+        except BaseException as e:
+            self._leave(key, future, error=e)
+            raise
+        self._leave(key, future, result=result)
+        return result
+
+    async def acall(self, name, fn, tokens=0, key=None, deadline=None):
+        """Async ``call``: ``fn()`` returns an awaitable."""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), max(0.0, deadline_at - time.monotonic())
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"{name} call still in flight at its deadline") from None
+        try:
+            result = await self._acall(name, fn, tokens, deadline_at)
+        except BaseException as e:
+            self._leave(key, future, error=e)
+            raise
+        self._leave(key, future, result=result)
+        return result
+
+    async def astream(self, name, fn, tokens=0, deadline=None):
+        """Yield the chunks of ``fn()``, an async iterator; retried only until the first chunk arrives."""
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        limiter = self.limiter(name)
+        for attempt in count():
+            await asyncio.sleep(limiter.reserve(tokens, deadline_at))
+            registry.increment(f"gateway.{name}.calls")
+            chunks = fn().__aiter__()
+            started = False
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), deadline_at - time.monotonic())
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if started:
+                    raise
+                await asyncio.sleep(self._retry_delay(name, e, attempt, deadline_at))
+
+    def _call(self, name, fn, tokens, deadline_at):
+        limiter = self.limiter(name)
+        for attempt in count():
+            time.sleep(limiter.reserve(tokens, deadline_at))
+            registry.increment(f"gateway.{name}.calls")
+            try:
+                with timed(f"gateway.{name}", attempt=attempt):
+                    context = contextvars.copy_context()
+                    future = self._executor.submit(context.run, fn)
+                    return future.result(timeout=max(0.0, deadline_at - time.monotonic()))
+            except Exception as e:
+                time.sleep(self._retry_delay(name, e, attempt, deadline_at))
+
+    async def _acall(self, name, fn, tokens, deadline_at):
+        limiter = self.limiter(name)
+        for attempt in count():
+            await asyncio.sleep(limiter.reserve(tokens, deadline_at))
+            registry.increment(f"gateway.{name}.calls")
+            try:
+                with timed(f"gateway.{name}", attempt=attempt):
+                    return await asyncio.wait_for(fn(), max(0.0, deadline_at - time.monotonic()))
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(name, e, attempt, deadline_at))
+
+    def _retry_delay(self, name, error, attempt, deadline_at):
+        """Return how long to wait before retrying after ``error``, or re-raise it."""
+        if isinstance(error, TimeoutError) and time.monotonic() >= deadline_at:
+            registry.increment(f"gateway.{name}.deadline_exceeded")
+            raise DeadlineExceeded(f"{name} call did not finish within its deadline") from error
+        retryable, retry_after = retry_hint(error)
+        if not retryable or attempt >= self.max_retries:
+            registry.increment(f"gateway.{name}.failures")
+            raise error
+        if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+            registry.increment(f"gateway.{name}.rate_limited")
+            if retry_after:
+                self.limiter(name).pause(retry_after)
+        # Full jitter, or the provider's Retry-After plus a little jitter so callers do not return together
+        if retry_after:
+            delay = retry_after + random.uniform(0, self.base_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if time.monotonic() + delay >= deadline_at:
+            registry.increment(f"gateway.{name}.deadline_exceeded")
+            raise DeadlineExceeded(f"{name} retry would end past the deadline") from error
+        registry.increment(f"gateway.{name}.retries")
+        log_event("gateway.retry", model=name, attempt=attempt, delay=round(delay, 3), error=repr(error))
+        return delay
+
+    def _join(self, key):
+        # Returns (future, True) for the caller that makes the request, or the in-flight one's future
+        if key is None:
+            return None, True
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                registry.increment("gateway.coalesced")
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _leave(self, key, future, result=None, error=None):
+        if key is None:
+            return
+        with self._lock:
+            del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    # One gateway per process, so every client of a model shares its rate limits
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = ModelGateway.from_env()
+    return _gateway
+
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model whose calls to ``inner`` go through a ModelGateway.
+
+    Identical requests in flight at the same time (same messages, tools and options)
+    are sent once. Rate-limit reservations assume ``output_tokens`` per answer and
+    are corrected from the reported usage.
+    """
+
+    inner: BaseChatModel
+    gateway: ModelGateway
+    limit: str = "chat"
+    output_tokens: int = 256
+    coalesce: bool = True
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return f"gateway-{self.inner._llm_type}"
+
+    def bind_tools(self, tools, **kwargs):
+        # Let the inner model format the tools, then send its request options through the gateway
+        bound = self.inner.bind_tools(tools, **kwargs)
+        options = getattr(bound, "kwargs", None)
+        return self.bind(**options) if options else self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_message_tokens(messages) + self.output_tokens
+        result = self.gateway.call(
+            self.limit,
+            lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=tokens, key=self._key(messages, stop, kwargs),
+        )
+        return self._own(result, tokens)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_message_tokens(messages) + self.output_tokens
+        result = await self.gateway.acall(
+            self.limit,
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=tokens, key=self._key(messages, stop, kwargs),
+        )
+        return self._own(result, tokens)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = estimate_message_tokens(messages) + self.output_tokens
+        async for chunk in self.gateway.astream(
+            self.limit,
+            lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=tokens,
+        ):
+            usage = getattr(chunk.message, "usage_metadata", None)
+            if usage:
+                self.gateway.limiter(self.limit).record(usage.get("total_tokens", tokens) - tokens)
+            yield chunk
+
+    def _key(self, messages, stop, kwargs):
+        if not self.coalesce:
+            return None
+        request = json.dumps([dumpd(messages), stop, kwargs], sort_keys=True, default=str)
+        return (self.limit, id(self.inner), hashlib.sha256(request.encode("utf-8")).hexdigest())
+
+    def _own(self, result, tokens):
+        # A coalesced result is shared; each caller gets its own copy to add ids and metadata to
+        usage = result.llm_output.get("usage_metadata") if result.llm_output else None
+        if not usage and result.generations:
+            usage = getattr(result.generations[0].message, "usage_metadata", None)
+        if usage:
+            self.gateway.limiter(self.limit).record(usage.get("total_tokens", tokens) - tokens)
+        return result.copy(deep=True)
+
+
+class MicroBatcher:
+    """Collects single items from concurrent callers into batches for ``fn(items) -> results``.
+
+    A batch is sent once ``max_batch`` items are waiting or ``window`` seconds after
+    its first item arrived; up to ``max_concurrency`` batches are in flight.
+    """
+
+    def __init__(self, fn, max_batch=100, window=0.01, max_concurrency=4):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="micro-batch")
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Return a concurrent.futures.Future of ``item``'s result."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name="micro-batcher", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            flush_at = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        registry.observe("gateway.micro_batch.size", len(batch))
+        try:
+            results = self.fn([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class GatewayEmbeddings(Embeddings):
+    """Embeddings whose calls to ``inner`` go through a ModelGateway.
+
+    Query embeddings and small document lists from concurrent sessions are
+    micro-batched into one ``embed_documents`` call. For providers that embed queries
+    differently from documents, ``query_task_type`` is passed to it for query batches
+    (Gemini's "retrieval_query"); without it queries are embedded as documents.
+    """
+
+    def __init__(self, inner, gateway, limit="embeddings", query_task_type=None, max_batch=100, window=0.01):
+        self.inner = inner
+        self.gateway = gateway
+        self.limit = limit
+        self.query_task_type = query_task_type
+        self.max_batch = max_batch
+        self.queries = MicroBatcher(self._embed_queries, max_batch, window)
+        self.documents = MicroBatcher(self._embed_batch, max_batch, window)
+
+    def embed_documents(self, texts):
+        if len(texts) >= self.max_batch:
+            return self._embed_batch(texts)
+        futures = [self.documents.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def embed_query(self, text):
+        return self.queries.submit(text).result()
+
+    async def aembed_documents(self, texts):
+        if len(texts) >= self.max_batch:
+            return await asyncio.to_thread(self._embed_batch, texts)
+        return list(await asyncio.gather(*(asyncio.wrap_future(self.documents.submit(text)) for text in texts)))
+
+    async def aembed_query(self, text):
+        return await asyncio.wrap_future(self.queries.submit(text))
+
+    def _embed_batch(self, texts):
+        return self.gateway.call(
+            self.limit, lambda: self.inner.embed_documents(texts), tokens=estimate_tokens("".join(texts))
+        )
+
+    def _embed_queries(self, texts):
+        if self.query_task_type:
+            embed = lambda: self.inner.embed_documents(texts, task_type=self.query_task_type)
+        else:
+            embed = lambda: self.inner.embed_documents(texts)
+        return self.gateway.call(self.limit, embed, tokens=estimate_tokens("".join(texts)))
@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from chat_Unstructured import VectorStoreCache
+from metrics import registry
+
+
+class SemanticResponseCache:
+    """Answers keyed on the attached vector-store set plus the query embedding.
+
+    A lookup hits when a cached query for the same stores, file filter and RAG
+    mode (the modes answer differently) has a
+    cosine similarity of at least ``threshold`` with the new query. Entries expire
+    after ``ttl`` seconds, the least recently used ones are evicted beyond
+    ``max_entries``, and every answer for a store set is dropped as soon as one of
+    its stores changes on disk.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=1000, ttl=3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # {store_key: {"fingerprint": ..., "entries": OrderedDict(entry_id: (vector, answer, created))}}
+        self._stores = {}
+        # Global LRU order over (store_key, entry_id)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def store_key(vector_store_folders, source_ids=None, mode=None):
+        folders = tuple(sorted({os.path.abspath(folder) for folder in vector_store_folders}))
+        return folders, tuple(sorted(source_ids)) if source_ids else None, mode
+
+    @staticmethod
+    def fingerprint(store_key):
+        return tuple(VectorStoreCache.fingerprint(folder) for folder in store_key[0])
+
+    def get(self, vector_store_folders, source_ids, query_embedding, mode=None):
+        key = self.store_key(vector_store_folders, source_ids, mode)
+        fingerprint = self.fingerprint(key)
+        query = self._normalize(query_embedding)
+        now = time.monotonic()
+
+        with self._lock:
+            store = self._current_store(key, fingerprint)
+            best_id, best_score = None, self.threshold
+            for entry_id, (vector, answer, created) in list(store["entries"].items()):
+                if now - created > self.ttl:
+                    self._remove(key, entry_id)
+                    self.evictions += 1
+                    continue
+                score = float(np.dot(vector, query))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                registry.increment("response_cache.misses")
+                return None
+            self.hits += 1
+            registry.increment("response_cache.hits")
+            self._lru.move_to_end((key, best_id))
+            return store["entries"][best_id][1]
+
+    def put(self, vector_store_folders, source_ids, query_embedding, answer, mode=None):
+        key = self.store_key(vector_store_folders, source_ids, mode)
+        fingerprint = self.fingerprint(key)
+        with self._lock:
+            store = self._current_store(key, fingerprint)
+            entry_id = self._next_id
+            self._next_id += 1
+            store["entries"][entry_id] = (self._normalize(query_embedding), answer, time.monotonic())
+            self._lru[(key, entry_id)] = None
+            while len(self._lru) > self.max_entries:
+                (old_key, old_id), _ = self._lru.popitem(last=False)
+                self._stores[old_key]["entries"].pop(old_id, None)
+                self.evictions += 1
+
+    def invalidate(self, vector_store_folder=None):
+        """Drop cached answers that involve ``vector_store_folder`` (or everything)."""
+        folder = os.path.abspath(vector_store_folder) if vector_store_folder else None
+        with self._lock:
+            for key in list(self._stores):
+                if folder is None or folder in key[0]:
+                    self._drop_store(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _current_store(self, key, fingerprint):
+        store = self._stores.get(key)
+        if store is not None and store["fingerprint"] != fingerprint:
+            # A store was appended to or rebuilt; its old answers may be stale
+            self._drop_store(key)
+            store = None
+        if store is None:
+            store = self._stores[key] = {"fingerprint": fingerprint, "entries": OrderedDict()}
+        return store
+
+    def _drop_store(self, key):
+        store = self._stores.pop(key)
+        for entry_id in store["entries"]:
+            self._lru.pop((key, entry_id), None)
+        self.invalidations += len(store["entries"])
+
+    def _remove(self, key, entry_id):
+        self._stores[key]["entries"].pop(entry_id, None)
+        self._lru.pop((key, entry_id), None)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import numpy as np
+from chunking import estimate_tokens
+from vector_storage import QUERY_TERM_PATTERN
+from metrics import timed
+
+
+class HybridRetriever:
+    """Keyword (BM25) plus vector retrieval over the stores of a VectorStoreManager.
+
+    Exact tokens such as invoice numbers, amounts and dates are matched by the FTS5
+    index in each store's sidecar, paraphrases by the vector index. Both rankings are
+    merged with reciprocal-rank fusion, near-duplicate overlapping chunks are
+    dropped with MMR, and chunks are taken until ``token_budget`` is spent.
+    """
+
+    def __init__(self, vector_store_manager, k=None, fetch_k=20, token_budget=None, mmr_lambda=0.7, rrf_k=60,
+                 keyword_cutoff=0.2):
+        self.vector_store_manager = vector_store_manager
+        self.k = k or int(os.getenv("RETRIEVAL_K", 6))
+        self.fetch_k = fetch_k
+        self.token_budget = token_budget or int(os.getenv("RETRIEVAL_TOKEN_BUDGET", 1000))
+        self.mmr_lambda = mmr_lambda
+        self.rrf_k = rrf_k
+        self.keyword_cutoff = keyword_cutoff
+
+    def retrieve(self, folders, query, source_ids=None, embedding=None):
+        """Return the documents to put in the prompt, most relevant first."""
+        if embedding is None:
+            embedding = self.vector_store_manager.embeddings.embed_query(query)
+
+        rankings = []
+        documents = {}
+        for folder in dict.fromkeys(folders):
+            store = self.vector_store_manager.load_vector_store(folder)
+            with timed("retrieval.search"):
+                vector_positions = self._vector_search(store, embedding, source_ids)
+                keyword_positions = self._keyword_search(store, query, source_ids)
+                rankings.extend(self._rankings(store, folder, vector_positions, keyword_positions, source_ids, documents))
+        return self._fuse(rankings, documents)
+
+    async def aretrieve(self, folders, query, source_ids=None, embedding=None):
+        """Async retrieve: the vector and keyword searches of every store run at once, off the event loop."""
+        if embedding is None:
+            embedding = await self.vector_store_manager.embeddings.aembed_query(query)
+        documents = {}
+
+        async def search(folder):
+            store = await asyncio.to_thread(self.vector_store_manager.load_vector_store, folder)
+            with timed("retrieval.search"):
+                vector_positions, keyword_positions = await asyncio.gather(
+                    asyncio.to_thread(self._vector_search, store, embedding, source_ids),
+                    asyncio.to_thread(self._keyword_search, store, query, source_ids),
+                )
+                return await asyncio.to_thread(
+                    self._rankings, store, folder, vector_positions, keyword_positions, source_ids, documents
+                )
+
+        # Folders keep their order in the fusion, as in retrieve
+        results = await asyncio.gather(*(search(folder) for folder in dict.fromkeys(folders)))
+        return self._fuse([ranking for rankings in results for ranking in rankings], documents)
+
+    def _vector_search(self, store, embedding, source_ids):
+        # Over-fetch when filtering by file, as LangChain's FAISS does
+        fetch_k = self.fetch_k * 4 if source_ids else self.fetch_k
+        _, positions = store.index.search(np.array([embedding], dtype=np.float32), fetch_k)
+        return [int(position) for position in positions[0] if position != -1]
+
+    def _keyword_search(self, store, query, source_ids):
+        keyword_hits = store.docstore.keyword_search(query, self.fetch_k, source_ids)
+        # Chunks that only share words found everywhere score ~0 and would just add noise to the fusion
+        best = keyword_hits[0][1] if keyword_hits else 0
+        return [position for position, score in keyword_hits if score <= best * self.keyword_cutoff]
+
+    def _rankings(self, store, folder, vector_positions, keyword_positions, source_ids, documents):
+        found = store.docstore.get_by_positions(set(vector_positions) | set(keyword_positions))
+        for position, doc in found.items():
+            documents[(folder, position)] = doc
+
+        def keep(position):
+            if position not in found:
+                return False
+            return not source_ids or found[position].metadata.get("source_id") in source_ids
+
+        vector_ranking = [(folder, position) for position in vector_positions if keep(position)]
+        keyword_ranking = [(folder, position) for position in keyword_positions if position in found]
+        return vector_ranking[:self.fetch_k], keyword_ranking
+
+    def _fuse(self, rankings, documents):
+        # The RRF constant keeps ranks from different stores and retrievers comparable
+        scores = {}
+        for ranking in rankings:
+            for rank, key in enumerate(ranking):
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        with timed("retrieval.select", candidates=len(ranked)) as stage:
+            selected = self._select(ranked, scores, documents)
+            stage["chunks"] = len(selected)
+            stage["tokens"] = sum(estimate_tokens(doc.page_content) for doc in selected)
+        return selected
+
+    def _select(self, ranked, scores, documents):
+        """MMR over the fused ranking, stopping at ``k`` chunks or the token budget."""
+        if not ranked:
+            return []
+        top_score = scores[ranked[0]]
+        terms = {key: self._terms(documents[key].page_content) for key in ranked}
+
+        selected = []
+        used_tokens = 0
+        candidates = list(ranked)
+        while candidates and len(selected) < self.k:
+            def mmr(key):
+                redundancy = max((self._overlap(terms[key], terms[other]) for other in selected), default=0.0)
+                return self.mmr_lambda * scores[key] / top_score - (1 - self.mmr_lambda) * redundancy
+
+            best = max(candidates, key=mmr)
+            candidates.remove(best)
+            # Near-copies of a selected chunk (e.g. the same page uploaded twice) add nothing
+            if any(self._overlap(terms[best], terms[other]) > 0.8 for other in selected):
+                continue
+            tokens = estimate_tokens(documents[best].page_content)
+            if selected and used_tokens + tokens > self.token_budget:
+                continue
+            selected.append(best)
+            used_tokens += tokens
+        return [documents[key] for key in selected]
+
+    @staticmethod
+    def _terms(text):
+        return set(QUERY_TERM_PATTERN.findall(text.lower()))
+
+    @staticmethod
+    def _overlap(first, second):
+        if not first or not second:
+            return 0.0
+        return len(first & second) / min(len(first), len(second))
@@ -0,0 +1,418 @@
+"""HTTP/WebSocket serving layer around Agent.
+
+One process owns the runtime (LLM clients, graph, checkpointer, stores) and the
+ingestion workers; the Streamlit app and the CLI talk to it through
+agent_client.AgentClient, so turns of a thread are ordered in one place:
+
+    python server.py            # SERVER_HOST / SERVER_PORT, 127.0.0.1:8080 by default
+"""
+import os
+import re
+import json
+import math
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from aiohttp import web, WSCloseCode, WSMsgType
+from agent import RAG_MODES, Agent, get_runtime
+from ingest_jobs import IngestionQueue
+from metrics import log_event, registry
+
+# Thread ids name upload folders and stores, so only plain identifiers are accepted
+THREAD_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,128}")
+# Largest page of history one request returns
+MAX_HISTORY_LIMIT = 1000
+
+
+def thread_id_of(request):
+    thread_id = request.match_info["thread_id"]
+    if not THREAD_ID_PATTERN.fullmatch(thread_id):
+        raise web.HTTPBadRequest(text="invalid thread id")
+    return thread_id
+
+
+def limit_of(request, default=50):
+    """The request's ``limit`` query parameter, clamped to MAX_HISTORY_LIMIT."""
+    try:
+        limit = int(request.query.get("limit", default))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be an integer")
+    if limit < 1:
+        raise web.HTTPBadRequest(text="limit must be positive")
+    return min(limit, MAX_HISTORY_LIMIT)
+
+
+def parse_turn(body):
+    """Return the turn options of a request body, or raise ValueError if it is malformed."""
+    if not isinstance(body, dict) or not isinstance(body.get("message"), str) or not body["message"].strip():
+        raise ValueError('expected a JSON object with a non-empty "message"')
+    source_ids = body.get("source_ids")
+    if source_ids is not None and (
+        not isinstance(source_ids, list) or not all(isinstance(source_id, str) for source_id in source_ids)
+    ):
+        raise ValueError('"source_ids" must be a list of strings')
+    rag_mode = body.get("rag_mode")
+    if rag_mode is not None and rag_mode not in RAG_MODES:
+        raise ValueError(f'"rag_mode" must be one of {RAG_MODES}')
+    return {
+        "message": body["message"],
+        "source_ids": source_ids,
+        "rag_mode": rag_mode,
+        "stream": bool(body.get("stream")),
+    }
+
+
+class Overloaded(Exception):
+    """A turn was rejected to keep waits bounded; the client should retry after ``retry_after`` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason} is at capacity, retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """Decides which agent turns run, wait or are turned away.
+
+    At most ``max_active`` turns run at once; a turn makes its LLM calls one after
+    another, so this is also the limit on concurrent LLM calls. Up to ``max_queued``
+    more may wait for a slot, and a thread may have ``max_per_thread`` turns running
+    or waiting, which run one at a time in arrival order so two clients of the same
+    thread never interleave its checkpoints. Beyond that a turn is rejected at once
+    with Overloaded instead of queueing, which keeps the tail latency of accepted
+    turns bounded at peak.
+    """
+
+    def __init__(self, max_active=8, max_queued=32, max_per_thread=2):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_per_thread = max_per_thread
+        self.active = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_active)
+        self._threads = {}  # {thread_id: [lock, turns admitted]}
+        # Moving average of turn duration, for Retry-After
+        self.turn_seconds = 1.0
+
+    def admit(self, thread_id):
+        """Reserve a place for a turn of ``thread_id`` or raise Overloaded.
+
+        The result is an async context manager that waits for the thread's earlier
+        turns and a free slot, and must be entered.
+        """
+        entry = self._threads.get(thread_id)
+        if entry is not None and entry[1] >= self.max_per_thread:
+            registry.increment("server.rejected.thread")
+            raise Overloaded("thread", self.retry_after(entry[1]))
+        if self.waiting >= self.max_queued:
+            registry.increment("server.rejected.server")
+            raise Overloaded("server", self.retry_after(self.waiting + self.max_active, self.max_active))
+        if entry is None:
+            entry = self._threads[thread_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.waiting += 1
+        return self._run(thread_id, entry)
+
+    @asynccontextmanager
+    async def _run(self, thread_id, entry):
+        waiting = True
+        loop = asyncio.get_running_loop()
+        try:
+            queued_at = loop.time()
+            async with entry[0], self._slots:
+                self.waiting -= 1
+                waiting = False
+                self.active += 1
+                registry.observe("server.queue_wait.seconds", loop.time() - queued_at)
+                started = loop.time()
+                try:
+                    yield
+                finally:
+                    self.active -= 1
+                    self.turn_seconds = 0.8 * self.turn_seconds + 0.2 * (loop.time() - started)
+        finally:
+            if waiting:
+                self.waiting -= 1
+            entry[1] -= 1
+            if not entry[1]:
+                del self._threads[thread_id]
+
+    def retry_after(self, turns_ahead, parallel=1):
+        return max(1, math.ceil(self.turn_seconds * turns_ahead / parallel))
+
+
+class AgentServer:
+    """aiohttp application serving agent turns, history and document ingestion.
+
+    Turns run as tasks of their own: a client that disconnects does not cut a turn
+    off halfway through its checkpoint writes, and shutdown waits for running turns
+    (up to ``drain_timeout`` seconds) while new ones get 503 with Retry-After.
+    A turn searches the stores the document registry has for its thread; clients
+    can narrow that to some source ids but never name a store folder.
+    """
+
+    def __init__(self, runtime=None, ingestion_queue=None, admission=None, drain_timeout=None, upload_dir="uploads"):
+        self.runtime = runtime or get_runtime()
+        self.ingestion_queue = ingestion_queue or IngestionQueue(
+            self.runtime.vector_store_manager, self.runtime.embedding_manager
+        )
+        self.admission = admission or AdmissionControl(
+            max_active=int(os.getenv("SERVER_MAX_ACTIVE_TURNS", 8)),
+            max_queued=int(os.getenv("SERVER_MAX_QUEUED_TURNS", 32)),
+            max_per_thread=int(os.getenv("SERVER_MAX_TURNS_PER_THREAD", 2)),
+        )
+        self.drain_timeout = drain_timeout or float(os.getenv("SERVER_DRAIN_TIMEOUT", 30))
+        self.upload_dir = upload_dir
+        self.draining = False
+        self._turns = set()
+        self._sockets = set()
+
+    def build_app(self):
+        app = web.Application(client_max_size=int(os.getenv("SERVER_MAX_UPLOAD_MB", 200)) * 2 ** 20)
+        app.add_routes([
+            web.get("/health", self.health),
+            web.get("/metrics", self.metrics),
+            web.post("/metrics/reset", self.reset_metrics),
+            web.get("/sessions", self.list_sessions),
+            web.post("/sessions", self.new_session),
+            web.get("/sessions/{thread_id}/history", self.history),
+            web.post("/sessions/{thread_id}/turns", self.turn),
+            web.get("/sessions/{thread_id}/ws", self.websocket),
+            web.get("/sessions/{thread_id}/jobs", self.list_jobs),
+            web.post("/sessions/{thread_id}/documents", self.add_document),
+            web.delete("/sessions/{thread_id}/jobs/{job_id}", self.cancel_job),
+        ])
+        app.on_startup.append(self.startup)
+        app.on_shutdown.append(self.drain)
+        app.on_cleanup.append(self.cleanup)
+        return app
+
+    async def startup(self, app):
+        await asyncio.to_thread(self.ingestion_queue.start)
+
+    async def drain(self, app):
+        """Stop admitting turns and wait for the running ones before connections close."""
+        self.draining = True
+        if self._turns:
+            log_event("server.draining", turns=len(self._turns))
+            _, pending = await asyncio.wait(set(self._turns), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                registry.increment("server.drain_cancelled", len(pending))
+        for ws in set(self._sockets):
+            await ws.close(code=WSCloseCode.GOING_AWAY, message=b"server shutting down")
+
+    async def cleanup(self, app):
+        # Ingestion jobs resume from their saved chunks, so a job still running is not waited for
+        stop = asyncio.to_thread(self.ingestion_queue.stop)
+        try:
+            await asyncio.wait_for(stop, timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            log_event("server.ingestion_stop_timeout")
+        await asyncio.to_thread(self.runtime.db_handler.flush)
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "draining" if self.draining else "ok",
+            "active_turns": self.admission.active,
+            "queued_turns": self.admission.waiting,
+        })
+
+    async def metrics(self, request):
+        return web.json_response(registry.snapshot())
+
+    async def reset_metrics(self, request):
+        registry.reset()
+        return web.json_response({})
+
+    async def list_sessions(self, request):
+        sessions = await asyncio.to_thread(self.runtime.db_handler.load_sessions)
+        return web.json_response(sessions)
+
+    async def new_session(self, request):
+        return web.json_response({"thread_id": str(uuid.uuid4())})
+
+    async def history(self, request):
+        thread_id, limit = thread_id_of(request), limit_of(request)
+        rows = await asyncio.to_thread(self.runtime.db_handler.get_recent_conversation_history, thread_id, limit)
+        return web.json_response([
+            {"id": row[0], "thread_id": row[1], "timestamp": row[2], "role": row[3], "content": row[4]}
+            for row in rows
+        ])
+
+    async def turn(self, request):
+        """Run one turn: a JSON answer, or with "stream": true, events as JSON lines."""
+        thread_id = thread_id_of(request)
+        try:
+            turn = parse_turn(await request.json())
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            raise web.HTTPBadRequest(text=json.dumps({"error": str(e)}), content_type="application/json")
+        try:
+            events = self.start_turn(thread_id, turn)
+        except Overloaded as e:
+            status = web.HTTPServiceUnavailable if e.reason == "draining" else web.HTTPTooManyRequests
+            raise status(
+                text=json.dumps({"error": str(e), "reason": e.reason, "retry_after": e.retry_after}),
+                content_type="application/json", headers={"Retry-After": str(e.retry_after)},
+            )
+
+        if not turn["stream"]:
+            result = None
+            while (event := await events.get()) is not None:
+                if event["type"] == "error":
+                    raise web.HTTPInternalServerError(
+                        text=json.dumps({"error": event["error"]}), content_type="application/json"
+                    )
+                if event["type"] == "done":
+                    result = event
+            if result is None:
+                # Cancelled while the server drained
+                raise web.HTTPServiceUnavailable(
+                    text=json.dumps({"error": "turn cancelled by shutdown"}), content_type="application/json",
+                    headers={"Retry-After": str(math.ceil(self.drain_timeout))},
+                )
+            return web.json_response({"output_text": result["output_text"], "trace": result.get("trace")})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        while (event := await events.get()) is not None:
+            await response.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+        await response.write_eof()
+        return response
+
+    async def websocket(self, request):
+        """Turns over a WebSocket: send {"message": ...}, receive its events up to "done" or "error".
+
+        A rejected turn gets a "busy" event with retry_after; turns on one socket run one after another.
+        """
+        thread_id = thread_id_of(request)
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    events = self.start_turn(thread_id, {**parse_turn(json.loads(msg.data)), "stream": True})
+                except ValueError as e:
+                    await ws.send_json({"type": "error", "error": str(e)})
+                    continue
+                except Overloaded as e:
+                    await ws.send_json({"type": "busy", "reason": e.reason, "retry_after": e.retry_after})
+                    continue
+                finished = False
+                while (event := await events.get()) is not None:
+                    finished = finished or event["type"] in ("done", "error")
+                    await ws.send_str(json.dumps(event, default=str))
+                if not finished:
+                    await ws.send_json({"type": "error", "error": "turn cancelled by shutdown"})
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+    def start_turn(self, thread_id, turn):
+        """Admit a turn (options from parse_turn) and start it; returns the queue its events arrive on, ending with None.
+
+        Raises Overloaded when the turn cannot be admitted.
+        """
+        if self.draining:
+            raise Overloaded("draining", math.ceil(self.drain_timeout))
+        ticket = self.admission.admit(thread_id)
+        events = asyncio.Queue()
+        task = asyncio.create_task(self._run_turn(ticket, thread_id, turn, events))
+        self._turns.add(task)
+        task.add_done_callback(self._turns.discard)
+        return events
+
+    async def _run_turn(self, ticket, thread_id, turn, events):
+        try:
+            async with ticket:
+                agent = Agent(agent_id=thread_id, runtime=self.runtime, rag_mode=turn["rag_mode"])
+                stores = await asyncio.to_thread(self.ingestion_queue.documents.session_stores, thread_id)
+                args = (turn["message"], thread_id, stores or None, turn["source_ids"])
+                if turn["stream"]:
+                    async for event in agent.astream_interact_with_agent(*args):
+                        if event["type"] == "done":
+                            done = event
+                        else:
+                            events.put_nowait(event)
+                else:
+                    done = {"type": "done", **await agent.ainteract_with_agent(*args)}
+            # The trace is complete only once the turn's stream has ended
+            done["trace"] = agent.last_trace.to_dict()
+            events.put_nowait(done)
+        except Exception as e:
+            registry.increment("server.turn_errors")
+            log_event("server.turn_error", thread_id=thread_id, error=repr(e))
+            events.put_nowait({"type": "error", "error": repr(e)})
+        finally:
+            events.put_nowait(None)
+
+    async def list_jobs(self, request):
+        jobs = await asyncio.to_thread(self.ingestion_queue.list_jobs, thread_id_of(request))
+        return web.json_response(jobs)
+
+    async def add_document(self, request):
+        """Queue an uploaded file (multipart field "file") or a URL (JSON {"url": ...}) for indexing.
+
+        Each upload is a new document unless it names one of the thread's documents to
+        replace, with ``?replace=<source_id>`` or {"replace": source_id}.
+        """
+        thread_id = thread_id_of(request)
+        replace = request.query.get("replace")
+        if request.content_type == "application/json":
+            try:
+                body = await request.json()
+                url, replace = body["url"], body.get("replace", replace)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                raise web.HTTPBadRequest(text='expected a JSON object with a "url"')
+            if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+                raise web.HTTPBadRequest(text="expected an http(s) URL")
+            source_id = await self._source_id(thread_id, replace)
+            job_id = await asyncio.to_thread(self.ingestion_queue.submit, thread_id, url, source_id, url=url)
+            return web.json_response({"job_id": job_id, "source_id": source_id})
+
+        field = await (await request.multipart()).next()
+        if field is None or field.name != "file":
+            raise web.HTTPBadRequest(text="expected a multipart field named 'file'")
+        file_name = os.path.basename(field.filename)
+        source_id = await self._source_id(thread_id, replace)
+        path = os.path.join(self.upload_dir, thread_id, f"{source_id}_{file_name}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            while chunk := await field.read_chunk():
+                f.write(chunk)
+        job_id = await asyncio.to_thread(self.ingestion_queue.submit, thread_id, file_name, source_id, path=path)
+        return web.json_response({"job_id": job_id, "source_id": source_id})
+
+    async def _source_id(self, thread_id, replace):
+        if replace is None:
+            return str(uuid.uuid4())
+        if not await asyncio.to_thread(self.ingestion_queue.documents.get, thread_id, replace):
+            raise web.HTTPNotFound(text=f"thread has no document {replace}")
+        return replace
+
+    async def cancel_job(self, request):
+        thread_id, job_id = thread_id_of(request), request.match_info["job_id"]
+        job = await asyncio.to_thread(self.ingestion_queue.get, job_id)
+        # Another thread's job is reported as missing rather than confirmed to exist
+        if job is None or job["session_id"] != thread_id:
+            raise web.HTTPNotFound(text=f"thread has no job {job_id}")
+        await asyncio.to_thread(self.ingestion_queue.cancel, job_id)
+        return web.json_response({})
+
+
+def main():
+    server = AgentServer()
+    web.run_app(
+        server.build_app(),
+        host=os.getenv("SERVER_HOST", "127.0.0.1"),
+        port=int(os.getenv("SERVER_PORT", 8080)),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from agent import Agent, AgentRuntime
+from chunking import estimate_message_tokens
+from fakes import FakeChatModel, FakeEmbeddings
+
+
+@pytest.fixture
+def runtime(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HISTORY_TOKEN_BUDGET", "100")
+    return AgentRuntime(
+        llm=FakeChatModel(), embeddings=FakeEmbeddings(dim=16), db_name=str(tmp_path / "agent.db"),
+        checkpointer_backend="memory",
+    )
+
+
+def history(turns, words=8):
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(content=f"question {turn} " + "word " * words, id=f"h{turn}"))
+        if turn % 3 == 1:
+            # A tool round trip that must stay with its turn
+            call = {"name": "add", "args": {"a": turn, "b": 1}, "id": f"call_{turn}"}
+            messages.append(AIMessage(content="", tool_calls=[call], id=f"c{turn}"))
+            messages.append(ToolMessage(str(turn + 1), tool_call_id=f"call_{turn}", id=f"t{turn}"))
+        messages.append(AIMessage(content=f"answer {turn} " + "word " * words, id=f"a{turn}"))
+    return messages
+
+
+def test_prompt_keeps_the_latest_whole_turns_within_budget(runtime):
+    messages = history(12)
+    prompt = runtime.build_prompt({"messages": messages, "context": "", "summary": ""})
+    assert estimate_message_tokens(prompt) <= runtime.history_token_budget
+    assert isinstance(prompt[0], HumanMessage)
+    assert prompt == messages[-len(prompt):]
+    assert len(prompt) < len(messages)
+
+
+def test_prompt_swaps_in_the_context_and_summary(runtime):
+    messages = history(3)
+    state = {"messages": messages, "context": "Documents: total 42.00", "summary": "The user asked about bills."}
+    prompt = runtime.build_prompt(state)
+    assert isinstance(prompt[0], SystemMessage) and "The user asked about bills." in prompt[0].content
+    latest = [m for m in prompt if isinstance(m, HumanMessage)][-1]
+    assert latest.content == "Documents: total 42.00" and latest.id == "h2"
+    # The checkpointed message is untouched
+    assert messages[-2].content.startswith("question 2")
+
+
+def test_prompt_keeps_the_latest_turn_even_over_budget(runtime):
+    messages = history(3) + [HumanMessage(content="long " * 1000, id="h3")]
+    prompt = runtime.build_prompt({"messages": messages, "context": "", "summary": ""})
+    assert prompt == messages[-1:]
+
+
+def test_split_history_cuts_before_a_user_message(runtime):
+    messages = history(12)
+    old = runtime.split_history(messages)
+    kept = messages[len(old):]
+    assert old and kept
+    assert isinstance(kept[0], HumanMessage)
+    # About half the budget is kept, and no tool result is separated from its call
+    assert estimate_message_tokens(kept) <= runtime.history_token_budget
+    for i, message in enumerate(messages):
+        if isinstance(message, ToolMessage):
+            assert (i < len(old)) == (i - 1 < len(old))
+
+
+def test_split_history_folds_everything_before_an_oversized_turn(runtime):
+    messages = history(4) + [HumanMessage(content="long " * 1000, id="h4"), AIMessage(content="ok", id="a4")]
+    assert runtime.split_history(messages) == messages[:-2]
+
+
+def test_summarize_node_folds_old_turns_into_the_summary(runtime):
+    agent = Agent("agent", runtime=runtime)
+    for turn in range(8):
+        agent.interact_with_agent(f"question {turn} " + "word " * 20, "thread", None)
+
+    state = runtime.app.get_state({"configurable": {"thread_id": "thread"}}).values
+    assert state["summary"] == FakeChatModel().answer
+    messages = state["messages"]
+    assert isinstance(messages[0], HumanMessage)
+    assert estimate_message_tokens(messages) <= runtime.history_token_budget
+    assert messages[-1].content == FakeChatModel().answer
+    assert sum(isinstance(m, HumanMessage) for m in messages) < 8
+    # The conversation store keeps every message
+    assert len(runtime.db_handler.get_conversation_history("thread")) == 16
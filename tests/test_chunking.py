@@ -0,0 +1,87 @@
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from chunking import CHARS_PER_TOKEN, TableChunker, TextChunker, normalize
+
+
+def random_text(rng, sentences):
+    words = ["invoice", "total", "due", "amount", "INV-2024-001", "42.00", "01/15/2024", "paid", "by", "card", "a"]
+    parts = []
+    for _ in range(sentences):
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(1, 30)))
+        parts.append(sentence + rng.choice([".", "?", "!", ",", ""]))
+    return " ".join(parts)
+
+
+def check_spans(chunker, segments):
+    """Every chunk is the slice of the joined text its metadata names, and together they cover it."""
+    source = " ".join(text for text, _ in segments)
+    chunks = list(chunker.iter_chunks(segments))
+    covered = np.zeros(len(source), dtype=bool)
+    previous_start = -1
+    for text, metadata in chunks:
+        assert source[metadata["start"]:metadata["end"]] == text
+        assert text == text.strip() and text
+        assert len(text) <= chunker.max_chars
+        assert metadata["start"] > previous_start
+        previous_start = metadata["start"]
+        covered[metadata["start"]:metadata["end"]] = True
+    assert all(covered[i] for i, char in enumerate(source) if not char.isspace())
+    return source, chunks
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_text_chunks_are_exact_spans_of_the_source(seed):
+    rng = random.Random(seed)
+    segments = [(random_text(rng, rng.randint(0, 40)), None) for _ in range(rng.randint(1, 20))]
+    check_spans(TextChunker(chunk_tokens=rng.choice([8, 25, 250]), overlap_tokens=rng.choice([0, 2, 5])), segments)
+
+
+def test_text_without_breaks_and_empty_segments():
+    chunker = TextChunker(chunk_tokens=10, overlap_tokens=2)
+    check_spans(chunker, [("x" * 333, None), ("", None), ("   ", None), ("short tail.", None)])
+    assert chunker.split("") == []
+
+
+def test_paged_chunks_name_their_pages():
+    rng = random.Random(7)
+    pages = [normalize(random_text(rng, 15), "pdf") for _ in range(6)]
+    source, chunks = check_spans(TextChunker(chunk_tokens=40, overlap_tokens=8), [(page, i + 1) for i, page in enumerate(pages)])
+    starts = np.cumsum([0] + [len(page) + 1 for page in pages])
+    for text, metadata in chunks:
+        first = int(np.searchsorted(starts, metadata["start"], side="right"))
+        last = int(np.searchsorted(starts, metadata["end"] - 1, side="right"))
+        assert (metadata["page_start"], metadata["page_end"]) == (first, last)
+
+
+def rendered(frame):
+    return [" | ".join("" if pd.isna(value) else str(value) for value in row) for row in frame.itertuples(index=False)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_table_chunks_hold_whole_contiguous_rows(seed):
+    rng = random.Random(seed)
+    rows = rng.randint(1, 400)
+    frame = pd.DataFrame({
+        "item": [f"item {i} " + "x" * rng.choice([0, 5, 40, 300]) for i in range(rows)],
+        "amount": [rng.randint(0, 10 ** 6) for _ in range(rows)],
+        "note": [rng.choice(["paid", "due", None]) for _ in range(rows)],
+    })
+    block_size = rng.choice([1, 7, 50, 1000])
+    blocks = [frame.iloc[start:start + block_size] for start in range(0, rows, block_size)]
+    chunker = TableChunker(chunk_tokens=rng.choice([10, 60, 250]))
+    chunks = list(chunker.iter_chunks(blocks))
+
+    lines = rendered(frame)
+    next_row = 0
+    for text, metadata in chunks:
+        header, *chunk_rows = text.split("\n")
+        assert header == "item | amount | note"
+        assert metadata["row_start"] == next_row < metadata["row_end"]
+        assert chunk_rows == lines[metadata["row_start"]:metadata["row_end"]]
+        # Over budget only when a single row is larger than it
+        if len(chunk_rows) > 1:
+            assert len(text) <= chunker.chunk_tokens * CHARS_PER_TOKEN
+        next_row = metadata["row_end"]
+    assert next_row == rows
@@ -0,0 +1,215 @@
+import os
+import time
+import sqlite3
+import tempfile
+import pytest
+from agent import AgentRuntime
+from document_registry import DocumentRegistry
+from fakes import FakeChatModel, FakeEmbeddings
+from ingest_jobs import IngestionQueue
+from retrieval import HybridRetriever
+
+
+@pytest.fixture
+def make_queue(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queues = []
+
+    def make(embeddings=None, **kwargs):
+        db_name = str(tmp_path / "agent.db")
+        runtime = AgentRuntime(llm=FakeChatModel(), embeddings=embeddings or FakeEmbeddings(dim=16), db_name=db_name)
+        queue = IngestionQueue(
+            runtime.vector_store_manager, runtime.embedding_manager, db_name=db_name,
+            **{"workers": 1, "poll_interval": 0.05, **kwargs}
+        ).start()
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop()
+
+
+@pytest.fixture
+def queue(make_queue):
+    return make_queue()
+
+
+def write_bill(path, rows, edited=None):
+    lines = ["item,amount"] + [f"item {i},{edited if i == 0 and edited else i}.00" for i in range(rows)]
+    path.write_text("\n".join(lines) + "\n")
+    return str(path)
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not (result := condition()):
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.02)
+    return result
+
+
+def run_job(queue, session_id, source, source_id, path):
+    job_id = queue.submit(session_id, source, source_id, path=path)
+    job = wait_until(lambda: (job := queue.get(job_id))["status"] not in ("queued", "running") and job)
+    assert job["status"] == "done", job["error"]
+    return job
+
+
+def test_same_name_uploads_are_separate_documents(queue, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = run_job(queue, "s", "bill.csv", "source-1", write_bill(tmp_path / "a" / "bill.csv", 500))
+    second = run_job(queue, "s", "bill.csv", "source-2", write_bill(tmp_path / "b" / "bill.csv", 300, edited=99))
+
+    assert (first["source_id"], second["source_id"]) == ("source-1", "source-2")
+    store = queue.vector_store_manager.load_vector_store(second["vector_store"])
+    assert store.docstore.count_source("source-1") == first["chunks_done"] > 0
+    assert store.docstore.count_source("source-2") == second["chunks_done"] > 0
+    assert queue.documents.get("s", "source-1")["chunks"] == first["chunks_done"]
+    assert queue.documents.get("s", "source-2")["chunks"] == second["chunks_done"]
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def test_replacing_a_document_keeps_its_source_id(make_queue, tmp_path):
+    embeddings = CountingEmbeddings(dim=16)
+    queue = make_queue(embeddings=embeddings)
+    path = write_bill(tmp_path / "bill.csv", 500)
+    first = run_job(queue, "s", "bill.csv", "source-1", path)
+    saved = queue.documents.get("s", "source-1")
+    assert len(embeddings.embedded) == first["chunks_done"] > 1
+
+    # Unchanged content is skipped
+    embeddings.embedded.clear()
+    again = run_job(queue, "s", "bill.csv", "source-1", path)
+    assert again["source_id"] == "source-1"
+    assert queue.documents.get("s", "source-1")["updated_at"] == saved["updated_at"]
+    assert embeddings.embedded == []
+
+    # Editing one row re-embeds only the chunk that holds it
+    write_bill(tmp_path / "bill.csv", 500, edited=99)
+    edited = run_job(queue, "s", "bill.csv", "source-1", path)
+    assert len(embeddings.embedded) == 1 and "item 0 | 99.0\n" in embeddings.embedded[0]
+    assert edited["source_id"] == "source-1"
+    document = queue.documents.get("s", "source-1")
+    assert document["content_hash"] != saved["content_hash"]
+    store = queue.vector_store_manager.load_vector_store(edited["vector_store"])
+    assert store.docstore.count_source("source-1") == first["chunks_done"] == document["chunks"]
+    texts = [doc.page_content for doc in store.docstore.get_by_positions(range(document["chunks"])).values()]
+    assert any("item 0 | 99.0\n" in text for text in texts)
+
+
+def test_cancelled_jobs_leave_no_chunks_behind(make_queue, tmp_path):
+    queue = make_queue(embeddings=FakeEmbeddings(dim=16, latency=0.1), commit_every=5)
+    job_id = queue.submit("s", "big.csv", "source-1", path=write_bill(tmp_path / "big.csv", 3000))
+    wait_until(lambda: queue.get(job_id)["chunks_done"] >= 5)
+    queue.cancel(job_id)
+    # The chunks are removed once the worker sees the cancellation
+    job = wait_until(lambda: (job := queue.get(job_id))["chunks_done"] == 0 and job)
+    assert job["status"] == "cancelled"
+
+    small = run_job(queue, "s", "bill.csv", "source-2", write_bill(tmp_path / "bill.csv", 300))
+    store = queue.vector_store_manager.load_vector_store(small["vector_store"])
+    assert store.docstore.count_source("source-1") == 0
+    assert store.index.ntotal == small["chunks_done"]
+    found = HybridRetriever(queue.vector_store_manager).retrieve([small["vector_store"]], "item 10")
+    assert found and {doc.metadata["source_id"] for doc in found} == {"source-2"}
+
+
+def test_failed_jobs_leave_no_chunks_behind(queue, tmp_path, monkeypatch):
+    manager = queue.vector_store_manager
+    add_to_session_store = manager.add_to_session_store
+    parts = []
+
+    def fail_second_part(*args, **kwargs):
+        parts.append(1)
+        if len(parts) == 2:
+            raise RuntimeError("disk full")
+        return add_to_session_store(*args, **kwargs)
+
+    monkeypatch.setattr(manager, "add_to_session_store", fail_second_part)
+    queue.commit_every = 5
+    job_id = queue.submit("s", "bill.csv", "source-1", path=write_bill(tmp_path / "bill.csv", 1000))
+    job = wait_until(lambda: (job := queue.get(job_id))["status"] == "failed" and job["chunks_done"] == 0 and job)
+    assert "disk full" in job["error"]
+    store = manager.load_vector_store("faiss_index_session_s")
+    assert store.docstore.count_source("source-1") == 0
+    assert queue.documents.get("s", "source-1") is None
+
+
+def test_queued_files_of_a_session_are_parsed_ahead(make_queue, tmp_path, monkeypatch):
+    monkeypatch.setenv("INGEST_WORKERS", "2")
+    queue = make_queue()
+    assert queue.prefetch == 2
+    spools = set(os.listdir(tempfile.gettempdir()))
+    started = []
+    submit_parse = queue.embedding_manager.submit_parse
+
+    def record(path, spool_path):
+        started.append((os.path.basename(path), sum(job["status"] == "done" for job in queue.list_jobs("s"))))
+        return submit_parse(path, spool_path)
+
+    monkeypatch.setattr(queue.embedding_manager, "submit_parse", record)
+    paths = [write_bill(tmp_path / f"bill_{i}.csv", 300 + i) for i in range(4)]
+    job_ids = [queue.submit("s", os.path.basename(path), f"source-{i}", path=path) for i, path in enumerate(paths)]
+    queue.cancel(job_ids[3])
+    jobs = [wait_until(lambda: (job := queue.get(job_id))["status"] in ("done", "cancelled") and job) for job_id in job_ids]
+
+    assert [job["status"] for job in jobs] == ["done", "done", "done", "cancelled"]
+    # Each file is parsed once, and the second one before the first job is done
+    names = [name for name, _ in started]
+    assert len(names) == len(set(names)) and names[:3] == ["bill_0.csv", "bill_1.csv", "bill_2.csv"]
+    assert started[1] == ("bill_1.csv", 0)
+    for i, job in enumerate(jobs[:3]):
+        assert queue.documents.get("s", f"source-{i}")["chunks"] == job["chunks_done"] > 0
+    queue.stop()
+    assert queue._parsed == {}
+    assert set(os.listdir(tempfile.gettempdir())) <= spools
+
+
+def test_parts_grow_with_a_trained_index(make_queue, tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_INDEX_TYPE", "hnsw")
+    queue = make_queue(commit_every=2)
+    manager = queue.vector_store_manager
+    parts = []
+    add_to_session_store = manager.add_to_session_store
+
+    def record(part, *args, **kwargs):
+        parts.append(len(part))
+        return add_to_session_store(part, *args, **kwargs)
+
+    monkeypatch.setattr(manager, "add_to_session_store", record)
+    job = run_job(queue, "s", "bill.csv", "source-1", write_bill(tmp_path / "bill.csv", 2000))
+
+    assert sum(parts) == job["chunks_done"] and len(parts) > 3
+    # Saving the index rewrites all of it, so each part (but the last) at least doubles the store
+    assert all(parts[i] >= max(2, sum(parts[:i])) for i in range(len(parts) - 1))
+    assert os.path.exists(os.path.join(job["vector_store"], "index.faiss"))
+
+
+def test_documents_keyed_by_name_are_migrated(tmp_path):
+    db_name = str(tmp_path / "agent.db")
+    conn = sqlite3.connect(db_name)
+    conn.execute("""
+    CREATE TABLE documents (
+        session_id TEXT NOT NULL, source TEXT NOT NULL, source_id TEXT NOT NULL, content_hash TEXT,
+        vector_store TEXT, chunks INTEGER, updated_at TEXT, PRIMARY KEY (session_id, source)
+    )""")
+    conn.execute("INSERT INTO documents VALUES ('s', 'bill.csv', 'source-1', 'hash', 'faiss_index_session_s', 3, 'now')")
+    conn.commit()
+    conn.close()
+
+    documents = DocumentRegistry(db_name)
+    assert documents.get("s", "source-1")["source"] == "bill.csv"
+    documents.put("s", "bill.csv", "source-2", "other", "faiss_index_session_s", 4)
+    assert documents.session_stores("s") == ["faiss_index_session_s"]
+    assert documents.get("s", "source-2")["chunks"] == 4
@@ -0,0 +1,183 @@
+import sys
+import time
+import asyncio
+import threading
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from agent import Agent, AgentRuntime
+from fakes import FakeChatModel, FakeEmbeddings
+from memory import CheckpointCompactor, DatabaseHandler, ThreadedSqliteSaver, connect
+from metrics import registry
+
+
+@pytest.fixture(autouse=True)
+def frequent_thread_switches():
+    # Interleave the worker threads as much as possible, even on one core
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_async_turns_share_the_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runtime = AgentRuntime(
+        llm=FakeChatModel(latency=0.01), embeddings=FakeEmbeddings(dim=16), db_name=str(tmp_path / "agent.db")
+    )
+
+    async def session(number):
+        agent = Agent(f"agent-{number}", runtime=runtime)
+        for turn in range(3):
+            await agent.ainteract_with_agent(f"question {turn}", f"thread-{number}", None)
+
+    async def run():
+        return await asyncio.gather(*(session(number) for number in range(32)), return_exceptions=True)
+
+    errors = [result for result in asyncio.run(run()) if isinstance(result, Exception)]
+    assert errors == []
+    runtime.db_handler.flush()
+    for number in range(32):
+        state = runtime.app.get_state({"configurable": {"thread_id": f"thread-{number}"}})
+        assert sum(isinstance(m, HumanMessage) for m in state.values["messages"]) == 3
+        assert len(runtime.db_handler.get_conversation_history(f"thread-{number}")) == 6
+
+
+def test_saver_reads_and_writes_from_many_threads(tmp_path):
+    db_name = str(tmp_path / "agent.db")
+    saver = ThreadedSqliteSaver.from_conn_string(db_name)
+    # The conversation store writes to the same file through its own connection
+    conversations = DatabaseHandler(db_name, batch_size=1)
+    errors = []
+
+    def worker(number):
+        config = {"configurable": {"thread_id": f"thread-{number}"}}
+        try:
+            for step in range(50):
+                checkpoint = {
+                    "v": 1, "id": f"{step:06d}", "ts": f"2024-01-01T00:00:{step:02d}",
+                    "channel_values": {"messages": [AIMessage(content=str(step))]},
+                    "channel_versions": {}, "versions_seen": {}, "pending_sends": [],
+                }
+                config = saver.put(config, checkpoint, {"step": step})
+                conversations.store_conversation(f"thread-{number}", "ai", str(step))
+                assert saver.get_tuple(config) is not None
+                assert list(saver.list({"configurable": {"thread_id": f"thread-{number}"}}, limit=5))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    conversations.flush()
+    assert errors == []
+
+
+def test_session_pages_keep_sessions_with_the_same_last_activity(tmp_path):
+    handler = DatabaseHandler(str(tmp_path / "agent.db"))
+    with handler.lock:
+        handler.conn.executemany(
+            "INSERT INTO sessions (thread_id, created_at, last_activity, message_count) VALUES (?, ?, ?, 1)",
+            [(f"thread-{i}", "2024-01-01T00:00:00", f"2024-01-0{1 + i // 3}T00:00:00") for i in range(7)],
+        )
+        handler.conn.commit()
+
+    seen = []
+    before = None
+    while page := handler.list_sessions(limit=2, before=before):
+        seen.extend(row[0] for row in page)
+        before = (page[-1][2], page[-1][0])
+    assert sorted(seen) == [f"thread-{i}" for i in range(7)]
+    assert len(seen) == 7
+    assert [row[0] for row in handler.list_sessions()] == seen
+
+
+def test_periodic_compaction_frees_pages_without_vacuum(tmp_path):
+    db_name = str(tmp_path / "agent.db")
+    saver = ThreadedSqliteSaver.from_conn_string(db_name)
+    config = {"configurable": {"thread_id": "thread"}}
+    for step in range(200):
+        checkpoint = {
+            "v": 1, "id": f"{step:06d}", "ts": f"2024-01-01T00:{step // 60:02d}:{step % 60:02d}",
+            "channel_values": {"messages": [AIMessage(content="x" * 4000)]},
+            "channel_versions": {}, "versions_seen": {}, "pending_sends": [],
+        }
+        config = saver.put(config, checkpoint, {"step": step})
+
+    conn = connect(db_name)
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    compactor = CheckpointCompactor(db_name, keep_last=10, vacuum_pages=50)
+    assert compactor.compact()["checkpoints_deleted"] == 190
+    # A bounded number of pages is returned per run; the rest stay free for reuse
+    assert conn.execute("PRAGMA page_count").fetchone()[0] == pages - 50
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    compactor.compact(vacuum=True)
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert len(list(saver.list({"configurable": {"thread_id": "thread"}}))) == 10
+
+
+def hold_write_lock(db_name, seconds):
+    conn = connect(db_name)
+    conn.execute("BEGIN IMMEDIATE")
+    threading.Timer(seconds, conn.rollback).start()
+
+
+def test_busy_write_batches_are_retried(tmp_path):
+    db_name = str(tmp_path / "agent.db")
+    handler = DatabaseHandler(db_name, retry_delay=0.05)
+    handler.conn.execute("PRAGMA busy_timeout=20")
+    retries = registry.counters.get("db.write_batch.retries", 0)
+
+    hold_write_lock(db_name, 0.3)
+    for i in range(10):
+        handler.store_conversation("thread", "human", f"message {i}")
+    rows = handler.get_conversation_history("thread")
+    assert [row[4] for row in rows] == [f"message {i}" for i in range(10)]
+    assert registry.counters["db.write_batch.retries"] > retries
+    assert handler.list_sessions()[0][3] == 10
+
+
+def test_batches_dropped_after_the_last_retry_are_reported(tmp_path, caplog):
+    db_name = str(tmp_path / "agent.db")
+    handler = DatabaseHandler(db_name, write_retries=1, retry_delay=0.01)
+    handler.conn.execute("PRAGMA busy_timeout=20")
+    dropped = registry.counters.get("db.write_batch.dropped_rows", 0)
+
+    hold_write_lock(db_name, 0.5)
+    with caplog.at_level("INFO", logger="metrics"):
+        handler.store_conversation("thread", "human", "lost")
+        handler.flush()
+    assert registry.counters["db.write_batch.dropped_rows"] == dropped + 1
+    assert any('"db.write_batch.dropped"' in record.message for record in caplog.records)
+    time.sleep(0.5)
+    handler.store_conversation("thread", "human", "kept")
+    assert [row[4] for row in handler.get_conversation_history("thread")] == ["kept"]
+
+
+def test_aiosqlite_checkpoints_are_compacted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db_name = str(tmp_path / "agent.db")
+    runtime = AgentRuntime(
+        llm=FakeChatModel(latency=0), embeddings=FakeEmbeddings(dim=16), db_name=db_name,
+        checkpointer_backend="aiosqlite",
+    )
+    assert runtime.compactor is not None
+    runtime.compactor.stop()
+
+    async def run():
+        config = {"configurable": {"thread_id": "thread"}}
+        for step in range(30):
+            checkpoint = {
+                "v": 1, "id": f"{step:06d}", "ts": f"2024-01-01T00:00:{step:02d}",
+                "channel_values": {"messages": [AIMessage(content=str(step))]},
+                "channel_versions": {}, "versions_seen": {}, "pending_sends": [],
+            }
+            config = await runtime.memory.aput(config, checkpoint, {"step": step})
+        assert runtime.compactor.compact()["checkpoints_deleted"] == 20
+        remaining = [item async for item in runtime.memory.alist({"configurable": {"thread_id": "thread"}})]
+        await runtime.memory.conn.close()
+        return remaining
+
+    remaining = asyncio.run(run())
+    assert [item.checkpoint["id"] for item in remaining] == [f"{step:06d}" for step in range(29, 19, -1)]
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.ai.generativelanguage_v1beta.types import Candidate, Content, GenerateContentResponse, Part
+from langchain_core.messages import HumanMessage
+from fakes import FakeHttpChatModel, FakeHttpEmbeddings, FakeModelServer, HttpStatusError
+from gemini import GeminiChat
+from model_gateway import (
+    DeadlineExceeded, GatewayChatModel, GatewayEmbeddings, ModelGateway, RateLimited, RateLimiter, TokenBucket,
+)
+
+
+@pytest.fixture
+def model_server():
+    servers = []
+
+    def start(**kwargs):
+        server = FakeModelServer(**{"latency": 0.01, "dim": 8, **kwargs})
+        servers.append(server)
+        return server, server.start()
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def ask(model, question):
+    return model.invoke([HumanMessage(content=question)]).content
+
+
+def test_retries_rate_limits_and_server_errors(model_server):
+    server, url = model_server(limit=2, window=0.3, fail_every=3)
+    direct = FakeHttpChatModel(base_url=url)
+    with pytest.raises((RateLimited, HttpStatusError)):
+        for i in range(4):
+            ask(direct, f"direct {i}")
+
+    model = GatewayChatModel(inner=FakeHttpChatModel(base_url=url), gateway=ModelGateway(base_delay=0.01, deadline=10))
+    answers = [ask(model, f"question {i}") for i in range(6)]
+    assert all(answers)
+    assert server.stats["rate_limited"] > 1
+    assert server.stats["failed"] > 1
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    gateway = ModelGateway(base_delay=0.01)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise HttpStatusError(400, "bad request")
+
+    with pytest.raises(HttpStatusError):
+        gateway.call("chat", bad_request)
+    assert len(calls) == 1
+
+
+def test_deadline_covers_slow_calls_and_retries(model_server):
+    _, url = model_server(latency=2.0)
+    model = GatewayChatModel(inner=FakeHttpChatModel(base_url=url), gateway=ModelGateway(deadline=0.2))
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        ask(model, "slow")
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(model.ainvoke([HumanMessage(content="slow too")]))
+    assert time.perf_counter() - start < 1.5
+
+    # A Retry-After past the deadline fails now instead of sleeping through it
+    gateway = ModelGateway(deadline=0.5)
+    start = time.perf_counter()
+    with pytest.raises(DeadlineExceeded):
+        gateway.call("chat", lambda: (_ for _ in ()).throw(RateLimited(retry_after=5)))
+    assert time.perf_counter() - start < 0.5
+
+
+def test_identical_concurrent_requests_are_coalesced(model_server):
+    server, url = model_server(latency=0.2)
+    model = GatewayChatModel(inner=FakeHttpChatModel(base_url=url), gateway=ModelGateway())
+
+    async def run(questions):
+        return await asyncio.gather(*(model.ainvoke([HumanMessage(content=q)]) for q in questions))
+
+    answers = asyncio.run(run(["same question"] * 8))
+    assert len({answer.content for answer in answers}) == 1
+    assert server.stats["answered"] == 1
+    # Each caller gets its own copy of the shared result
+    assert len({id(answer) for answer in answers}) == 8
+
+    asyncio.run(run([f"question {i}" for i in range(4)]))
+    assert server.stats["answered"] == 5
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(per_minute=600, burst=1)  # 10 per second, at most 10 at once
+    assert bucket.reserve(10, now=bucket.updated) == 0
+    assert bucket.reserve(1, now=bucket.updated) == pytest.approx(0.1)
+    # Reservations queue up behind each other
+    assert bucket.reserve(2, now=bucket.updated) == pytest.approx(0.3)
+    assert bucket.reserve(1, now=bucket.updated + 0.3) == pytest.approx(0.1)
+
+
+def test_rate_limiter_refuses_waits_past_the_deadline():
+    limiter = RateLimiter(rpm=60, tpm=600, burst=1)
+    assert limiter.reserve(tokens=10) == 0
+    with pytest.raises(DeadlineExceeded):
+        limiter.reserve(tokens=1, deadline_at=time.monotonic() + 0.1)
+    # The refused reservation was given back
+    assert limiter.reserve(tokens=1) == pytest.approx(1.0, abs=0.05)
+
+
+def test_gateway_spreads_calls_over_the_rate_limit():
+    gateway = ModelGateway(limits={"embeddings": (300, 0)}, burst=1)  # 5 per second, 5 at once
+    start = time.perf_counter()
+    for _ in range(10):
+        gateway.call("embeddings", lambda: None)
+    assert 0.9 < time.perf_counter() - start < 2
+
+
+def test_embeddings_micro_batch_through_the_gateway(model_server):
+    server, url = model_server(limit=100, window=1)
+    embeddings = GatewayEmbeddings(FakeHttpEmbeddings(url), ModelGateway(base_delay=0.01), window=0.05)
+
+    async def run():
+        return await asyncio.gather(*(embeddings.aembed_query(f"query {i}") for i in range(20)))
+
+    vectors = asyncio.run(run())
+    assert len(vectors) == 20 and all(len(vector) == 8 for vector in vectors)
+    assert server.stats["answered"] < 20
+    assert server.stats["texts_embedded"] == 20
+
+
+class FakeGeminiClient:
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = []
+
+    def generate_content(self, request, metadata=(), **kwargs):
+        self.calls.append(kwargs)
+        if self.failures:
+            raise self.failures.pop(0)
+        return GenerateContentResponse(candidates=[
+            Candidate(content=Content(parts=[Part(text="42")], role="model"), finish_reason=1)
+        ])
+
+
+def test_gemini_client_leaves_retries_to_the_gateway():
+    chat = GeminiChat(model="gemini-1.5-flash", google_api_key="test")
+    chat.client = FakeGeminiClient([google_exceptions.ResourceExhausted("quota"), google_exceptions.ServiceUnavailable("down")])
+    model = GatewayChatModel(inner=chat, gateway=ModelGateway(base_delay=0.01))
+    assert ask(model, "total?") == "42"
+    # One request per gateway attempt, each with google-api-core's own Retry turned off
+    assert chat.client.calls == [{"retry": None}] * 3
@@ -0,0 +1,91 @@
+import time
+import numpy as np
+from agent import Agent, AgentRuntime
+from chat_Unstructured import VectorStoreCache, VectorStoreManager
+from fakes import FakeChatModel, FakeEmbeddings
+from response_cache import SemanticResponseCache
+from benchmarks.rag_modes import run_mode
+from benchmarks.vector_indexes import synthetic_corpus
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_store(tmp_path, name):
+    folder = tmp_path / name
+    folder.mkdir()
+    (folder / "vectors.npy").write_bytes(b"v1")
+    return str(folder)
+
+
+def test_hits_need_the_similarity_threshold(tmp_path):
+    store = make_store(tmp_path, "faiss_index_session_a")
+    cache = SemanticResponseCache(threshold=0.9)
+    cache.put([store], None, unit(1, 0), "forty-two")
+    assert cache.get([store], None, unit(1, 0.1)) == "forty-two"  # cosine 0.995
+    assert cache.get([store], None, unit(1, 1)) is None  # cosine 0.707
+    # The file filter and the RAG mode are part of the key
+    assert cache.get([store], ["source-1"], unit(1, 0)) is None
+    assert cache.get([store], None, unit(1, 0), "two_pass") is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    store = make_store(tmp_path, "faiss_index_session_a")
+    cache = SemanticResponseCache(ttl=0.05)
+    cache.put([store], None, unit(1, 0), "forty-two")
+    assert cache.get([store], None, unit(1, 0)) == "forty-two"
+    time.sleep(0.1)
+    assert cache.get([store], None, unit(1, 0)) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted_across_store_sets(tmp_path):
+    a, b = make_store(tmp_path, "faiss_index_session_a"), make_store(tmp_path, "faiss_index_session_b")
+    cache = SemanticResponseCache(max_entries=2)
+    cache.put([a], None, unit(1, 0), "a1")
+    cache.put([b], None, unit(1, 0), "b1")
+    assert cache.get([a], None, unit(1, 0)) == "a1"
+    cache.put([a, b], None, unit(1, 0), "ab")
+    # b1 was used least recently, whichever store set it belongs to
+    assert cache.get([b], None, unit(1, 0)) is None
+    assert cache.get([a], None, unit(1, 0)) == "a1"
+    assert cache.get([b, a], None, unit(1, 0)) == "ab"
+    assert cache.evictions == 1
+
+
+def test_appending_to_a_store_invalidates_its_answers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = VectorStoreManager(cache=VectorStoreCache(), embeddings=FakeEmbeddings(dim=16))
+    texts, _ = synthetic_corpus(100, 0)
+    folder = manager.add_to_session_store(texts[:50], "a", "first", "source-1")
+    other = manager.add_to_session_store(texts[:50], "b", "first", "source-1")
+    cache = SemanticResponseCache()
+    cache.put([folder], None, unit(1, 0), "before")
+    cache.put([other], None, unit(1, 0), "other")
+
+    manager.add_to_session_store(texts[50:], "a", "second", "source-2")
+    assert cache.get([folder], None, unit(1, 0)) is None
+    assert cache.invalidations == 1
+    assert cache.get([other], None, unit(1, 0)) == "other"
+
+
+def test_rag_modes_do_not_share_answers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runtime = AgentRuntime(llm=FakeChatModel(), embeddings=FakeEmbeddings(dim=16), db_name=str(tmp_path / "agent.db"))
+    texts, _ = synthetic_corpus(200, 0)
+    folder = runtime.vector_store_manager.add_to_session_store(texts, "a", "corpus", "corpus")
+
+    single, two_pass = Agent("single", "single_pass", runtime), Agent("two", "two_pass", runtime)
+    single.interact_with_agent("what is the total?", "thread-1", [folder])
+    two_pass.interact_with_agent("what is the total?", "thread-2", [folder])
+    assert runtime.response_cache.hits == 0
+    two_pass.interact_with_agent("what is the total?", "thread-3", [folder])
+    assert runtime.response_cache.hits == 1
+
+    # The mode benchmark answers every turn with the model, in both modes
+    results = {mode: run_mode(mode, folder, ["what is the total?"], 2, runtime) for mode in ("single_pass", "two_pass")}
+    assert results["single_pass"]["llm_calls_per_turn"] == 1
+    assert results["two_pass"]["llm_calls_per_turn"] == 2
@@ -0,0 +1,52 @@
+import time
+import asyncio
+import pytest
+from chat_Unstructured import VectorStoreCache, VectorStoreManager
+from fakes import FakeEmbeddings
+from retrieval import HybridRetriever
+from benchmarks.vector_indexes import synthetic_corpus
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = VectorStoreManager(cache=VectorStoreCache(), embeddings=FakeEmbeddings(dim=16))
+    texts, queries = synthetic_corpus(600, 10, topics=20)
+    folders = [
+        manager.add_to_session_store(texts[i::3], f"session_{i}", f"part {i}", f"source-{i}") for i in range(3)
+    ]
+    return manager, folders, queries
+
+
+def test_aretrieve_matches_retrieve(stores):
+    manager, folders, queries = stores
+    retriever = HybridRetriever(manager)
+    for query in queries + ["w3 w17 invoice"]:
+        expected = retriever.retrieve(folders, query)
+        found = asyncio.run(retriever.aretrieve(folders, query))
+        assert [doc.page_content for doc in found] == [doc.page_content for doc in expected]
+        assert found
+    filtered = asyncio.run(retriever.aretrieve(folders, queries[0], source_ids=["source-1"]))
+    assert {doc.metadata["source_id"] for doc in filtered} == {"source-1"}
+
+
+def test_aretrieve_searches_stores_concurrently(stores, monkeypatch):
+    manager, folders, queries = stores
+    retriever = HybridRetriever(manager)
+    vector_search, keyword_search = retriever._vector_search, retriever._keyword_search
+
+    def slow(search):
+        def run(*args):
+            time.sleep(0.2)
+            return search(*args)
+        return run
+
+    monkeypatch.setattr(retriever, "_vector_search", slow(vector_search))
+    monkeypatch.setattr(retriever, "_keyword_search", slow(keyword_search))
+    for folder in folders:
+        manager.load_vector_store(folder)
+
+    start = time.perf_counter()
+    assert asyncio.run(retriever.aretrieve(folders, queries[0]))
+    # Six searches of 0.2 s each; run one after another they would take 1.2 s
+    assert time.perf_counter() - start < 0.6
@@ -0,0 +1,166 @@
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from agent import Agent, AgentRuntime
+from fakes import FakeChatModel, FakeEmbeddings
+from ingest_jobs import IngestionQueue
+from server import AdmissionControl, AgentServer
+
+
+@pytest.fixture
+def make_server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def make(latency=0.3, **kwargs):
+        db_name = str(tmp_path / "agent.db")
+        runtime = AgentRuntime(llm=FakeChatModel(latency=latency), embeddings=FakeEmbeddings(dim=16), db_name=db_name)
+        queue = IngestionQueue(runtime.vector_store_manager, runtime.embedding_manager, db_name=db_name, workers=1)
+        return AgentServer(runtime, ingestion_queue=queue, upload_dir=str(tmp_path / "uploads"), **kwargs)
+
+    return make
+
+
+async def wait_for(condition, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+def run_with_client(server, test):
+    async def run():
+        async with TestClient(TestServer(server.build_app())) as client:
+            return await test(client)
+
+    return asyncio.run(run())
+
+
+def test_admission_rejects_beyond_limits(make_server):
+    server = make_server(admission=AdmissionControl(max_active=1, max_queued=1, max_per_thread=1))
+
+    async def test(client):
+        running = asyncio.create_task(client.post("/sessions/a/turns", json={"message": "first"}))
+        await wait_for(lambda: server.admission.active == 1)
+        queued = asyncio.create_task(client.post("/sessions/b/turns", json={"message": "second"}))
+        await wait_for(lambda: server.admission.waiting == 1)
+
+        same_thread = await client.post("/sessions/a/turns", json={"message": "again"})
+        assert same_thread.status == 429
+        assert (await same_thread.json())["reason"] == "thread"
+        full = await client.post("/sessions/c/turns", json={"message": "third"})
+        assert full.status == 429
+        assert (await full.json())["reason"] == "server"
+        assert int(full.headers["Retry-After"]) >= 1
+
+        for response in await asyncio.gather(running, queued):
+            assert response.status == 200
+            assert (await response.json())["output_text"]
+        assert server.admission.active == server.admission.waiting == 0
+
+    run_with_client(server, test)
+
+
+def test_drain_finishes_running_turns_and_rejects_new_ones(make_server):
+    server = make_server(drain_timeout=5)
+
+    async def test(client):
+        running = asyncio.create_task(client.post("/sessions/a/turns", json={"message": "first"}))
+        await wait_for(lambda: server.admission.active == 1)
+        drain = asyncio.create_task(server.drain(None))
+        await wait_for(lambda: server.draining)
+
+        rejected = await client.post("/sessions/b/turns", json={"message": "late"})
+        assert rejected.status == 503
+        assert rejected.headers["Retry-After"] == "5"
+        response = await running
+        assert response.status == 200
+        await drain
+
+    run_with_client(server, test)
+
+
+def test_drain_timeout_cancels_turns(make_server):
+    server = make_server(latency=5, drain_timeout=0.1)
+
+    async def test(client):
+        running = asyncio.create_task(client.post("/sessions/a/turns", json={"message": "slow"}))
+        await wait_for(lambda: server.admission.active == 1)
+        await server.drain(None)
+        response = await running
+        assert response.status == 503
+        assert "Retry-After" in response.headers
+
+    run_with_client(server, test)
+
+
+def test_malformed_turns_are_rejected(make_server):
+    server = make_server(latency=0)
+
+    async def test(client):
+        bad_json = await client.post("/sessions/a/turns", data="{not json", headers={"Content-Type": "application/json"})
+        assert bad_json.status == 400
+        no_message = await client.post("/sessions/a/turns", json={"text": "hi"})
+        assert no_message.status == 400
+        bad_mode = await client.post("/sessions/a/turns", json={"message": "hi", "rag_mode": "three_pass"})
+        assert bad_mode.status == 400
+        bad_thread = await client.post("/sessions/a%20b/turns", json={"message": "hi"})
+        assert bad_thread.status == 400
+        bad_upload = await client.post("/sessions/..%2Ftmp/documents", json={"url": "http://example.com"})
+        assert bad_upload.status in (400, 404)
+        bad_url = await client.post("/sessions/a/documents", json={"url": "file:///etc/passwd"})
+        assert bad_url.status == 400
+        assert server.admission.active == server.admission.waiting == 0
+
+    run_with_client(server, test)
+
+
+def test_history_limit_is_validated_and_clamped(make_server):
+    server = make_server(latency=0)
+    for i in range(3):
+        server.runtime.db_handler.store_conversation("a", "human", f"message {i}")
+
+    async def test(client):
+        for limit in ("ten", "0", "-5"):
+            response = await client.get("/sessions/a/history", params={"limit": limit})
+            assert response.status == 400
+        response = await client.get("/sessions/a/history", params={"limit": "2"})
+        assert [row["content"] for row in await response.json()] == ["message 1", "message 2"]
+        response = await client.get("/sessions/a/history", params={"limit": str(10 ** 12)})
+        assert len(await response.json()) == 3
+
+    run_with_client(server, test)
+
+
+def test_jobs_are_cancelled_through_their_own_thread(make_server):
+    server = make_server(latency=0)
+
+    async def test(client):
+        job_id = await asyncio.to_thread(server.ingestion_queue.submit, "a", "bill.csv", "source-1", path="missing.csv")
+        assert (await client.delete(f"/sessions/b/jobs/{job_id}")).status == 404
+        assert (await client.delete("/sessions/a/jobs/no-such-job")).status == 404
+        assert (await client.delete(f"/sessions/a/jobs/{job_id}")).status == 200
+
+    run_with_client(server, test)
+
+
+def test_turns_search_the_registered_stores_only(make_server, monkeypatch):
+    server = make_server(latency=0)
+    server.ingestion_queue.documents.put("a", "report.pdf", "source-1", "hash", "store_a", 3)
+    calls = []
+    interact_with_agent = Agent.ainteract_with_agent
+
+    async def interact(self, message, thread_id, vector_stores=None, source_ids=None):
+        calls.append((thread_id, vector_stores, source_ids))
+        return await interact_with_agent(self, message, thread_id, None, None)
+
+    monkeypatch.setattr(Agent, "ainteract_with_agent", interact)
+
+    async def test(client):
+        response = await client.post("/sessions/a/turns", json={"message": "hi", "vector_stores": ["/etc/legacy"]})
+        assert response.status == 200
+        response = await client.post("/sessions/b/turns", json={"message": "hi", "source_ids": ["source-1"]})
+        assert response.status == 200
+
+    run_with_client(server, test)
+    assert calls == [("a", ["store_a"], None), ("b", None, ["source-1"])]
@@ -0,0 +1,121 @@
+import time
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.tools import tool
+from tool_executor import ToolExecutor, ToolRegistry
+import tools
+
+calls = []
+
+
+@tool
+def slow_echo(text: str, seconds: float) -> str:
+    """Return the text after sleeping."""
+    calls.append(text)
+    time.sleep(seconds)
+    return text
+
+
+@tool
+def square(x: int) -> int:
+    """Square a number."""
+    calls.append(x)
+    return x * x
+
+
+@tool
+def divide(a: int, b: int) -> float:
+    """Divide a by b."""
+    return a / b
+
+
+@pytest.fixture
+def executor():
+    calls.clear()
+    tool_registry = ToolRegistry(default_timeout=5)
+    tool_registry.register(slow_echo)
+    tool_registry.register(square, pure=True)
+    tool_registry.register(divide)
+    tool_registry.register(tools.add, process=True)
+    yield ToolExecutor(tool_registry, memo_size=2)
+    tool_registry.shutdown()
+
+
+def ai_calls(*calls):
+    return {"messages": [AIMessage(content="", tool_calls=[
+        {"name": name, "args": args, "id": f"call_{i}"} for i, (name, args) in enumerate(calls)
+    ])]}
+
+
+def timed_run(executor, state, use_async):
+    """Return the tool messages and the seconds the executor took to return them."""
+    async def arun():
+        start = time.perf_counter()
+        messages = (await executor.ainvoke(state))["messages"]
+        return messages, time.perf_counter() - start
+
+    if use_async:
+        # asyncio.run also waits for threads of timed-out calls, so time the call itself
+        return asyncio.run(arun())
+    start = time.perf_counter()
+    messages = executor(state)["messages"]
+    return messages, time.perf_counter() - start
+
+
+def run(executor, state, use_async):
+    return timed_run(executor, state, use_async)[0]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_a_batch_of_calls_runs_concurrently(executor, use_async):
+    messages, seconds = timed_run(
+        executor, ai_calls(*[("slow_echo", {"text": str(i), "seconds": 0.2}) for i in range(4)]), use_async
+    )
+    assert seconds < 0.6
+    # Results keep the order of the calls
+    assert [(m.content, m.tool_call_id, m.status) for m in messages] == [
+        (str(i), f"call_{i}", "success") for i in range(4)
+    ]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_slow_calls_time_out(executor, use_async):
+    executor.registry.register(slow_echo, timeout=0.1)
+    (slow, fast), seconds = timed_run(
+        executor, ai_calls(("slow_echo", {"text": "late", "seconds": 1}), ("square", {"x": 3})), use_async
+    )
+    assert seconds < 0.5
+    assert slow.status == "error" and "did not finish within 0.1 seconds" in slow.content
+    assert (fast.content, fast.status) == ("9", "success")
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_pure_tools_are_memoized(executor, use_async):
+    for x in (2, 3, 2, 4, 2, 3):
+        (message,) = run(executor, ai_calls(("square", {"x": x})), use_async)
+        assert message.content == str(x * x)
+    # 3 was evicted by 4 (memo_size=2) while 2 stayed in use
+    assert calls == [2, 3, 4, 3]
+
+    # Tools not registered as pure run every time
+    echo = ("slow_echo", {"text": "a", "seconds": 0})
+    run(executor, ai_calls(echo, echo), use_async)
+    assert calls[-2:] == ["a", "a"]
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_errors_become_tool_messages(executor, use_async):
+    state = ai_calls(("multiply", {"a": 1}), ("divide", {"a": 1, "b": 0}), ("divide", {"a": 1, "b": 2}))
+    unknown, failed, ok = run(executor, state, use_async)
+    assert unknown.status == "error" and unknown.tool_call_id == "call_0"
+    assert unknown.content == "Error: multiply is not a valid tool, try one of [slow_echo, square, divide, add]."
+    assert failed.status == "error" and "ZeroDivisionError" in failed.content
+    assert (ok.content, ok.status) == ("0.5", "success")
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_process_tools_run_in_the_pool(executor, use_async):
+    (message,) = run(executor, ai_calls(("add", {"a": 2, "b": 3})), use_async)
+    assert (message.content, message.status) == ("5", "success")
+    assert executor.registry._process_pool is not None
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from chat_Unstructured import VectorStoreManager
+from fakes import FakeEmbeddings
+from vector_index import FaissIndexFactory
+from vector_storage import INDEX_FILE, VECTORS_FILE, LegacyStoreError, load_store, migrate_legacy_stores
+
+
+def test_legacy_stores_are_only_converted_by_the_migration(tmp_path):
+    embeddings = FakeEmbeddings(dim=16)
+    texts = ["invoice total 42.00", "due on 01/15/2024", "paid by card"]
+    for name in ("faiss_index_session_a", "uploaded_folder"):
+        FAISS.from_texts(texts, embeddings).save_local(str(tmp_path / name))
+
+    with pytest.raises(LegacyStoreError):
+        load_store(str(tmp_path / "faiss_index_session_a"), embeddings)
+    assert not (tmp_path / "faiss_index_session_a" / "docstore.db").exists()
+
+    assert migrate_legacy_stores(embeddings, str(tmp_path)) == ["faiss_index_session_a"]
+    store = load_store(str(tmp_path / "faiss_index_session_a"), embeddings)
+    assert [doc.page_content for doc in store.similarity_search(texts[1], k=1)] == [texts[1]]
+    # Folders the app did not name are left alone
+    assert (tmp_path / "uploaded_folder" / "index.pkl").exists()
+    assert migrate_legacy_stores(embeddings, str(tmp_path)) == []
+
+
+def test_flat_stores_are_appended_in_place(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    embeddings = FakeEmbeddings(dim=16)
+    manager = VectorStoreManager(embeddings=embeddings)
+    texts = [f"invoice INV-{i:04d} total {i}.00" for i in range(100)]
+    folder = manager.add_to_session_store(texts[:50], "s", "a.txt", "a")
+    path = os.path.join(folder, VECTORS_FILE)
+    inode = os.stat(path).st_ino
+    reader = manager.load_vector_store(folder)
+    # Bytes past the saved rows, as an interrupted append leaves them
+    with open(path, "ab") as f:
+        f.write(b"\0" * 100)
+
+    manager.add_to_session_store(texts[50:], "s", "a.txt", "a", first_chunk=50)
+    assert os.stat(path).st_ino == inode
+    vectors = np.load(path)
+    np.testing.assert_array_equal(vectors, np.array(embeddings.embed_documents(texts), dtype=np.float32))
+    # The leftover bytes were overwritten and cut off
+    assert os.path.getsize(path) == np.load(path, mmap_mode="r").offset + vectors.nbytes
+    # Readers keep searching the rows they mapped
+    assert reader.index.ntotal == 50
+    assert reader.similarity_search(texts[10], k=1)[0].page_content == texts[10]
+    store = manager.load_vector_store(folder)
+    assert store.index.ntotal == 100
+    assert store.similarity_search(texts[75], k=1)[0].page_content == texts[75]
+    assert store.docstore.count_source("a") == 100
+
+
+def test_appended_flat_stores_grow_into_a_trained_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    factory = FaissIndexFactory("ivf_flat", nlist=2, min_train_size=64, train_size=64)
+    manager = VectorStoreManager(embeddings=FakeEmbeddings(dim=16), index_factory=factory)
+    texts = [f"invoice INV-{i:04d} total {i}.00" for i in range(80)]
+    folder = manager.add_to_session_store(texts[:40], "s", "a.txt", "a")
+    assert os.path.exists(os.path.join(folder, VECTORS_FILE))
+
+    manager.add_to_session_store(texts[40:], "s", "a.txt", "a", first_chunk=40)
+    assert os.path.exists(os.path.join(folder, INDEX_FILE))
+    assert not os.path.exists(os.path.join(folder, VECTORS_FILE))
+    store = manager.load_vector_store(folder)
+    assert store.index.ntotal == 80
+    assert store.similarity_search(texts[60], k=1)[0].page_content == texts[60]
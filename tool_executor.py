@@ -0,0 +1,206 @@
+import json
+import time
+import asyncio
+import importlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from langchain_core.messages import AIMessage, ToolMessage
+from metrics import registry, timed
+
+# Same wording as LangGraph's ToolNode, so the model sees familiar error messages
+INVALID_TOOL_TEMPLATE = "Error: {name} is not a valid tool, try one of [{available}]."
+TOOL_ERROR_TEMPLATE = "Error: {error}\n Please fix your mistakes."
+
+
+class ToolSpec:
+    """How the executor runs one tool."""
+
+    def __init__(self, tool, pure=False, timeout=None, process=False):
+        self.tool = tool
+        self.name = tool.name
+        # Same arguments, same result: the executor memoizes the output
+        self.pure = pure
+        self.timeout = timeout
+        # CPU-heavy tools run in the process pool; the child imports the tool by module and name
+        self.process = process
+        self.path = (tool.func.__module__, tool.func.__name__) if process else None
+
+
+def _run_in_process(module, name, args):
+    tool = getattr(importlib.import_module(module), name)
+    return tool.invoke(args)
+
+
+class ToolRegistry:
+    """Tools available to the agent and how each one is executed."""
+
+    def __init__(self, default_timeout=30.0, process_workers=None):
+        self.default_timeout = default_timeout
+        self.process_workers = process_workers
+        self.specs = {}
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    def register(self, tool, pure=False, timeout=None, process=False):
+        self.specs[tool.name] = ToolSpec(tool, pure=pure, timeout=timeout, process=process)
+        return tool
+
+    @property
+    def tools(self):
+        return [spec.tool for spec in self.specs.values()]
+
+    def get(self, name):
+        return self.specs.get(name)
+
+    def timeout(self, spec):
+        return spec.timeout if spec.timeout is not None else self.default_timeout
+
+    def process_pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._process_pool
+
+    def shutdown(self):
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+                self._process_pool = None
+
+
+class ToolExecutor:
+    """Graph node that runs every tool call of the last AI message concurrently.
+
+    Each call gets its tool's timeout; a failing or slow call becomes an error
+    ToolMessage instead of failing the turn. Results of pure tools are kept in
+    an LRU memo, and tools registered with ``process=True`` run in a process pool.
+    """
+
+    def __init__(self, tool_registry, max_workers=8, memo_size=1024):
+        self.registry = tool_registry
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def __call__(self, state, config=None):
+        calls = self._tool_calls(state)
+        started = time.monotonic()
+        # Each worker gets a copy of the context so tool stages land in the turn's trace
+        futures = [
+            self._threads.submit(contextvars.copy_context().run, self._run_one, call, config) for call in calls
+        ]
+        messages = []
+        for call, future in zip(calls, futures):
+            spec = self.registry.get(call["name"])
+            # Timeouts count from the start of the batch
+            timeout = None if spec is None else max(0.0, started + self.registry.timeout(spec) - time.monotonic())
+            try:
+                messages.append(future.result(timeout=timeout))
+            except FutureTimeoutError:
+                # The thread keeps running, but the turn does not wait for it
+                messages.append(self._timeout_message(call, spec))
+        return {"messages": messages}
+
+    async def ainvoke(self, state, config=None):
+        calls = self._tool_calls(state)
+        messages = await asyncio.gather(*(self._arun_one(call, config) for call in calls))
+        return {"messages": list(messages)}
+
+    def _tool_calls(self, state):
+        message = state["messages"][-1]
+        if not isinstance(message, AIMessage):
+            raise ValueError("Last message is not an AIMessage")
+        registry.increment("tool.batch_calls", len(message.tool_calls))
+        return message.tool_calls
+
+    def _run_one(self, call, config):
+        spec = self.registry.get(call["name"])
+        if spec is None:
+            return self._invalid_message(call)
+        key = self._memo_key(spec, call)
+        found, content = self._memo_get(key)
+        if found:
+            return self._message(call, content)
+        try:
+            if spec.process:
+                future = self.registry.process_pool().submit(_run_in_process, *spec.path, call["args"])
+                with timed(f"tool.{spec.name}", process=True):
+                    output = future.result(timeout=self.registry.timeout(spec))
+            else:
+                output = spec.tool.invoke(call["args"], config)
+        except FutureTimeoutError:
+            return self._timeout_message(call, spec)
+        except Exception as e:
+            return self._error_message(call, e)
+        return self._message(call, self._memo_put(key, output))
+
+    async def _arun_one(self, call, config):
+        spec = self.registry.get(call["name"])
+        if spec is None:
+            return self._invalid_message(call)
+        key = self._memo_key(spec, call)
+        found, content = self._memo_get(key)
+        if found:
+            return self._message(call, content)
+        try:
+            if spec.process:
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(self.registry.process_pool(), _run_in_process, *spec.path, call["args"])
+                with timed(f"tool.{spec.name}", process=True):
+                    output = await asyncio.wait_for(future, self.registry.timeout(spec))
+            else:
+                output = await asyncio.wait_for(spec.tool.ainvoke(call["args"], config), self.registry.timeout(spec))
+        except asyncio.TimeoutError:
+            return self._timeout_message(call, spec)
+        except Exception as e:
+            return self._error_message(call, e)
+        return self._message(call, self._memo_put(key, output))
+
+    def _memo_key(self, spec, call):
+        if not spec.pure or not self.memo_size:
+            return None
+        try:
+            return spec.name, json.dumps(call["args"], sort_keys=True)
+        except TypeError:
+            return None
+
+    def _memo_get(self, key):
+        if key is None:
+            return False, None
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                registry.increment("tool.memo_hits")
+                return True, self._memo[key]
+        registry.increment("tool.memo_misses")
+        return False, None
+
+    def _memo_put(self, key, output):
+        content = output if isinstance(output, str) else json.dumps(output, default=str)
+        if key is not None:
+            with self._memo_lock:
+                self._memo[key] = content
+                self._memo.move_to_end(key)
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        return content
+
+    @staticmethod
+    def _message(call, content, status="success"):
+        return ToolMessage(content, name=call["name"], tool_call_id=call["id"], status=status)
+
+    def _invalid_message(self, call):
+        content = INVALID_TOOL_TEMPLATE.format(name=call["name"], available=", ".join(self.registry.specs))
+        return self._message(call, content, status="error")
+
+    def _error_message(self, call, error):
+        registry.increment("tool.errors")
+        return self._message(call, TOOL_ERROR_TEMPLATE.format(error=repr(error)), status="error")
+
+    def _timeout_message(self, call, spec):
+        registry.increment("tool.timeouts")
+        error = f"{call['name']} did not finish within {self.registry.timeout(spec)} seconds"
+        return self._message(call, TOOL_ERROR_TEMPLATE.format(error=error), status="error")
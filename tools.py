@@ -1,5 +1,7 @@
 # tools.py
+import os
 from langchain_core.tools import tool
+from tool_executor import ToolRegistry
 
 @tool
 def add(a: int, b: int) -> int:
@@ -10,3 +12,12 @@ def add(a: int, b: int) -> int:
 def subtract(a: int, b: int) -> int:
     """Subtract the second number from the first number."""
     return a - b
+
+# Tools the agent can call and how the executor runs them (TOOL_TIMEOUT seconds per call by default).
+# Register pure tools with pure=True to memoize them and CPU-heavy ones with process=True.
+tool_registry = ToolRegistry(
+    default_timeout=float(os.getenv("TOOL_TIMEOUT", 30)),
+    process_workers=int(os.getenv("TOOL_PROCESS_WORKERS", 0)) or None,
+)
+tool_registry.register(add, pure=True)
+tool_registry.register(subtract, pure=True)
@@ -0,0 +1,124 @@
+import os
+import faiss
+import numpy as np
+from vector_storage import AppendableFlatIndex
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+class FaissIndexFactory:
+    """Builds and tunes the FAISS index behind a vector store.
+
+    - "flat": exact brute-force L2 search (LangChain's default)
+    - "ivf_flat": inverted lists over k-means cells; ``nprobe`` cells are scanned per query
+    - "ivf_pq": IVF with product-quantized vectors, for corpora that must fit in less memory
+    - "hnsw": graph index, no training; ``ef_search`` trades latency for recall
+
+    Every type uses L2 distance so scores stay comparable across stores. Trained
+    types need at least ``min_train_size`` vectors (more for PQ); smaller stores
+    stay flat, which is exact and fast at that size, and are rebuilt once they grow.
+    """
+
+    def __init__(self, index_type="flat", nlist=None, nprobe=16, pq_m=64, pq_nbits=8,
+                 hnsw_m=32, ef_construction=80, ef_search=64, train_size=20000, min_train_size=5000):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.train_size = train_size
+        self.min_train_size = min_train_size
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            index_type=os.getenv("VECTOR_INDEX_TYPE", "flat"),
+            nlist=int(os.getenv("VECTOR_INDEX_NLIST", 0)) or None,
+            nprobe=int(os.getenv("VECTOR_INDEX_NPROBE", 16)),
+            pq_m=int(os.getenv("VECTOR_INDEX_PQ_M", 64)),
+            hnsw_m=int(os.getenv("VECTOR_INDEX_HNSW_M", 32)),
+            ef_search=int(os.getenv("VECTOR_INDEX_EF_SEARCH", 64)),
+            min_train_size=int(os.getenv("VECTOR_INDEX_MIN_TRAIN_SIZE", 5000)),
+        )
+
+    @property
+    def needs_training(self):
+        return self.index_type in ("ivf_flat", "ivf_pq")
+
+    @property
+    def required_training_points(self):
+        if self.index_type == "ivf_pq":
+            # k-means wants ~39 points per PQ centroid
+            return max(self.min_train_size, 39 * 2 ** self.pq_nbits)
+        return self.min_train_size
+
+    def build(self, vectors):
+        """Return an empty index for ``vectors``' dimension, trained on a sample of them if needed."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        count, dim = vectors.shape
+        index_type = self.index_type
+        if self.needs_training and count < self.required_training_points:
+            index_type = "flat"
+
+        if index_type == "flat":
+            index = faiss.IndexFlatL2(dim)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            # Rule of thumb: about sqrt(n) cells, each with enough points for k-means to train
+            nlist = self.nlist or int(4 * np.sqrt(count))
+            nlist = max(1, min(nlist, count // 39))
+            quantizer = faiss.IndexFlatL2(dim)
+            if index_type == "ivf_flat":
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+            else:
+                index = faiss.IndexIVFPQ(quantizer, dim, nlist, self._pq_subquantizers(dim), self.pq_nbits)
+            # The quantizer must outlive this function along with the index
+            index.own_fields = True
+            quantizer.this.disown()
+            index.train(self._training_sample(vectors))
+
+        self.configure(index)
+        return index
+
+    def configure(self, index):
+        """Apply the query-time knobs; they are not tied to how the index was built."""
+        if hasattr(index, "nprobe"):
+            index.nprobe = min(self.nprobe, index.nlist)
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = self.ef_search
+        return index
+
+    def needs_rebuild(self, index):
+        """True when a store that started flat has grown enough for the configured type."""
+        return (
+            self.index_type != "flat"
+            and isinstance(index, (faiss.IndexFlat, AppendableFlatIndex))
+            and index.ntotal >= self.required_training_points
+        )
+
+    def rebuild(self, index):
+        """Return a new index of the configured type holding the same vectors in the same order."""
+        vectors = index.reconstruct_n(0, index.ntotal)
+        new_index = self.build(vectors)
+        new_index.add(vectors)
+        return new_index
+
+    def _training_sample(self, vectors):
+        if len(vectors) <= self.train_size:
+            return vectors
+        rng = np.random.default_rng(0)
+        return vectors[rng.choice(len(vectors), self.train_size, replace=False)]
+
+    def _pq_subquantizers(self, dim):
+        # The vector dimension must split evenly into sub-quantizers
+        m = min(self.pq_m, dim)
+        while dim % m:
+            m -= 1
+        return m
@@ -0,0 +1,486 @@
+import io
+import os
+import re
+import sys
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+# Every vector store folder the app writes starts with this
+STORE_PREFIX = "faiss_index_"
+# On-disk layout of a vector store folder
+INDEX_FILE = "index.faiss"      # trained/graph indexes (IVF, HNSW), FAISS's own format
+VECTORS_FILE = "vectors.npy"    # flat indexes, a raw (n, d) float32 array
+DOCSTORE_FILE = "docstore.db"   # chunk texts and metadata, keyed by index position
+LEGACY_DOCSTORE_FILE = "index.pkl"
+# Files that only exist while a store is being written
+TMP_PREFIX = "tmp_"
+TRANSIENT_SUFFIXES = ("-journal", "-wal", "-shm")
+SWAP_SUFFIXES = (".new", ".old")  # sibling folders used by replace_store
+
+
+class LegacyStoreError(Exception):
+    """A store folder is still in the old pickle format and has to be migrated first."""
+
+
+def is_transient(name):
+    return name.startswith(TMP_PREFIX) or name.endswith(TRANSIENT_SUFFIXES)
+
+
+def chunk_hash(text):
+    # Stored in each chunk's metadata; re-ingestion diffs sources by it
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Words, keeping identifiers like INV-2024-001, 1,234.56 or 01/02/2024 together
+QUERY_TERM_PATTERN = re.compile(r"\w+(?:[.,:/-]\w+)*")
+
+
+class SqliteDocstore(Docstore, AddableMixin):
+    """Chunk texts and metadata in an indexed SQLite sidecar, read only for search hits.
+
+    Added documents are held in memory until flush(), which the store's save
+    calls before the index file is replaced, so a failed ingestion leaves the
+    sidecar consistent with the index on disk. An FTS5 table over the chunk text,
+    kept in sync by triggers, serves BM25 keyword search.
+    """
+
+    def __init__(self, path, count=0):
+        self.path = path
+        self.count = count
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            position INTEGER PRIMARY KEY,
+            doc_id TEXT NOT NULL,
+            content TEXT,
+            metadata TEXT
+        )
+        """)
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_doc_id ON chunks (doc_id)")
+        has_fts = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'"
+        ).fetchone()
+        if not has_fts:
+            self._conn.executescript("""
+            BEGIN;
+            CREATE VIRTUAL TABLE chunks_fts USING fts5 (content, content = 'chunks', content_rowid = 'position');
+            CREATE TRIGGER chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.position, new.content);
+            END;
+            CREATE TRIGGER chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.position, old.content);
+            END;
+            -- Index whatever the sidecar already holds
+            INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild');
+            COMMIT;
+            """)
+        self._conn.commit()
+        self._pending = {}            # {doc_id: Document}
+        self._pending_positions = {}  # {position: doc_id}
+        self.ids = ChunkIds(self)
+
+    def add(self, texts):
+        self._pending.update(texts)
+
+    def search(self, search):
+        if search in self._pending:
+            return self._pending[search]
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, metadata FROM chunks WHERE doc_id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def doc_id(self, position):
+        if position in self._pending_positions:
+            return self._pending_positions[position]
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT doc_id FROM chunks WHERE position = ? AND position < ?", (position, self.count)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def flush(self):
+        rows = []
+        for position, doc_id in sorted(self._pending_positions.items()):
+            doc = self._pending[doc_id]
+            rows.append((position, doc_id, doc.page_content, json.dumps(doc.metadata)))
+        with self._lock:
+            # Rows past the saved count are leftovers of an interrupted save; replace them
+            self._conn.execute("DELETE FROM chunks WHERE position >= ?", (self.count,))
+            self._conn.executemany(
+                "INSERT INTO chunks (position, doc_id, content, metadata) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        self.count += len(rows)
+        self._pending.clear()
+        self._pending_positions.clear()
+
+    def keyword_search(self, query, k=20, source_ids=None):
+        """Return [(position, bm25 score)] for saved chunks, best first (lower scores are better)."""
+        # Each query word becomes an FTS phrase, so "INV-2024-001" matches its tokens in order
+        terms = dict.fromkeys(QUERY_TERM_PATTERN.findall(query))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        sql = """
+        SELECT chunks.position, bm25(chunks_fts) AS score
+        FROM chunks_fts JOIN chunks ON chunks.position = chunks_fts.rowid
+        WHERE chunks_fts MATCH ? AND chunks.position < ?
+        """
+        params = [match, self.count]
+        if source_ids:
+            sql += f" AND json_extract(chunks.metadata, '$.source_id') IN ({','.join('?' * len(source_ids))})"
+            params.extend(source_ids)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(k)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def count_source(self, source_id):
+        """Number of saved chunks from one source; ingestion resumes after them."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chunks WHERE position < ? AND json_extract(metadata, '$.source_id') = ?",
+                (self.count, source_id),
+            ).fetchone()[0]
+
+    def source_chunks(self, source_id):
+        """Return [(position, chunk hash)] of one source's saved chunks."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, content, metadata FROM chunks "
+                "WHERE position < ? AND json_extract(metadata, '$.source_id') = ? ORDER BY position",
+                (self.count, source_id),
+            ).fetchall()
+        # Chunks saved before hashes were recorded are hashed from their text
+        return [(position, json.loads(metadata).get("chunk_hash") or chunk_hash(content))
+                for position, content, metadata in rows]
+
+    def get_by_positions(self, positions):
+        """Return {position: Document} for saved chunks."""
+        positions = [int(position) for position in positions if 0 <= position < self.count]
+        if not positions:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT position, content, metadata FROM chunks WHERE position IN ({','.join('?' * len(positions))})",
+                positions,
+            ).fetchall()
+        return {position: Document(page_content=content, metadata=json.loads(metadata))
+                for position, content, metadata in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ChunkIds:
+    """The index_to_docstore_id mapping LangChain's FAISS expects, backed by the sidecar."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __len__(self):
+        return self.docstore.count + len(self.docstore._pending_positions)
+
+    def __getitem__(self, position):
+        return self.docstore.doc_id(int(position))
+
+    def update(self, mapping):
+        self.docstore._pending_positions.update(mapping)
+
+    def items(self):
+        with self.docstore._lock:
+            rows = self.docstore._conn.execute(
+                "SELECT position, doc_id FROM chunks WHERE position < ? ORDER BY position", (self.docstore.count,)
+            ).fetchall()
+        return rows + sorted(self.docstore._pending_positions.items())
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+class MmapFlatIndex:
+    """Read-only exact L2 search over a memory-mapped (n, d) float32 array.
+
+    Opening costs nothing and the pages are shared with every other process that
+    maps the same file; the duck-typed FAISS surface is what LangChain uses to search.
+    """
+
+    is_trained = True
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.ntotal, self.d = vectors.shape
+        self._norms = None
+
+    def search(self, x, k):
+        x = np.asarray(x, dtype=np.float32)
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        top_k = min(k, self.ntotal)
+        if not top_k:
+            return distances, labels
+        if self._norms is None:
+            self._norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+        for row, query in enumerate(x):
+            scores = np.maximum(self._norms - 2 * (self.vectors @ query) + query @ query, 0)
+            top = np.argpartition(scores, top_k - 1)[:top_k]
+            top = top[np.argsort(scores[top])]
+            distances[row, :top_k] = scores[top]
+            labels[row, :top_k] = top
+        return distances, labels
+
+    def reconstruct(self, key):
+        return np.array(self.vectors[key])
+
+    def reconstruct_n(self, start, count):
+        return np.array(self.vectors[start:start + count])
+
+
+class AppendableFlatIndex:
+    """Flat index that can only grow, opened with load_store(..., append=True).
+
+    The saved rows stay memory-mapped and the added ones are buffered, so
+    save_store writes only the new rows past the end of the vectors file instead
+    of rewriting it; an append costs the size of the part, not of the store.
+    """
+
+    is_trained = True
+
+    def __init__(self, vectors):
+        self.saved = vectors
+        self.d = vectors.shape[1]
+        self._added = []
+
+    @property
+    def ntotal(self):
+        return len(self.saved) + sum(len(rows) for rows in self._added)
+
+    def add(self, x):
+        self._added.append(np.ascontiguousarray(x, dtype=np.float32).reshape(-1, self.d))
+
+    def added_rows(self):
+        return np.concatenate(self._added) if self._added else np.empty((0, self.d), dtype=np.float32)
+
+    def reconstruct_n(self, start, count):
+        return np.concatenate([self.saved, self.added_rows()])[start:start + count]
+
+
+def store_exists(folder):
+    _finish_swap(folder)
+    return any(
+        os.path.exists(os.path.join(folder, name))
+        for name in (INDEX_FILE, VECTORS_FILE)
+    )
+
+
+def load_store(folder, embeddings, writable=False, append=False):
+    """Open a vector store folder without unpickling anything.
+
+    Read-only opens memory-map the vectors (flat) or the inverted lists (IVF);
+    ``writable`` loads a private in-memory copy that can be appended to and saved.
+    With ``append`` as well, a flat store is opened as an AppendableFlatIndex
+    instead of being copied; it can be added to but not have chunks removed.
+    Folders in the old pickle format raise LegacyStoreError; see migrate_legacy_stores.
+    """
+    _finish_swap(folder)
+    if not os.path.exists(os.path.join(folder, DOCSTORE_FILE)):
+        if os.path.exists(os.path.join(folder, LEGACY_DOCSTORE_FILE)):
+            raise LegacyStoreError(f"{folder} is in the pickle format, run `python vector_storage.py migrate` first")
+        raise FileNotFoundError(os.path.join(folder, DOCSTORE_FILE))
+
+    index_path = os.path.join(folder, INDEX_FILE)
+    if os.path.exists(index_path):
+        # Memory-mapped IVF lists are read-only, so writers get a regular copy
+        index = faiss.read_index(index_path, 0 if writable else faiss.IO_FLAG_MMAP)
+    else:
+        vectors = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode="r")
+        if writable and append:
+            index = AppendableFlatIndex(vectors)
+        elif writable:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(np.ascontiguousarray(vectors))
+        else:
+            index = MmapFlatIndex(vectors)
+
+    docstore = SqliteDocstore(os.path.join(folder, DOCSTORE_FILE), count=index.ntotal)
+    return FAISS(embeddings, index, docstore, docstore.ids)
+
+
+def save_store(folder, vector_store):
+    """Write ``vector_store`` to ``folder``: the sidecar first, then the index file atomically.
+
+    Replacing the index with a rename keeps readers that still map the old file valid.
+    """
+    os.makedirs(folder, exist_ok=True)
+    if not isinstance(vector_store.docstore, SqliteDocstore):
+        _move_to_sidecar(folder, vector_store)
+    vector_store.docstore.flush()
+
+    index = vector_store.index
+    if isinstance(index, AppendableFlatIndex):
+        if not _append_rows(os.path.join(folder, VECTORS_FILE), index):
+            _replace(folder, VECTORS_FILE, lambda path: np.save(path, index.reconstruct_n(0, index.ntotal)))
+        index.saved = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode="r")
+        index._added = []
+        stale = INDEX_FILE
+    elif isinstance(index, faiss.IndexFlat):
+        vectors = faiss.vector_to_array(index.codes).view(np.float32).reshape(-1, index.d)
+        _replace(folder, VECTORS_FILE, lambda path: np.save(path, vectors))
+        stale = INDEX_FILE
+    else:
+        _replace(folder, INDEX_FILE, lambda path: faiss.write_index(index, path))
+        stale = VECTORS_FILE
+    for name in (stale, LEGACY_DOCSTORE_FILE):
+        if os.path.exists(os.path.join(folder, name)):
+            os.remove(os.path.join(folder, name))
+
+
+def without_positions(vector_store, positions):
+    """Return a new in-memory store holding every chunk except those at ``positions``.
+
+    Vectors are copied out of the index, not re-embedded; a trained index keeps its training.
+    """
+    index = vector_store.index
+    keep = np.setdiff1d(np.arange(index.ntotal), np.fromiter(positions, dtype=np.int64))
+    if isinstance(index, faiss.IndexIVF):
+        # IVF indexes can only look vectors up by position through a direct map
+        index.make_direct_map()
+    vectors = index.reconstruct_n(0, index.ntotal)[keep]
+    new_index = faiss.clone_index(index)
+    new_index.reset()
+
+    new_store = FAISS(vector_store.embedding_function, new_index, InMemoryDocstore(), {})
+    if len(keep):
+        docs = vector_store.docstore.get_by_positions(keep)
+        new_store.add_embeddings(
+            zip([docs[position].page_content for position in keep], vectors),
+            metadatas=[docs[position].metadata for position in keep],
+        )
+    return new_store
+
+
+def replace_store(folder, vector_store):
+    """Save ``vector_store`` as a new copy of ``folder`` and swap the folders.
+
+    Removing chunks renumbers positions, which cannot be done in place while
+    readers map the old files; they keep the old copy until they reload.
+    """
+    new_folder, old_folder = f"{folder}{SWAP_SUFFIXES[0]}", f"{folder}{SWAP_SUFFIXES[1]}"
+    shutil.rmtree(new_folder, ignore_errors=True)
+    save_store(new_folder, vector_store)
+    shutil.rmtree(old_folder, ignore_errors=True)
+    if os.path.exists(folder):
+        os.rename(folder, old_folder)
+    os.rename(new_folder, folder)
+    shutil.rmtree(old_folder, ignore_errors=True)
+
+
+def _finish_swap(folder):
+    # A crash between replace_store's renames leaves only the complete new copy
+    new_folder, old_folder = f"{folder}{SWAP_SUFFIXES[0]}", f"{folder}{SWAP_SUFFIXES[1]}"
+    if not os.path.exists(folder) and os.path.exists(old_folder) and os.path.exists(new_folder):
+        os.rename(new_folder, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+
+def migrate_legacy_stores(embeddings, root="."):
+    """Convert the pickle-format store folders under ``root`` to the current format, offline.
+
+    Converting unpickles index.pkl, so only folders named like the ones this app
+    writes (STORE_PREFIX) are touched; nothing on the serving path does this.
+    Returns the converted folder names.
+    """
+    converted = []
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if not name.startswith(STORE_PREFIX) or name.endswith(SWAP_SUFFIXES) or not os.path.isdir(folder):
+            continue
+        if os.path.exists(os.path.join(folder, DOCSTORE_FILE)) or not os.path.exists(os.path.join(folder, LEGACY_DOCSTORE_FILE)):
+            continue
+        vector_store = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
+        save_store(folder, vector_store)
+        converted.append(name)
+    return converted
+
+
+def _move_to_sidecar(folder, vector_store):
+    path = os.path.join(folder, DOCSTORE_FILE)
+    if os.path.exists(path):
+        # A new store is replacing whatever was in this folder
+        os.remove(path)
+    docstore = SqliteDocstore(path)
+    ids = dict(vector_store.index_to_docstore_id)
+    docstore.add({doc_id: vector_store.docstore.search(doc_id) for doc_id in ids.values()})
+    docstore.ids.update(ids)
+    vector_store.docstore = docstore
+    vector_store.index_to_docstore_id = docstore.ids
+
+
+def _append_rows(path, index):
+    """Write the rows added to ``index`` in place after the saved ones; False if the file has to be rewritten.
+
+    The rows go first and the header with the new shape last, so an interrupted
+    append leaves the file as it was plus ignored bytes past its end. Readers
+    keep mapping the rows they opened, which are never written to.
+    """
+    if not os.path.exists(path):
+        return False
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            read_header, write_header = np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0
+        elif version == (2, 0):
+            read_header, write_header = np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0
+        else:
+            return False
+        shape, fortran_order, dtype = read_header(f)
+        header_size = f.tell()
+        if shape != index.saved.shape or fortran_order or dtype != np.float32:
+            return False
+        header = io.BytesIO()
+        write_header(header, {
+            "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (index.ntotal, index.d),
+        })
+        # The header is padded for the row count to grow; if it no longer fits, rewrite the file
+        if len(header.getvalue()) != header_size:
+            return False
+        f.seek(header_size + index.saved.nbytes)
+        f.write(index.added_rows().tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def _replace(folder, name, write):
+    # Keep the extension: np.save appends .npy to paths without it
+    tmp_path = os.path.join(folder, f"{TMP_PREFIX}{name}")
+    write(tmp_path)
+    os.replace(tmp_path, os.path.join(folder, name))
+
+
+if __name__ == "__main__":
+    # python vector_storage.py migrate [root]
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("usage: python vector_storage.py migrate [root]")
+    from chat_Unstructured import get_embeddings
+    for name in migrate_legacy_stores(get_embeddings(), sys.argv[2] if len(sys.argv) > 2 else "."):
+        print(f"migrated {name}")